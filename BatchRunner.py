@@ -0,0 +1,196 @@
+"""Applies a WIZ template to many data files at once, without opening any windows
+
+Each file is loaded as "Load Raw Data" would load it, used as <ORIGINAL> in the template, and every resulting graph
+is written to <output>/<file name>/<graph name>.npy (or .csv). Files are spread across a pool of processes, and a
+summary of the time spent on each file is printed at the end.
+
+Usage: python BatchRunner.py template.wizt "data/*.txt" [more patterns...] [options]
+"""
+import argparse
+import glob
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from numpy.lib.format import open_memmap
+from MainWindow import MainWindow
+from ExpressionChain import ExpressionChain
+import Graph
+import TemplateFile
+
+__author__ = "Thomas Schweich"
+
+
+def applyTemplate(chain, data, lazy=False):
+    """Evaluates chain using a Graph of data as <ORIGINAL>, returning a list of (result, name) in template order
+
+    With lazy=True, results are only computed (a chunk at a time) as they are written.
+    """
+    original = Graph.Graph(rawXData=data[0], rawYData=data[1])
+    original.setLazy(lazy)
+    chain.addVariable('ORIGINAL', original)
+    chain.modules = (Graph, np, math)
+    chain.blockFunc = Graph.Graph.evaluateBlockwise
+    return list(chain)
+
+
+def saveGraph(graph, path):
+    """Saves the raw data of graph to path in the same formats as GraphWindow.saveData (.npy, or otherwise csv)
+
+    The data is written a chunk at a time, so that lazy Graphs are never computed whole.
+    """
+    if path.endswith(".npy"):
+        dtype = np.result_type(*[getattr(a, 'dtype', np.float64) for a in graph.getRawData()])
+        out = open_memmap(path, mode='w+', dtype=dtype, shape=(2, len(graph)))
+        start = 0
+        for x, y in graph.iterRawChunks():
+            out[0, start:start + len(x)] = x
+            out[1, start:start + len(y)] = y
+            start += len(x)
+        out.flush()
+        del out
+    else:
+        with open(path, 'w') as f:
+            for x, y in graph.iterRawChunks():
+                np.savetxt(f, np.dstack((x, y))[0], delimiter=",")
+
+
+def outputPaths(names, directory, extension):
+    """Returns a file path in directory for each graph name, replacing unsafe characters and avoiding duplicates"""
+    paths = []
+    for i, name in enumerate(names):
+        safe = re.sub(r'[^\w\-. ()]', '_', name).strip() or "Result %d" % (i + 1)
+        path = os.path.join(directory, safe + extension)
+        n = 1
+        while path in paths:
+            path = os.path.join(directory, "%s (%d)%s" % (safe, n, extension))
+            n += 1
+        paths.append(path)
+    return paths
+
+
+def processFile(job):
+    """Loads one data file, applies the template to it and writes its graphs, returning a summary dict
+
+    Run in the worker processes. Errors are reported in the summary rather than raised so that one bad file doesn't
+    stop the batch.
+    """
+    templatePath, dataPath, options = job
+    summary = {'path': dataPath, 'points': 0, 'outputs': 0, 'error': None, 'load': 0., 'evaluate': 0., 'write': 0.}
+    start = time.time()
+    tempDir = tempfile.mkdtemp(prefix="wiz")
+    try:
+        chain = TemplateFile.load(templatePath)
+        chain.threads = options['threads']
+        chain.memoize = options['cache'] is not None
+        data = MainWindow.loadData(dataPath, clean=options['clean'], chunkRead=options['chunkRead'],
+                                   chunkSize=options['chunkSize'], xCol=options['xCol'], yCol=options['yCol'],
+                                   header=options['header'], tempDir=tempDir)
+        summary['points'] = len(data[0])
+        loaded = time.time()
+        results = [(result, name) for result, name in applyTemplate(chain, data, lazy=options['lazy'])
+                   if hasattr(result, 'getRawData')]
+        evaluated = time.time()
+        directory = os.path.join(options['output'], os.path.splitext(os.path.basename(dataPath))[0])
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for (result, name), path in zip(results, outputPaths([n for _, n in results], directory,
+                                                            options['extension'])):
+            saveGraph(result, path)
+        summary['outputs'] = len(results)
+        summary['load'], summary['evaluate'], summary['write'] = \
+            loaded - start, evaluated - loaded, time.time() - evaluated
+    except Exception as e:
+        summary['error'] = "%s: %s" % (type(e).__name__, str(e))
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+    summary['total'] = time.time() - start
+    return summary
+
+
+def _initWorker(cacheDirectory):
+    if cacheDirectory:
+        ExpressionChain.cache.setDirectory(cacheDirectory)
+        ExpressionChain.cache.maxBytes = 0  # Results of other files are never reused, so only keep them on disk
+
+
+def run(templatePath, patterns, output="output", processes=None, threads=1, extension=".npy", xCol=0, yCol=1,
+        header=None, clean=True, chunkRead=True, chunkSize=100000, cache=None, lazy=False):
+    """Applies the template to every file matching patterns, returning a list of summaries in file order"""
+    paths = sorted({p for pattern in patterns for p in (glob.glob(pattern) or [pattern]) if os.path.isfile(p)})
+    if not paths:
+        print "No files matched %s" % ", ".join(patterns)
+        return []
+    try:
+        TemplateFile.load(templatePath)  # Fail before reading any data if the template is invalid
+    except TemplateFile.TemplateError as e:
+        print "Couldn't load template: %s" % str(e)
+        return []
+    options = {'output': output, 'threads': threads, 'extension': extension, 'xCol': xCol, 'yCol': yCol,
+               'header': header, 'clean': clean, 'chunkRead': chunkRead, 'chunkSize': chunkSize, 'cache': cache,
+               'lazy': lazy}
+    jobs = [(templatePath, path, options) for path in paths]
+    processes = min(processes or cpu_count(), len(jobs))
+    start = time.time()
+    summaries = []
+    if processes == 1:
+        _initWorker(cache)
+        results = (processFile(job) for job in jobs)
+        pool = None
+    else:
+        pool = Pool(processes, initializer=_initWorker, initargs=(cache,))
+        results = pool.imap_unordered(processFile, jobs)
+    for summary in results:
+        summaries.append(summary)
+        print "[%d/%d] %s %s" % (len(summaries), len(jobs), summary['path'],
+                                 "failed" if summary['error'] else "done in %.2f s" % summary['total'])
+    if pool:
+        pool.close()
+        pool.join()
+    summaries.sort(key=lambda s: paths.index(s['path']))
+    printSummary(summaries, time.time() - start, processes)
+    return summaries
+
+
+def printSummary(summaries, elapsed, processes):
+    width = max(len("File"), max(len(os.path.basename(s['path'])) for s in summaries))
+    print "\n%-*s %12s %9s %9s %9s %9s  %s" % (width, "File", "Points", "Load (s)", "Eval (s)", "Write (s)",
+                                               "Total (s)", "Graphs written")
+    for s in summaries:
+        print "%-*s %12d %9.2f %9.2f %9.2f %9.2f  %s" % (width, os.path.basename(s['path']), s['points'], s['load'],
+                                                         s['evaluate'], s['write'], s['total'],
+                                                         s['error'] if s['error'] else s['outputs'])
+    failed = sum(1 for s in summaries if s['error'])
+    print "\n%d files (%d failed) in %.2f s using %d processes; %.2f s of work in total" % (
+        len(summaries), failed, elapsed, processes, sum(s['total'] for s in summaries))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a WIZ template to many data files without the GUI")
+    parser.add_argument("template", help="the .wizt template to apply")
+    parser.add_argument("files", nargs="+", help="data files or glob patterns, e.g. 'data/*.txt'")
+    parser.add_argument("-o", "--output", default="output", help="directory to write results to (default: output)")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="number of files to process at once (default: number of CPUs)")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="threads used by each process to evaluate independent formulae (default: 1)")
+    parser.add_argument("-f", "--format", choices=["npy", "csv"], default="npy", help="output format (default: npy)")
+    parser.add_argument("-x", "--x-column", type=int, default=0, help="column of the x data (default: 0)")
+    parser.add_argument("-y", "--y-column", type=int, default=1, help="column of the y data (default: 1)")
+    parser.add_argument("--headers", action="store_true", help="the data files start with a row of column headers")
+    parser.add_argument("--no-clean", action="store_true", help="keep infs and NaNs")
+    parser.add_argument("--no-chunks", action="store_true", help="read each file at once rather than in chunks")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="rows read at a time (default: 100000)")
+    parser.add_argument("--cache", default=None,
+                        help="directory in which to store the results of each formula, so re-runs are faster")
+    parser.add_argument("--lazy", action="store_true",
+                        help="only compute results as they are written, a chunk at a time (for files larger than memory)")
+    args = parser.parse_args()
+    run(args.template, args.files, output=args.output, processes=args.processes, threads=args.threads,
+        extension="." + args.format, xCol=args.x_column, yCol=args.y_column, header=0 if args.headers else None,
+        clean=not args.no_clean, chunkRead=not args.no_chunks, chunkSize=args.chunk_size, cache=args.cache,
+        lazy=args.lazy)
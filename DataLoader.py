@@ -0,0 +1,631 @@
+"""Loads columns of text data files into memmaps in a single pass
+
+The file is parsed a chunk of rows at a time, and the x and y values of each chunk are appended to a GrowableMemmap
+of their own, so neither the file nor its values need to fit in memory. Rows which aren't finite can be dropped from
+each chunk as it is read. The memmaps are sized from an estimate of the number of rows, grown if the estimate was too
+small, and truncated to the rows read at the end, so the values are never copied once written.
+
+A range of rows, or of x values where x is in ascending order, can be loaded on its own. The start and end of the range
+are found without parsing the rest of the file (by counting line breaks, or by a binary search over byte offsets), and
+only the rows in between are parsed, so the time taken depends on the size of the range rather than of the file.
+A RowIndex of the file, which records the byte offset of every step-th row and is saved next to the file, lets ranges
+be found without reading the file before them, and rows be read from anywhere in it (see RowIndex.readRows() and
+RowIndex.readXRange()). Building one reads the whole file, so it can be done in the background
+(see RowIndex.buildInBackground()).
+
+loadTextParallel() gives the same result using several processes. The file is split into byte ranges at line breaks,
+the lines of each range are counted, and then each range is parsed by a worker process directly into its own slice of
+the memmaps. Rows which are left out leave gaps at the end of each slice, which are closed before the memmaps are
+truncated.
+
+A LoadCache keeps the columns parsed from text files as .npy files, so that loading the same file with the same options
+again only maps the stored columns rather than parsing the text.
+"""
+import hashlib
+import io
+import math
+import numpy as np
+import pandas as pd
+import tempfile
+import os
+from multiprocessing import Pool, cpu_count
+from threading import Thread
+from numpy.lib.format import open_memmap
+
+__author__ = "Thomas Schweich"
+
+sampleSize = 1 << 16  # Bytes at the start of a file read to estimate its number of rows
+rangeSize = 1 << 26  # Greatest number of bytes of a file parsed by each task of loadTextParallel()
+blockSize = 1 << 24  # Bytes read at a time while counting lines, and values moved at a time while closing gaps
+pollInterval = .1  # Seconds between calls of the progress function of loadTextParallel()
+probeLines = 64  # Lines read past a line without an x value by findX() to find one which has one
+
+
+class GrowableMemmap(object):
+    """A 1D memmap in a temporary file which grows as values are appended to it"""
+    __author__ = "Thomas Schweich"
+
+    growth = 1.5  # Factor by which the capacity grows when it is exceeded
+
+    def __init__(self, capacity, dtype=np.float64, directory=None):
+        handle, self.path = tempfile.mkstemp(suffix=".dat", dir=directory)
+        self.file = os.fdopen(handle, 'r+b')
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.capacity = 0
+        self.array = None
+        self._resize(max(int(capacity), 1))
+
+    def _resize(self, capacity):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None  # Unmapped before the file changes size
+        self.file.truncate(capacity * self.dtype.itemsize)
+        self.array = np.memmap(self.file, dtype=self.dtype, mode='r+', shape=(capacity,))
+        self.capacity = capacity
+
+    def append(self, values):
+        """Writes values after those already appended, growing the file if they don't fit"""
+        end = self.length + len(values)
+        if end > self.capacity:
+            self._resize(max(end, int(self.capacity * self.growth)))
+        self.array[self.length:end] = values
+        self.length = end
+
+    def finish(self):
+        """Returns a memmap of the values appended, having truncated the file to them
+
+        The file is removed once it is mapped, so that its space is freed once the memmap is no longer used.
+        """
+        self.array.flush()
+        self.array = None
+        self.file.truncate(self.length * self.dtype.itemsize)
+        if self.length:
+            result = np.memmap(self.file, dtype=self.dtype, mode='r+', shape=(self.length,))
+        else:
+            result = np.empty(0, dtype=self.dtype)  # Empty files can't be mapped
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass  # Windows doesn't allow removing files which are in use
+        return result
+
+
+def estimateRows(path):
+    """Returns an estimate of the number of rows of the text file at path, from the rows in its first sampleSize
+    bytes"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        sample = f.read(sampleSize)
+    rows = sample.count(b"\n")
+    if not rows or len(sample) >= size:
+        return rows + 1
+    return int(size * rows / float(len(sample)) * 1.05) + 1  # A little over, so the memmaps rarely have to grow
+
+
+def loadText(path, xCol=0, yCol=1, header=None, chunkSize=100000, clean=True, tempDir=None, progress=None, rows=None,
+             xRange=None, index=None):
+    """Returns (x data, y data) as memmaps of columns xCol and yCol of the text file at path, read in one pass of
+    chunkSize rows at a time
+
+    With clean=True, rows where either value isn't finite are left out. header is passed to pandas.read_csv(), and
+    progress, if given, is called after each chunk. The memmaps are created in tempDir.
+    Given rows as (begin, end), only the rows from begin up to end are read, counting every line (blank or not) from
+    the first after the headers. Given xRange as (lowest, highest), only the rows with x from lowest to highest are read, which requires x
+    to be in ascending order. Either end of a range may be None to read from the start or to the end of the file.
+    The range is found with index, a RowIndex of the file with the same header and xCol, if one is given.
+    """
+    f = None
+    if rows is None and xRange is None:
+        source, capacity = path, estimateRows(path)
+    else:
+        f = open(path, 'rb')
+        begin, end = findRange(f, header, xCol, rows, xRange, index)
+        capacity = _countRows((path, begin, end)) if end > begin else 0  # Lines, some of which may be blank
+        f.seek(begin)
+        source = _RangeReader(f, end)
+        header = None  # Already skipped
+    xData, yData = GrowableMemmap(capacity, directory=tempDir), GrowableMemmap(capacity, directory=tempDir)
+    try:
+        if capacity != 0:
+            for x, y in _readColumns(source, xCol, yCol, header, chunkSize, clean):
+                xData.append(x)
+                yData.append(y)
+                if progress:
+                    progress()
+    except Exception:
+        xData.finish(), yData.finish()  # Removing their files
+        raise
+    finally:
+        if f is not None:
+            f.close()
+    return xData.finish(), yData.finish()
+
+
+class _RangeReader(object):
+    """A file-like object which reads the file f from its current position up to byte end
+
+    Ranges are read through one rather than by limiting the number of rows pandas reads, since pandas skips blank
+    lines without counting them.
+    """
+    __author__ = "Thomas Schweich"
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def read(self, size=-1):
+        remaining = max(self.end - self.f.tell(), 0)
+        return self.f.read(remaining if size is None or size < 0 else min(size, remaining))
+
+    def readline(self):
+        remaining = max(self.end - self.f.tell(), 0)
+        return self.f.readline(remaining) if remaining else b""
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+def findRange(f, header, xCol, rows=None, xRange=None, index=None):
+    """Returns (begin, end), the byte offsets in the file f of the first row of a range of rows or of x values (as
+    described by loadText()) and of the row after it, using index (a RowIndex of f) if it is given"""
+    if index is not None:
+        if rows is not None:
+            begin = index.rowOffset(f, rows[0] or 0)
+            return begin, index.size if rows[1] is None else max(begin, index.rowOffset(f, rows[1]))
+        begin = index.offsets[0] if xRange[0] is None else index.xOffset(f, xRange[0])
+        return begin, index.size if xRange[1] is None else max(begin, index.xOffset(f, xRange[1], after=True))
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    for _ in range(0 if header is None else header + 1):
+        f.readline()
+    start = f.tell()
+    if rows is not None:
+        begin = skipLines(f, start, rows[0] or 0)
+        end = size if rows[1] is None else skipLines(f, begin, max(0, rows[1] - (rows[0] or 0)))
+    else:
+        begin = start if xRange[0] is None else findX(f, start, size, xCol, xRange[0])
+        end = size if xRange[1] is None else findX(f, begin, size, xCol, xRange[1], after=True)
+    return begin, end
+
+
+def skipLines(f, start, lines):
+    """Returns the byte offset of the line lines after the one at byte start of the file f, or of the end of f"""
+    f.seek(start)
+    position = start
+    while lines > 0:
+        block = f.read(blockSize)
+        if not block:
+            break
+        count = block.count(b"\n")
+        if count < lines:
+            lines -= count
+            position += len(block)
+        else:
+            index = -1
+            for _ in range(lines):
+                index = block.index(b"\n", index + 1)
+            return position + index + 1
+    return position
+
+
+def findX(f, begin, end, xCol, value, after=False):
+    """Returns the byte offset of the first line from byte begin to end of the file f whose x is at least value (or
+    more than value if after is set), or end if there isn't one, where x is in ascending order
+
+    The lines are binary searched until fewer than sampleSize bytes remain, which are then searched in order. Lines
+    without an x value (headers, gaps, NaN) are never found; the search reads past them to the next line which has one.
+    """
+    low, high = begin, end  # Lines before low are before value, and the line at high isn't
+    while high - low > sampleSize:
+        f.seek((low + high) // 2 - 1)
+        f.readline()  # To the start of the next line
+        middle = position = f.tell()
+        line = f.readline()
+        if middle >= high:
+            break
+        x = _parseX(line, xCol)
+        for _ in range(probeLines):
+            if np.isfinite(x) or position + len(line) >= high:
+                break
+            position += len(line)
+            line = f.readline()
+            x = _parseX(line, xCol)
+        if not np.isfinite(x):
+            # None of the lines from middle to here can be found, so the part before them is searched on its own
+            found = findX(f, low, middle, xCol, value, after)
+            if found < middle:
+                return found
+            low = position + len(line)
+        elif x < value or (after and x == value):
+            low = position + len(line)
+        else:
+            high = position
+    f.seek(low)
+    position = low
+    while position < high:
+        line = f.readline()
+        if not line:
+            break
+        x = _parseX(line, xCol)
+        if x > value or (x == value and not after):
+            return position
+        position += len(line)
+    return high
+
+
+def _parseX(line, xCol):
+    try:
+        return float(line.split(b"\t")[xCol])
+    except (ValueError, IndexError):
+        return np.nan
+
+
+def _readColumns(source, xCol, yCol, header, chunkSize, clean):
+    """Yields (x, y) for each chunk of chunkSize rows of the text file or file-like object source"""
+    columns = sorted({xCol, yCol})  # The order in which read_csv() returns them
+    xIndex, yIndex = columns.index(xCol), columns.index(yCol)
+    for chunk in pd.read_csv(source, sep='\t', chunksize=chunkSize, dtype=np.float64, usecols=columns, header=header):
+        values = chunk.values
+        x, y = values[:, xIndex], values[:, yIndex]
+        if clean:
+            finite = np.isfinite(x) & np.isfinite(y)
+            if not finite.all():
+                x, y = x[finite], y[finite]
+        yield x, y
+
+
+def loadTextParallel(path, xCol=0, yCol=1, header=None, chunkSize=100000, clean=True, tempDir=None, processes=None,
+                     progress=None):
+    """Returns the same as loadText(), parsing ranges of the file in processes worker processes (one per CPU by
+    default) at once
+
+    header must be None or the number of the row of column headers, all rows up to which are skipped, as by
+    pandas.read_csv(). progress, if given, is called regularly while waiting for the workers.
+    """
+    processes = processes or cpu_count()
+    size = os.path.getsize(path)
+    count = max(processes, int(math.ceil(size / float(rangeSize))))
+    ranges = byteRanges(path, 0 if header is None else header + 1, count)
+    pool = Pool(min(processes, len(ranges)) or 1)
+    try:
+        rows = _map(pool, _countRows, [(path, begin, end) for begin, end in ranges], progress)
+        xData, yData = GrowableMemmap(sum(rows), directory=tempDir), GrowableMemmap(sum(rows), directory=tempDir)
+        offsets = np.cumsum([0] + rows[:-1]).tolist()
+        try:
+            kept = _map(pool, _parseRange, [(path, begin, end, xCol, yCol, chunkSize, clean, xData.path, yData.path,
+                                             offset, count)
+                                            for (begin, end), offset, count in zip(ranges, offsets, rows) if count],
+                        progress)
+        except Exception:
+            xData.finish(), yData.finish()  # Removing their files
+            raise
+    finally:
+        pool.close()
+        pool.join()
+    offsets = [offset for offset, count in zip(offsets, rows) if count]
+    for data in (xData, yData):
+        data.length = _closeGaps(data.array, offsets, kept)
+    return xData.finish(), yData.finish()
+
+
+def _map(pool, func, tasks, progress=None):
+    """Returns pool.map(func, tasks), calling progress() every pollInterval seconds until it is done"""
+    result = pool.map_async(func, tasks)
+    while not result.ready():
+        result.wait(pollInterval)
+        if progress:
+            progress()
+    return result.get()
+
+
+def byteRanges(path, skipLines, count):
+    """Returns a list of (begin, end) of about count byte ranges of the file at path after its first skipLines lines,
+    each beginning at the start of a line"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        for _ in range(skipLines):
+            f.readline()
+        start = f.tell()
+        bounds = [start]
+        for i in range(1, count):
+            position = start + (size - start) * i // count
+            if position > bounds[-1]:
+                f.seek(position - 1)
+                f.readline()  # To the end of the line which position is in, unless position begins a line
+                bounds.append(min(f.tell(), size))
+        bounds.append(size)
+    return [(begin, end) for begin, end in zip(bounds, bounds[1:]) if end > begin]
+
+
+def _countRows(task):
+    """Returns the number of lines from byte begin to end of the file at path"""
+    path, begin, end = task
+    rows = 0
+    last = b"\n"
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        for position in range(begin, end, blockSize):
+            block = f.read(min(blockSize, end - position))
+            rows += block.count(b"\n")
+            last = block[-1:] or last
+    return rows + (last != b"\n")  # The last line of a file may not end with a line break
+
+
+def _parseRange(task):
+    """Parses the lines from byte begin to end of the file at path into count values of the memmaps at xPath and
+    yPath from offset, returning the number of rows written"""
+    path, begin, end, xCol, yCol, chunkSize, clean, xPath, yPath, offset, count = task
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        text = f.read(end - begin)
+    xData, yData = [np.memmap(p, dtype=np.float64, mode='r+', offset=offset * 8, shape=(count,))
+                    for p in (xPath, yPath)]
+    kept = 0
+    for x, y in _readColumns(io.BytesIO(text), xCol, yCol, None, chunkSize, clean):
+        xData[kept:kept + len(x)] = x
+        yData[kept:kept + len(y)] = y
+        kept += len(x)
+    xData.flush()
+    yData.flush()
+    return kept
+
+
+def _closeGaps(array, offsets, counts):
+    """Moves the counts[i] values of array at each offsets[i] to follow on from each other, returning how many values
+    there are"""
+    end = 0
+    for offset, count in zip(offsets, counts):
+        if offset != end:
+            for start in range(0, count, blockSize):
+                stop = min(start + blockSize, count)
+                array[end + start:end + stop] = array[offset + start:offset + stop]
+        end += count
+    return end
+
+
+class RowIndex(object):
+    """The byte offsets of every step-th row of a text data file, counting from the first row after its headers, and
+    the x values of those rows where they are in ascending order
+
+    With the offsets, any row can be reached by skipping fewer than step rows from the nearest offset before it, and
+    with the x values, a row with a given x value by searching fewer than step rows. An index is saved next to the file
+    it indexes (see indexPath()), and is only used while the file keeps the size and modification time it was built
+    with.
+    """
+    __author__ = "Thomas Schweich"
+
+    step = 1 << 12  # Rows between the offsets recorded
+    suffix = ".index.npz"
+    _building = set()  # (path, header, xCol) of the indices being built in the background
+
+    def __init__(self, path, header, xCol, step, offsets, xValues, rows, size, mtime):
+        self.path = path
+        self.header = header
+        self.xCol = xCol
+        self.step = step
+        self.offsets = offsets
+        self.xValues = xValues  # None unless the x values of the rows at offsets ascend
+        self.rows = rows
+        self.size = size
+        self.mtime = mtime
+
+    @staticmethod
+    def indexPath(path):
+        return path + RowIndex.suffix
+
+    @staticmethod
+    def build(path, header=None, xCol=0, step=None):
+        """Returns a RowIndex of the text file at path, made in one pass which only looks for line breaks"""
+        step = step or RowIndex.step
+        size, mtime = os.path.getsize(path), os.path.getmtime(path)
+        offsets = []
+        rows = 0
+        with open(path, 'rb') as f:
+            for _ in range(0 if header is None else header + 1):
+                f.readline()
+            position = f.tell()
+            starts = np.array([position] if position < size else [], dtype=np.int64)  # Of the rows in the block
+            while True:
+                block = f.read(blockSize)
+                if not block:
+                    break
+                breaks = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")) + position + 1
+                starts = np.concatenate((starts, breaks[breaks < size]))
+                position += len(block)
+                offsets.append(starts[(rows + np.arange(len(starts))) % step == 0])
+                rows += len(starts)
+                starts = starts[:0]
+            offsets = np.concatenate(offsets) if offsets else np.array([position], dtype=np.int64)
+            xValues = np.empty(len(offsets))
+            for i, offset in enumerate(offsets):
+                f.seek(offset)
+                xValues[i] = _parseX(f.readline(), xCol)
+        if not rows or not (np.isfinite(xValues).all() and (np.diff(xValues) >= 0).all()):
+            xValues = None
+        return RowIndex(path, header, xCol, step, offsets, xValues, rows, size, mtime)
+
+    @staticmethod
+    def open(path, header=None, xCol=0, build=True):
+        """Returns the RowIndex saved next to the text file at path if it is up to date and was made with header and
+        xCol, or otherwise builds and saves a new one (if build is set, or else returns None)"""
+        try:
+            with np.load(RowIndex.indexPath(path)) as saved:
+                (size, mtime, savedHeader, savedXCol, step, rows), offsets = saved['meta'], saved['offsets']
+                xValues = saved['xValues'] if len(saved['xValues']) else None
+            if (size, mtime, savedHeader, savedXCol) == (os.path.getsize(path), os.path.getmtime(path),
+                                                         -1 if header is None else header, xCol):
+                return RowIndex(path, header, xCol, int(step), offsets, xValues, int(rows), int(size), mtime)
+        except Exception:  # The index is missing, unreadable or corrupt, so it is built again
+            pass
+        if not build:
+            return None
+        index = RowIndex.build(path, header, xCol)
+        index.save()
+        return index
+
+    @staticmethod
+    def buildInBackground(path, header=None, xCol=0):
+        """Builds and saves the RowIndex of the text file at path in a daemon thread, returning the thread, or None if
+        the index is already being built"""
+        key = (os.path.abspath(path), header, xCol)
+        if key in RowIndex._building:
+            return None
+        RowIndex._building.add(key)
+
+        def run():
+            try:
+                RowIndex.build(path, header, xCol).save()
+            except (IOError, OSError) as e:
+                print "Couldn't index %s: %s" % (path, str(e))
+            finally:
+                RowIndex._building.discard(key)
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def save(self):
+        """Saves the index next to its file, if the directory can be written to
+
+        The index is written to a temporary file which then replaces the saved index, so that an index which is only
+        partly written is never read.
+        """
+        path = RowIndex.indexPath(self.path)
+        temp = path + ".%d.tmp" % os.getpid()
+        try:
+            with open(temp, 'wb') as f:
+                np.savez(f, offsets=self.offsets, xValues=self.xValues if self.xValues is not None else np.empty(0),
+                         meta=np.array([self.size, self.mtime, -1 if self.header is None else self.header, self.xCol,
+                                        self.step, self.rows], dtype=np.float64))
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+        except (IOError, OSError) as e:
+            print "Couldn't save the index of %s: %s" % (self.path, str(e))
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def rowOffset(self, f, row):
+        """Returns the byte offset in f, the indexed file, of row, or of the end of f if there are no more rows"""
+        if row >= self.rows:
+            return self.size
+        return skipLines(f, self.offsets[row // self.step], row % self.step)
+
+    def xOffset(self, f, value, after=False):
+        """Returns the byte offset in f, the indexed file, of the first row whose x is at least value (or more than
+        value if after is set), or of the end of f if there isn't one"""
+        if self.xValues is None:
+            return findX(f, self.offsets[0], self.size, self.xCol, value, after)
+        following = self.xValues.searchsorted(value, side='right' if after else 'left')  # The first after the row
+        begin = self.offsets[max(following - 1, 0)]
+        end = self.offsets[following] if following < len(self.offsets) else self.size
+        return findX(f, begin, end, self.xCol, value, after)
+
+    def readRows(self, start, stop, yCol=1, clean=False):
+        """Returns (x data, y data) as arrays of the rows from start up to stop, reading only those rows"""
+        with open(self.path, 'rb') as f:
+            return self._read(f, self.rowOffset(f, start), self.rowOffset(f, max(start, stop)), yCol, clean)
+
+    def readXRange(self, lowest, highest, yCol=1, clean=False):
+        """Returns (x data, y data) as arrays of the rows with x from lowest to highest, which requires x to be in
+        ascending order, reading only those rows"""
+        with open(self.path, 'rb') as f:
+            begin = self.xOffset(f, lowest)
+            return self._read(f, begin, max(begin, self.xOffset(f, highest, after=True)), yCol, clean)
+
+    def _read(self, f, begin, end, yCol, clean):
+        count = _countRows((self.path, begin, end)) if end > begin else 0
+        f.seek(begin)
+        chunks = list(_readColumns(_RangeReader(f, end), self.xCol, yCol, None, count, clean)) if count else []
+        if not chunks:
+            return np.empty(0), np.empty(0)
+        return np.concatenate([x for x, y in chunks]), np.concatenate([y for x, y in chunks])
+
+
+class LoadCache(object):
+    """Columns parsed from text files, stored in directory and memory mapped when the same file is loaded again
+
+    Entries are keyed by the path, size and modification time of the file, a digest of its first and last sampleSize
+    bytes, and the options it was loaded with, so a file which has changed is parsed again. Each entry is a .npy file
+    of shape (2, points), whose rows are the x and y data. Once the entries take more than maxBytes, the least recently
+    used are removed.
+    """
+    __author__ = "Thomas Schweich"
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def key(self, path, options):
+        """Returns the key of the text file at path loaded with options, a tuple of the values of the options"""
+        digest = hashlib.sha1(repr((os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path), options)))
+        with open(path, 'rb') as f:
+            digest.update(f.read(sampleSize))
+            f.seek(max(0, os.path.getsize(path) - sampleSize))
+            digest.update(f.read(sampleSize))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, path, options):
+        """Returns (x data, y data) as read-only memmaps of the entry of path loaded with options, or None if there
+        isn't one"""
+        entry = self._path(self.key(path, options))
+        if not os.path.isfile(entry):
+            return None
+        try:
+            data = np.load(entry, mmap_mode='r')
+            os.utime(entry, None)  # Marking it as recently used
+        except (IOError, OSError, ValueError) as e:
+            print "Couldn't read cached data %s: %s" % (entry, str(e))
+            return None
+        return data[0], data[1]
+
+    def put(self, path, options, xData, yData):
+        """Stores xData and yData as the entry of path loaded with options, then removes the least recently used
+        entries while the entries take more than maxBytes"""
+        length = len(yData)
+        if not length or 2 * length * 8 > self.maxBytes:
+            return
+        entry = self._path(self.key(path, options))
+        temp = entry + ".%d.tmp" % os.getpid()
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            out = open_memmap(temp, mode='w+', dtype=np.float64, shape=(2, length))
+            for start in range(0, length, blockSize):
+                out[0, start:start + blockSize] = xData[start:start + blockSize]
+                out[1, start:start + blockSize] = yData[start:start + blockSize]
+            out.flush()
+            del out
+            if os.path.exists(entry):
+                os.remove(entry)
+            os.rename(temp, entry)
+        except (IOError, OSError) as e:
+            print "Couldn't cache data of %s: %s" % (path, str(e))
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries while the entries take more than maxBytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                entry = os.path.join(self.directory, name)
+                entries.append((os.path.getmtime(entry), os.path.getsize(entry), entry))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(entry)
+                total -= size
+            except OSError:
+                pass  # Windows doesn't allow removing files which are in use
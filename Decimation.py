@@ -0,0 +1,103 @@
+"""Min/max decimation of large data sets for plotting
+
+A DecimationPyramid splits the data into buckets of consecutive points and keeps the points with the lowest and
+highest y value of each bucket, at several resolutions. Drawing those points in order traces the same envelope as
+the full data, so spikes and glitches stay visible however far the data is decimated. The pyramid is built once, a
+chunk at a time, after which any range of the data can be drawn at a fixed point budget without reading the full data.
+Ranges only a few times larger than the budget are decimated from the data itself instead, since even the finest level
+of the pyramid would draw them with far fewer points than the budget allows.
+"""
+import numpy as np
+
+__author__ = "Thomas Schweich"
+
+
+class DecimationPyramid(object):
+    """Min/max points of each bucket of bucketSize * factor ** level points, for every level down to a single bucket"""
+    __author__ = "Thomas Schweich"
+
+    bucketSize = 64  # Points per bucket of the finest level
+    factor = 4  # Buckets of each level combined into one bucket of the next
+    chunkSize = 1 << 20  # Points read at a time while building; a multiple of bucketSize
+    directLimit = 8  # Ranges of at most this many times the point budget are decimated from the data itself
+
+    def __init__(self, xData, yData):
+        """Builds the pyramid of xData and yData, which may be any array-likes supporting len() and slicing"""
+        self.length = len(yData)
+        self.xData = xData
+        self.yData = yData
+        self.levels = []
+        if self.length <= self.bucketSize:
+            return
+        parts = []
+        for start in range(0, self.length, self.chunkSize):
+            stop = min(start + self.chunkSize, self.length)
+            parts.append(DecimationPyramid._bucket(np.asarray(xData[start:stop]), np.asarray(yData[start:stop]),
+                                                   start, self.bucketSize))
+        level = tuple(np.concatenate(p) for p in zip(*parts))
+        self.levels.append(level)
+        while len(level[0]) > 1:
+            level = DecimationPyramid._combine(level, self.factor)
+            self.levels.append(level)
+
+    @staticmethod
+    def _bucket(x, y, offset, size):
+        """Returns (min index, min x, min y, max index, max x, max y) of each bucket of size points of x and y"""
+        count = -(-len(y) // size)
+        padded = count * size
+        if padded != len(y):  # Pad the last bucket with its own last value, which doesn't change its min or max
+            y = np.concatenate((y, np.repeat(y[-1:], padded - len(y))))
+        buckets = y.reshape(count, size)
+        rows = np.arange(count)
+        minIndex = np.minimum(rows * size + np.argmin(buckets, axis=1), len(x) - 1)
+        maxIndex = np.minimum(rows * size + np.argmax(buckets, axis=1), len(x) - 1)
+        return minIndex + offset, x[minIndex], y[minIndex], maxIndex + offset, x[maxIndex], y[maxIndex]
+
+    @staticmethod
+    def _combine(level, factor):
+        """Returns the next level of the pyramid, whose buckets each span factor buckets of level"""
+        minIndex, minX, minY, maxIndex, maxX, maxY = level
+        count = -(-len(minY) // factor)
+        padded = count * factor
+
+        def pad(array):
+            return np.concatenate((array, np.repeat(array[-1:], padded - len(array)))).reshape(count, factor)
+        rows = np.arange(count)
+        lowest = rows * factor + np.minimum(np.argmin(pad(minY), axis=1), len(minY) - 1 - rows * factor)
+        highest = rows * factor + np.minimum(np.argmax(pad(maxY), axis=1), len(maxY) - 1 - rows * factor)
+        return minIndex[lowest], minX[lowest], minY[lowest], maxIndex[highest], maxX[highest], maxY[highest]
+
+    def getBucketSize(self, level):
+        return self.bucketSize * self.factor ** level
+
+    def getView(self, begin=0, end=None, maxPoints=10000):
+        """Returns arrays of (x, y, level) of the points between indices begin and end drawn with at most maxPoints
+        points, or (None, None, None) if the data between begin and end has fewer than maxPoints points
+
+        Each bucket of the finest level with few enough buckets in range contributes its min and max, in order. Where
+        there are at most directLimit times maxPoints points in range, they are instead read and split into as many
+        buckets as fit maxPoints, and level is None.
+        """
+        end = self.length if end is None else min(end, self.length)
+        begin = max(0, begin)
+        if end - begin <= maxPoints or not self.levels:
+            return None, None, None
+        if end - begin <= self.directLimit * maxPoints:
+            size = -(-2 * (end - begin) // maxPoints)  # Points per bucket, each of which contributes two points
+            bucketed = DecimationPyramid._bucket(np.asarray(self.xData[begin:end]), np.asarray(self.yData[begin:end]),
+                                                 begin, size)
+            return DecimationPyramid._interleave(bucketed) + (None,)
+        for index, level in enumerate(self.levels):
+            size = self.getBucketSize(index)
+            first, last = begin // size, -(-end // size)
+            if 2 * (last - first) <= maxPoints or index == len(self.levels) - 1:
+                return DecimationPyramid._interleave([a[first:last] for a in level]) + (index,)
+
+    @staticmethod
+    def _interleave(buckets):
+        """Returns (x, y) of the min and max of each of buckets, as returned by _bucket(), in the order they occur"""
+        minIndex, minX, minY, maxIndex, maxX, maxY = buckets
+        minFirst = (minIndex <= maxIndex)[:, np.newaxis]
+        xs = np.where(minFirst, np.dstack((minX, maxX))[0], np.dstack((maxX, minX))[0]).reshape(-1)
+        ys = np.where(minFirst, np.dstack((minY, maxY))[0], np.dstack((maxY, minY))[0]).reshape(-1)
+        return xs, ys
@@ -0,0 +1,71 @@
+"""Compares the cached tree evaluator of MathExpression with the token-list evaluator it replaced
+
+Usage: python ExpressionBenchmark.py [repeats]
+"""
+import os
+import sys
+import time
+from MathExpression import MathExpression
+
+__author__ = "Thomas Schweich"
+
+terms = ["(%d + %d * sqrt(%d))", "%d / (%d - %d)", "%d ^ 2", "(%d * %d + %d) / 7"]
+
+
+def buildExpression(numTokens):
+    """Returns an expression string which is tokenized into at least numTokens tokens"""
+    parts = []
+    n = 0
+    while True:
+        term = terms[n % len(terms)]
+        parts.append(term % tuple(range(n + 1, n + 1 + term.count("%d"))))
+        string = " + ".join(parts)
+        if len(MathExpression(string).expression) >= numTokens:
+            return string
+        n += 1
+
+
+def best(func, repeats):
+    """Returns the fastest of repeats calls to func in seconds"""
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def run(sizes=(10, 100, 1000), repeats=5):
+    results = []
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        for size in sizes:
+            sys.stdout = devnull  # Both evaluators print their progress
+            try:
+                string = buildExpression(size)
+                numTokens = len(MathExpression(string).expression)
+                old = best(lambda: MathExpression(string).evaluateExpression(list(MathExpression(string).expression)),
+                           repeats)
+
+                def uncached():
+                    MathExpression._trees.clear()
+                    MathExpression(string).evaluate()
+                new = best(uncached, repeats)
+                cached = best(lambda: MathExpression(string).evaluate(), repeats)
+                oldValue = MathExpression(string).evaluateExpression(list(MathExpression(string).expression))
+                exp = MathExpression(string)
+                exp.evaluate()
+            finally:
+                sys.stdout = stdout
+            if abs(oldValue - exp.expression) > 1e-9 * max(1.0, abs(oldValue)):
+                raise AssertionError("Evaluators disagree on %d tokens: %s != %s" % (numTokens, oldValue,
+                                                                                    exp.expression))
+            results.append((numTokens, old, new, cached))
+    print "%8s %14s %14s %14s %9s" % ("Tokens", "Token list (s)", "Parse+eval (s)", "Cached (s)", "Speedup")
+    for numTokens, old, new, cached in results:
+        print "%8d %14.6f %14.6f %14.6f %8.1fx" % (numTokens, old, new, cached, old / max(cached, 1e-9))
+    return results
+
+
+if __name__ == "__main__":
+    run(repeats=int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,26 +1,265 @@
 from MathExpression import MathExpression
-from itertools import chain
+from Graph import Graph, UniformAxis
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import Event, Lock
+from collections import OrderedDict
+import numpy as np
+import json
+import hashlib
+import copy
+import sys
+import os
+
+
+def fingerprint(value):
+    """Returns a digest of the contents of value
+
+    Graphs (anything with getRawData()) are fingerprinted by their x and y data, arrays by their data, and anything
+    else by its repr. Arrays are read a chunk at a time so that memmaps are never loaded whole.
+    """
+    digest = hashlib.sha1()
+    if hasattr(value, 'getRawData'):
+        for array in value.getRawData():
+            _updateDigest(digest, np.asarray(array))
+    elif isinstance(value, np.ndarray):
+        _updateDigest(digest, value)
+    else:
+        digest.update(repr(value))
+    return digest.hexdigest()
+
+
+def _updateDigest(digest, array, chunkSize=1 << 20):
+    digest.update("%s%s" % (array.dtype.str, str(array.shape)))
+    flat = array.reshape(-1)
+    for start in range(0, len(flat), chunkSize):
+        digest.update(np.ascontiguousarray(flat[start:start + chunkSize]).data)
+
+
+def _graphClasses():
+    """Returns a dict of Graph and each of its subclasses by name, being the only classes results are restored as"""
+    classes, pending = {}, [Graph]
+    while pending:
+        cls = pending.pop()
+        classes[cls.__name__] = cls
+        pending.extend(cls.__subclasses__())
+    return classes
+
+
+def _isJSON(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _toStr(obj):
+    """Converts the unicode strings produced by json back to str"""
+    if isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    if isinstance(obj, list):
+        return [_toStr(o) for o in obj]
+    if isinstance(obj, dict):
+        return {_toStr(k): _toStr(v) for k, v in obj.items()}
+    return obj
+
+
+class ResultCache:
+    """Remembers the results of formulae by key, in memory and optionally in a directory on disk
+
+    The most recently used results are kept in memory until their arrays take up more than maxBytes (those mapped from
+    files aren't counted), and none are kept in memory if maxBytes is 0. On disk, each result is a JSON document
+    (<key>.json) describing it, along with a .npy file of each of its arrays. Graphs are stored as their class, their
+    metadata which can be written as JSON, and their x and y data and the arrays named by their .arrayAttrs (each of
+    which is a .npy file, or part of the document if it's a UniformAxis); arrays and numbers are stored as they are, and
+    any other result is only kept in memory. Reading a stored result thus never runs code
+    from the file, and its arrays are memory-mapped rather than read.
+    """
+    __author__ = "Thomas Schweich"
+
+    version = 1  # Of the stored results, and part of every key so that results of other versions are never used
+
+    def __init__(self, directory=None, maxBytes=256 << 20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = Lock()
+
+    def setDirectory(self, directory):
+        """Sets the directory results are stored in between sessions, or disables storing them if it's empty"""
+        self.directory = directory if directory else None
+
+    def _path(self, key, suffix=".json"):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key):
+        """Returns a copy of the result stored under key, or None if there isn't one"""
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+        if value is None and self.directory and os.path.isfile(self._path(key)):
+            try:
+                value = self._read(key)
+            except Exception as e:
+                print "Couldn't read cached result %s: %s" % (key, str(e))
+                return None
+            if value is not None:
+                self._remember(key, value)
+        return ResultCache._copy(value) if value is not None else None
+
+    def _read(self, key):
+        """Returns the result stored on disk under key, or None if it isn't a result this version can read"""
+        with open(self._path(key), 'rb') as f:
+            document = _toStr(json.load(f))
+        if not isinstance(document, dict) or document.get("version") != ResultCache.version:
+            return None
+        load = lambda name: np.load(self._path(key, ".%s.npy" % name), mmap_mode='c', allow_pickle=False)
+        if document["type"] == "Graph":
+            cls = _graphClasses().get(document["class"])
+            if cls is None:
+                return None
+            arrays = {name: UniformAxis(*uniform) if uniform else load(name)
+                      for name, uniform in document["arrays"].items()}
+            value = cls()
+            value.setRawData((arrays.pop("x"), arrays.pop("y")))
+            value.__dict__.update(document["metaData"])
+            value.__dict__.update(arrays)
+            return value
+        if document["type"] == "array":
+            return load("value")
+        return document["value"]
+
+    def _write(self, key, value):
+        """Writes value to disk under key, returning False if it isn't a kind of result which can be stored
+
+        The arrays are written first and the document last, so that a result is only found once it's complete.
+        """
+        document = OrderedDict([("format", "WIZ Result"), ("version", ResultCache.version)])
+        arrays = {}
+        if hasattr(value, 'getRawData') and hasattr(value, 'getMetaData'):
+            if _graphClasses().get(value.__class__.__name__) is not value.__class__:
+                return False
+            document["type"], document["class"] = "Graph", value.__class__.__name__
+            values = dict(zip(("x", "y"), value.getRawData()))
+            values.update((name, getattr(value, name)) for name in value.arrayAttrs)
+            if any(a is None for a in values.values()):
+                return False
+            document["arrays"] = {name: [a.start, a.step, a.count] if isinstance(a, UniformAxis) else None
+                                  for name, a in values.items()}
+            arrays = {name: a for name, a in values.items() if not isinstance(a, UniformAxis)}
+            document["metaData"] = {k: v for k, v in value.getMetaData().items() if _isJSON(v)}
+        elif isinstance(value, np.ndarray):
+            document["type"] = "array"
+            arrays["value"] = value
+        elif isinstance(value, (int, long, float)) and _isJSON(value):
+            document["type"], document["value"] = "number", value
+        else:
+            return False
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        suffix = ".%d.tmp" % os.getpid()
+        for name, array in arrays.items():
+            array = array.materialize() if hasattr(array, 'materialize') else np.asarray(array)
+            with open(self._path(key, ".%s.npy" % name) + suffix, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+        with open(self._path(key) + suffix, 'wb') as f:
+            json.dump(document, f)
+        for path in [self._path(key, ".%s.npy" % name) for name in arrays] + [self._path(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(path + suffix, path)
+        return True
+
+    def store(self, key, value):
+        """Stores a copy of value under key, writing it to .directory if one is set"""
+        if value is None:
+            return
+        value = ResultCache._copy(value)
+        self._remember(key, value)
+        if self.directory and not os.path.exists(self._path(key)):
+            try:
+                self._write(key, value)
+            except (IOError, OSError, TypeError, ValueError) as e:
+                print "Couldn't store result %s: %s" % (key, str(e))
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._sizes.pop(key, None)
+            if not self.maxBytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = ResultCache._size(value)
+            total = sum(self._sizes.values())
+            while self._entries and total > self.maxBytes:
+                oldest, _ = self._entries.popitem(last=False)
+                total -= self._sizes.pop(oldest)
+
+    def clear(self):
+        """Forgets every result held in memory"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    @staticmethod
+    def _size(value):
+        """Returns the number of bytes held in memory by the arrays of a result, not counting those mapped from files"""
+        if hasattr(value, 'getRawData'):
+            arrays = list(value.getRawData()) + [getattr(value, name, None) for name in value.arrayAttrs]
+        else:
+            arrays = [value]
+        return sum(getattr(a, 'nbytes', 0) for a in arrays if not isinstance(a, np.memmap))
+
+    @staticmethod
+    def _copy(value):
+        """Returns a shallow copy of objects (so that setting a title doesn't change the stored result)"""
+        return copy.copy(value) if hasattr(value, '__dict__') else value
 
 
 class ExpressionChain:
     """ An iterable which stores MathExpressions and allows the use of previous expressions as variables when iterated
+
+    Formulae which don't reference one another are evaluated at the same time on a pool of threads, but results are
+    always returned in the order the formulae were added.
+    Results are memoized in .cache under a key made from the formula and the fingerprints of its inputs, where the
+    result of an earlier formula is identified by that formula's key. Thus after editing a formula, only it and the
+    formulae downstream of it are evaluated again.
     """
     __author__ = "Thomas Schweich"
 
+    # Class level defaults for chains pickled before these attributes existed
+    blockFunc = None
+    threads = None
+    memoize = True
+    cache = ResultCache()  # Shared by every chain so that results outlive the chain which created them
+
+    # Attributes which only exist while iterating, and so are never pickled
+    _transient = {'_iterator', '_pool', '_lock', '_base', '_results', '_errors', '_done', '_waiting', '_dependents',
+                  '_dependencies', '_position', '_keys', 'cache'}
+
     def __init__(self, variables=None, operators=None, modules=None,
-                 fallbackFunc=None):
+                 fallbackFunc=None, blockFunc=None, threads=None):
         """Takes an initial argument for 'variables', which is then appended to as expressions are evaluated
 
-        The remaining options stay constant, and are simply used to customize the MathExpression
+        The remaining options stay constant, and are simply used to customize the MathExpression. threads is the
+        number of formulae which may be evaluated at once (defaults to the number of CPUs).
         """
         self.formulae = []
-        self._iterator = None
+        self._pool = None
         self.variables = {} if not variables else variables
         self.operators = operators
         self.modules = modules
         self.fallbackFunc = fallbackFunc
+        self.blockFunc = blockFunc
+        self.threads = threads
         self.finalized = False
 
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in ExpressionChain._transient}
+
     def addVariable(self, name, value):
         self.variables.update({name:value})
 
@@ -33,25 +272,146 @@ class ExpressionChain:
         """
         self.formulae.append((expression, name))
 
+    @staticmethod
+    def getReferences(tokens):
+        """Returns the set of variable names (without angle brackets) used in a tokenized expression"""
+        return {t[1:-1] for t in tokens if isinstance(t, str) and t.startswith("<") and t.endswith(">")}
+
+    def getDependencies(self):
+        """Returns a list holding, for each formula, the sorted indices of the earlier formulae it references
+
+        A name refers to the closest formula above the one using it, just as when the chain is evaluated in order.
+        Names which aren't defined by an earlier formula (such as ORIGINAL) are expected to be in .variables.
+        """
+        defined = {}
+        dependencies = []
+        for index, (formula, name) in enumerate(self.formulae):
+            tokens = MathExpression(formula, operators=self.operators).expression
+            dependencies.append(sorted({defined[r] for r in self.getReferences(tokens) if r in defined}))
+            defined[name] = index
+        return dependencies
+
+    def getKeys(self):
+        """Returns a list holding, for each formula, the key its result is memoized under
+
+        Keys are digests of the version of the stored results, the formula, the modules it is evaluated with, and for
+        each variable it references either the key of the formula defining it or the fingerprint of its value in
+        .variables.
+        """
+        modules = repr([getattr(m, '__name__', str(m)) for m in (self.modules or MathExpression.modules)])
+        defined = {}
+        keys = []
+        fingerprints = {}
+        for index, (formula, name) in enumerate(self.formulae):
+            digest = hashlib.sha1("%d:%s%s" % (ResultCache.version, formula, modules))
+            for reference in sorted(self.getReferences(MathExpression(formula, operators=self.operators).expression)):
+                digest.update("<%s>" % reference)
+                if reference in defined:
+                    digest.update(keys[defined[reference]])
+                elif reference in self.variables:
+                    if reference not in fingerprints:
+                        fingerprints[reference] = fingerprint(self.variables[reference])
+                    digest.update(fingerprints[reference])
+            keys.append(digest.hexdigest())
+            defined[name] = index
+        return keys
+
     def __iter__(self):
-        """Creates an iterator from the given expressions in order, returns self ready for use in a loop"""
-        self._iterator = chain(*self.formulae)
+        """Starts evaluating the formulae, returning self ready for use in a loop
+
+        Memoized results are used straight away. Every other formula whose inputs are ready is handed to the thread
+        pool, and each one which finishes hands over its dependents once all of their inputs are ready too.
+        """
+        self._close()
+        self._dependencies = self.getDependencies()
+        self._keys = self.getKeys() if self.memoize else [None] * len(self.formulae)
+        self._base = dict(self.variables)
+        self._results = [None] * len(self.formulae)
+        self._errors = [None] * len(self.formulae)
+        self._done = [Event() for _ in self.formulae]
+        for index, key in enumerate(self._keys):
+            if key is not None:
+                self._results[index] = self.cache.get(key)
+                if self._results[index] is not None:
+                    print "Using memoized result for %s" % self.formulae[index][1]
+                    self._done[index].set()
+        self._waiting = [set(d for d in dependencies if not self._done[d].is_set()) if not self._done[index].is_set()
+                         else set() for index, dependencies in enumerate(self._dependencies)]
+        self._dependents = [[] for _ in self.formulae]
+        for index, dependencies in enumerate(self._dependencies):
+            for d in dependencies:
+                self._dependents[d].append(index)
+        self._lock = Lock()
+        self._position = 0
+        self._pool = ThreadPool(self.threads or cpu_count()) if self.formulae else None
+        for index, waiting in enumerate(self._waiting):
+            if not waiting and not self._done[index].is_set():
+                self._submit(index)
         return self
 
-    def next(self):
-        """Generates the next result from .formulae, allowing use of previously defined variables
+    def _submit(self, index):
+        try:
+            self._pool.apply_async(self._evaluate, (index,))
+        except (ValueError, AssertionError, AttributeError):
+            pass  # Iteration was abandoned and the pool closed
 
-        Returns a tuple of (resulting expression, name)
-        """
-        formula = next(self._iterator)
+    def _evaluate(self, index):
+        """Evaluates formula index with the results of the formulae it depends on, then submits any dependents which
+        are now ready"""
+        formula, name = self.formulae[index]
         print "Formula: %s" % formula
-        name = next(self._iterator)
         print "Name: %s" % name
-        exp = MathExpression(formula, variables=self.variables, operators=self.operators, modules=self.modules,
-                             fallbackFunc=self.fallbackFunc)
-        exp.evaluate()
-        self.variables.update({name: exp.expression})
-        return exp.expression, name
+        # Each formula gets copies of its inputs, as functions like Graph.useYForCall() change the Graphs they are given
+        variables = {name: ResultCache._copy(value) for name, value in self._base.items()}
+        for d in self._dependencies[index]:
+            variables[self.formulae[d][1]] = ResultCache._copy(self._results[d])
+        try:
+            exp = MathExpression(formula, variables=variables, operators=self.operators, modules=self.modules,
+                                 fallbackFunc=self.fallbackFunc, blockFunc=self.blockFunc)
+            exp.evaluate()
+            self._results[index] = exp.expression
+            if self._keys[index] is not None:
+                self.cache.store(self._keys[index], exp.expression)
+        except Exception:
+            self._errors[index] = sys.exc_info()
+            self._done[index].set()
+            return
+        self._done[index].set()
+        with self._lock:
+            ready = []
+            for dependent in self._dependents[index]:
+                self._waiting[dependent].discard(index)
+                if not self._waiting[dependent]:
+                    ready.append(dependent)
+        for dependent in ready:
+            self._submit(dependent)
+
+    def _close(self):
+        """Stops the thread pool from accepting more formulae, and waits for those it's evaluating to finish"""
+        pool = getattr(self, '_pool', None)
+        self._pool = None
+        if pool:
+            pool.close()
+            pool.join()
+
+    def next(self):
+        """Returns the next result from .formulae, waiting for it to be evaluated if necessary
+
+        Returns a tuple of (resulting expression, name). Errors are raised when their formula is reached.
+        """
+        if self._position >= len(self.formulae):
+            self._close()
+            raise StopIteration
+        index = self._position
+        self._done[index].wait()
+        self._position += 1
+        if self._errors[index]:
+            self._close()
+            excType, excValue, traceback = self._errors[index]
+            raise excType, excValue, traceback
+        name = self.formulae[index][1]
+        self.variables.update({name: self._results[index]})
+        return self._results[index], name
 
     def __len__(self):
         return len(self.formulae)
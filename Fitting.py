@@ -0,0 +1,341 @@
+"""Least squares fits of data sets too large to fit with scipy.optimize.curve_fit
+
+A polynomial is linear in its coefficients, so its least squares fit is the solution of a small system of normal
+equations, which only needs sums of powers of x and of y times powers of x. PolynomialFit accumulates those sums a chunk
+at a time, in one pass over the data, which may be a memmap, LazyArray or Graph.UniformAxis. x is shifted and scaled to
+about [-1, 1] first, which keeps the system well conditioned however large the x values are.
+
+A sine wave isn't linear in its frequency, so SineFit estimates the frequency from the peak of a real FFT of at most
+estimatePoints block averages, fits a block averaged copy of the data small enough to fit quickly, and only then refines
+the fit on the full data, with one pass over the data per iteration.
+"""
+import numpy as np
+import math
+import time
+from LazyArray import LazyArray
+import Spectral
+
+__author__ = "Thomas Schweich"
+
+
+class PolynomialFit(object):
+    """The least squares polynomial of a given degree through x and y data"""
+    __author__ = "Thomas Schweich"
+
+    chunkSize = 1 << 20  # Points read at a time
+
+    def __init__(self, xData, yData, degree, isSorted=False):
+        """Fits a polynomial of degree to xData and yData, ignoring non-finite points
+
+        The range of x is taken from its ends if isSorted is set or xData is a Graph.UniformAxis, and is otherwise
+        found with an extra pass over xData. Raises a RuntimeError if there are too few distinct x values to determine
+        the polynomial.
+        """
+        self.degree = degree
+        length = len(xData)
+        first, last = float(xData[0]), float(xData[length - 1])
+        if not (isSorted or hasattr(xData, 'step')) or not np.isfinite(first - last) or first == last:
+            first, last = PolynomialFit._getRange(xData)
+        self.center = (first + last) / 2.0
+        self.scale = abs(last - first) / 2.0 or 1.0
+        powers = np.zeros(2 * degree + 1)  # Sums of t ** k, where t is scaled x
+        products = np.zeros(degree + 1)  # Sums of y * t ** k
+        self.count = 0
+        for start in range(0, length, self.chunkSize):
+            stop = min(start + self.chunkSize, length)
+            t = (np.asarray(xData[start:stop], dtype=np.float64) - self.center) / self.scale
+            y = np.asarray(yData[start:stop], dtype=np.float64)
+            finite = np.isfinite(t) & np.isfinite(y)
+            if not finite.all():
+                t, y = t[finite], y[finite]
+            self.count += len(t)
+            power = np.ones_like(t)
+            for k in range(2 * degree + 1):
+                powers[k] += power.sum()
+                if k <= degree:
+                    products[k] += power.dot(y)
+                if k < 2 * degree:
+                    power *= t
+        normal = powers[np.add.outer(np.arange(degree + 1), np.arange(degree + 1))]
+        if self.count <= degree or np.linalg.cond(normal) > 1 / np.finfo(np.float64).eps:
+            raise RuntimeError("A polynomial of degree %d can't be fitted to %d points with these x values" %
+                               (degree, self.count))
+        self.coefficients = np.linalg.solve(normal, products)  # Of scaled x, lowest power first
+
+    @staticmethod
+    def _getRange(xData):
+        """Returns (min, max) of the finite values of xData, read a chunk at a time"""
+        low, high = np.inf, -np.inf
+        for start in range(0, len(xData), PolynomialFit.chunkSize):
+            chunk = np.asarray(xData[start:start + PolynomialFit.chunkSize], dtype=np.float64)
+            chunk = chunk[np.isfinite(chunk)]
+            if len(chunk):
+                low, high = min(low, chunk.min()), max(high, chunk.max())
+        return (low, high) if low <= high else (0.0, 0.0)
+
+    def __call__(self, xData):
+        """Returns the value of the polynomial at each of xData"""
+        t = (np.asarray(xData, dtype=np.float64) - self.center) / self.scale
+        return np.polyval(self.coefficients[::-1], t)
+
+    def getCoefficients(self):
+        """Returns the coefficients of the polynomial of unscaled x, highest power first as in numpy.polyval()"""
+        scaled = np.poly1d(self.coefficients[::-1])
+        return scaled(np.poly1d([1.0 / self.scale, -self.center / self.scale])).coeffs
+
+    def evaluate(self, xData):
+        """Returns a LazyArray of the value of the polynomial at each of xData, computed a chunk at a time"""
+        return FittedValues(self, xData)
+
+
+class SineFit(object):
+    """The least squares sine wave plus linear trend through x and y data, A * sin(w * (x - center) + p) + m * x + b
+
+    The fit is found in three stages, each timed in .report:
+    1. The frequency is estimated by interpolating the peak of the real FFT of the detrended data, and the amplitude
+       and phase by a linear least squares fit at that frequency.
+    2. The data is averaged in blocks of as many points as keep at least samplesPerPeriod blocks per period, and the
+       fit is refined on the averages, allowing for how much averaging reduces the amplitude of a sine wave. When
+       the frequency is too high to average, an evenly strided subset of the data is fitted instead.
+    3. The fit is refined on the full data by damped Gauss-Newton iterations with the analytic Jacobian, each of which
+       reads the data once, until the sum of squared residuals stops improving or timeBudget seconds have passed.
+    """
+    __author__ = "Thomas Schweich"
+
+    chunkSize = 1 << 20  # Points read at a time
+    decimatedPoints = 1 << 16  # Number of block averages fitted before the full data
+    estimatePoints = 1 << 20  # Most points (or block averages) transformed to estimate the frequency
+    samplesPerPeriod = 16  # Fewest block averages per period of the estimated frequency
+    maxIterations = 50
+    tolerance = 1e-9  # Relative change in the sum of squared residuals below which the fit has converged
+
+    def __init__(self, xData, yData, timeBudget=30.0):
+        """Fits a sine wave and linear trend to xData and yData
+
+        No iterations are started once timeBudget seconds have passed, though the estimate and a pass over the full
+        data to measure the fit are always made. Raises a RuntimeError if the data is too short to fit.
+        """
+        started = time.time()
+        deadline = started + timeBudget
+        length = len(xData)
+        if length < 8:
+            raise RuntimeError("A sine wave can't be fitted to %d points" % length)
+        first, last = float(xData[0]), float(xData[length - 1])
+        self.center = (first + last) / 2.0
+        spacing = getattr(xData, 'step', (last - first) / (length - 1))  # Graph.UniformAxis has an exact step
+        self.report = {'points': length}
+
+        # 1. Frequency from the FFT peak, amplitude and phase from a linear fit at that frequency
+        trend = PolynomialFit(xData, yData, 1, isSorted=True)  # Sine fits already take x to be evenly spaced
+        w = SineFit._estimateFrequency(xData, yData, trend, spacing)
+        self.report['estimate time'] = time.time() - started
+
+        # 2. Fit of the block averaged data
+        stageStarted = time.time()
+        size = max(1, min(length // self.decimatedPoints,
+                          int(2 * math.pi / abs(w * spacing) / self.samplesPerPeriod) if w else length))
+        if size == 1 and length > self.decimatedPoints:
+            # The frequency is too high to average over blocks, but as the model is evaluated at the exact x values an
+            # evenly strided subset fits the same wave
+            stride = length // self.decimatedPoints
+            xBlocks = np.asarray(xData[::stride], dtype=np.float64)
+            yBlocks = np.asarray(yData[::stride], dtype=np.float64)
+        else:
+            xBlocks, yBlocks = SineFit._blockAverage(xData, size), SineFit._blockAverage(yData, size)
+        gain = SineFit._averagingGain(w, spacing, size)
+        params = SineFit._linearEstimate(xBlocks - self.center, yBlocks, w)
+        params[0] /= gain
+        params, iterations, converged, ssr = SineFit._refine(xBlocks, yBlocks, self.center, params, gain, deadline)
+        self.report.update({'block size': size, 'warm start iterations': iterations,
+                            'warm start time': time.time() - stageStarted})
+
+        # 3. Refinement on the full data
+        stageStarted = time.time()
+        params, iterations, converged, ssr = SineFit._refine(xData, yData, self.center, params, 1.0, deadline,
+                                                             SineFit.maxIterations)
+        amplitude, w, phase = params[:3]
+        if amplitude < 0:
+            amplitude, phase = -amplitude, phase + math.pi
+        self.params = np.array([amplitude, w, (phase + math.pi) % (2 * math.pi) - math.pi, params[3], params[4]])
+        self.report.update({'iterations': iterations, 'converged': converged, 'refine time': time.time() - stageStarted,
+                            'time': time.time() - started, 'rms residual': math.sqrt(ssr / length),
+                            'amplitude': self.params[0], 'frequency': self.params[1] / (2 * math.pi),
+                            'phase': self.params[2], 'timed out': not converged and time.time() > deadline})
+
+    @staticmethod
+    def _estimateFrequency(xData, yData, trend, spacing):
+        """Returns the angular frequency of the highest peak, other than at zero, of the spectrum of the data less trend
+
+        Data longer than estimatePoints is averaged in blocks first, so the memory used doesn't depend on its length.
+        As averaging hides frequencies near the Nyquist frequency of the blocks, the peak is first found in the power
+        spectral density of the full data by Welch's method, which reads it a batch at a time, and only if it is
+        within half that Nyquist frequency is it located in the spectrum of the blocks, which resolves frequencies as
+        finely as the spectrum of the full data.
+        """
+        detrended = Detrended(xData, yData, trend)
+        size = -(-len(detrended) // SineFit.estimatePoints)  # Points per block
+        if size > 1:
+            frequencies, density = Spectral.welch(detrended, 1.0 / spacing, SineFit.estimatePoints)
+            peak = SineFit._interpolatePeak(density)
+            if peak * frequencies[1] > .25 / (size * spacing):
+                return 2 * math.pi * peak * frequencies[1]
+            detrended, spacing = SineFit._blockAverage(detrended, size), spacing * size
+        data = np.asarray(detrended, dtype=np.float64) * np.hanning(len(detrended))
+        length = Spectral.fastLength(len(data))  # Zero padded to a fast length
+        return 2 * math.pi * SineFit._interpolatePeak(np.abs(Spectral.rfft(data, length))) / (length * spacing)
+
+    @staticmethod
+    def _interpolatePeak(spectrum):
+        """Returns the index of the highest value of spectrum other than the first, located between indices by fitting
+        a parabola to the log of the values around it"""
+        peak = np.argmax(spectrum[1:]) + 1
+        offset = 0.0
+        if peak < len(spectrum) - 1:
+            left, middle, right = np.log(spectrum[peak - 1:peak + 2] + np.finfo(np.float64).tiny)
+            curvature = left - 2 * middle + right
+            if curvature < 0:
+                offset = .5 * (left - right) / curvature
+        return peak + offset
+
+    @staticmethod
+    def _blockAverage(data, size):
+        """Returns the means of consecutive blocks of size values of data, leaving out any incomplete last block"""
+        count = len(data) // size
+        if size == 1:
+            return np.asarray(data, dtype=np.float64)
+        means = np.empty(count)
+        blocksPerChunk = max(1, SineFit.chunkSize // size)
+        for block in range(0, count, blocksPerChunk):
+            blocks = min(blocksPerChunk, count - block)
+            chunk = np.asarray(data[block * size:(block + blocks) * size], dtype=np.float64)
+            means[block:block + blocks] = chunk.reshape(blocks, size).mean(axis=1)
+        return means
+
+    @staticmethod
+    def _averagingGain(w, spacing, size):
+        """Returns the ratio of the amplitude of the means of blocks of size samples of a sine wave of angular
+        frequency w to the amplitude of the wave"""
+        half = w * spacing / 2.0
+        return 1.0 if size == 1 or math.sin(half) == 0 else math.sin(size * half) / (size * math.sin(half))
+
+    @staticmethod
+    def _linearEstimate(t, y, w):
+        """Returns [amplitude, w, phase, slope, intercept] of the least squares fit of
+        a * sin(w * t) + b * cos(w * t) + slope * t + intercept, which is linear at a given angular frequency w"""
+        finite = np.isfinite(y)
+        t, y = t[finite], y[finite]
+        basis = np.column_stack((np.sin(w * t), np.cos(w * t), t, np.ones_like(t)))
+        (a, b, slope, intercept), residuals, rank, values = np.linalg.lstsq(basis, y, rcond=None)
+        return np.array([math.hypot(a, b), w, math.atan2(b, a), slope, intercept])
+
+    @staticmethod
+    def _refine(xData, yData, center, params, gain, deadline, maxIterations=20):
+        """Improves params by damped Gauss-Newton (Levenberg-Marquardt) iterations, returning a tuple of
+        (params, iterations, converged, sum of squared residuals)
+
+        The model is gain * A * sin(w * t + p) + m * t + b where t = x - center, so the slope and intercept are of t.
+        Stops once an iteration changes the fit by less than tolerance, or at the deadline.
+        """
+        normal, gradient, ssr = SineFit._accumulate(xData, yData, center, params, gain)
+        damping = 1e-3
+        converged = False
+        iterations = 0
+        while iterations < maxIterations and time.time() < deadline:
+            iterations += 1
+            scale = np.sqrt(np.where(np.diag(normal) > 0, np.diag(normal), 1))  # Evens out the parameters' units
+            try:
+                step = np.linalg.solve(normal / np.outer(scale, scale) + damping * np.eye(5), gradient / scale) / scale
+            except np.linalg.LinAlgError:
+                break
+            trial = params + step
+            trialNormal, trialGradient, trialSsr = SineFit._accumulate(xData, yData, center, trial, gain)
+            change = ssr - trialSsr
+            if change >= 0:
+                params, normal, gradient, ssr = trial, trialNormal, trialGradient, trialSsr
+                damping = max(damping / 10, 1e-12)
+            else:
+                damping *= 10
+            # Changes this small are as likely to be rounding as anything, so neither accepted nor rejected steps will
+            # improve the fit
+            if abs(change) <= SineFit.tolerance * ssr or damping > 1e12:
+                converged = True
+                break
+        return params, iterations, converged, ssr
+
+    @staticmethod
+    def _accumulate(xData, yData, center, params, gain):
+        """Returns (J^T J, J^T r, r . r) over the data, a chunk at a time, where J is the Jacobian of the model at
+        params and r its residuals"""
+        amplitude, w, phase, slope, intercept = params
+        normal, gradient, ssr = np.zeros((5, 5)), np.zeros(5), 0.0
+        for start in range(0, len(xData), SineFit.chunkSize):
+            stop = min(start + SineFit.chunkSize, len(xData))
+            t = np.asarray(xData[start:stop], dtype=np.float64) - center
+            y = np.asarray(yData[start:stop], dtype=np.float64)
+            finite = np.isfinite(y) & np.isfinite(t)
+            if not finite.all():
+                t, y = t[finite], y[finite]
+            angle = w * t + phase
+            sin, cos = np.sin(angle), gain * amplitude * np.cos(angle)
+            residuals = y - (gain * amplitude * sin + slope * t + intercept)
+            jacobian = np.column_stack((gain * sin, t * cos, cos, t, np.ones_like(t)))
+            normal += jacobian.T.dot(jacobian)
+            gradient += jacobian.T.dot(residuals)
+            ssr += residuals.dot(residuals)
+        return normal, gradient, ssr
+
+    def __call__(self, xData):
+        """Returns the value of the fitted sine wave and trend at each of xData"""
+        amplitude, w, phase, slope, intercept = self.params
+        t = np.asarray(xData, dtype=np.float64) - self.center
+        return amplitude * np.sin(w * t + phase) + slope * t + intercept
+
+    def evaluate(self, xData):
+        """Returns a LazyArray of the value of the fit at each of xData, computed a chunk at a time"""
+        return FittedValues(self, xData)
+
+    def getReport(self):
+        """Returns a description of how the fit went"""
+        report = self.report
+        return ("%s after %d iterations on %d points in %.2f s (%.2f s to estimate, %.2f s on blocks of %d, "
+                "%.2f s refining)\nAmplitude %g, frequency %g, phase %g, RMS residual %g" %
+                ("Converged" if report['converged'] else
+                 "Stopped at the time limit" if report['timed out'] else "Didn't converge",
+                 report['iterations'], report['points'], report['time'], report['estimate time'],
+                 report['warm start time'], report['block size'], report['refine time'], report['amplitude'],
+                 report['frequency'], report['phase'], report['rms residual']))
+
+
+class Detrended(LazyArray):
+    """A LazyArray of y data less a fitted function of x data, with zeros where either isn't finite"""
+
+    def __init__(self, xData, yData, function):
+        LazyArray.__init__(self, len(yData), np.float64)
+        self.xData = xData
+        self.yData = yData
+        self.function = function
+
+    def compute(self, start, stop):
+        values = np.asarray(self.yData[start:stop], dtype=np.float64) - self.function(self.xData[start:stop])
+        values[~np.isfinite(values)] = 0
+        return values
+
+    def take(self, indices):
+        values = np.asarray(self.yData[indices], dtype=np.float64) - self.function(self.xData[indices])
+        values[~np.isfinite(values)] = 0
+        return values
+
+
+class FittedValues(LazyArray):
+    """A LazyArray of a fitted function of x data, such as a PolynomialFit"""
+
+    def __init__(self, function, xData):
+        LazyArray.__init__(self, len(xData), np.float64)
+        self.function = function
+        self.xData = xData
+
+    def compute(self, start, stop):
+        return self.function(self.xData[start:stop])
+
+    def take(self, indices):
+        return self.function(self.xData[indices])
@@ -3,19 +3,191 @@ import matplotlib
 matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.fftpack import fft
 from scipy.optimize import curve_fit
 from GraphWindow import GraphWindow
 from numbers import Number
 from MathExpression import MathExpression
+from LazyArray import LazyArray, Deferred
+from Decimation import DecimationPyramid
+from Fitting import PolynomialFit, SineFit
+import Spectral
 import math
-import tkMessageBox
+import weakref
+from threading import RLock
+from functools import partial
+from matplotlib.colors import LogNorm
+from matplotlib.image import AxesImage
+
+
+class UniformAxis(object):
+    """Evenly spaced x data stored as (start, step, count) rather than as an array
+
+    Behaves like the 1D array start + step * arange(count) wherever Graphs use x data: it has a length, can be indexed
+    and sliced (slices are UniformAxes), searched with searchsorted(), and multiplied, divided or shifted by numbers.
+    Anything else, such as passing it to a NumPy function, materializes the full array through __array__().
+    """
+    __author__ = "Thomas Schweich"
+
+    __array_priority__ = 20  # So that NumPy scalars and arrays leave arithmetic with a UniformAxis to it
+    dtype = np.dtype(np.float64)
+    ndim = 1
+
+    def __init__(self, start, step, count):
+        self.start = float(start)
+        self.step = float(step)
+        self.count = int(count)
+
+    @staticmethod
+    def fromArray(array, tolerance=1e-6, chunkSize=1 << 20):
+        """Returns a UniformAxis of array if its values are evenly spaced, otherwise None
+
+        Values may differ from a perfectly even spacing by tolerance * step (to allow for the rounding of values in
+        text files). The array is checked chunkSize values at a time, so that memmaps are never loaded whole.
+        """
+        if isinstance(array, UniformAxis):
+            return array
+        count = len(array)
+        if count < 2 or np.asarray(array[:1]).ndim != 1:
+            return None
+        start, stop = float(array[0]), float(array[count - 1])
+        step = (stop - start) / (count - 1)
+        if not step or not np.isfinite(step):
+            return None
+        allowed = max(abs(step) * tolerance, 4 * np.finfo(np.float64).eps * max(abs(start), abs(stop)))
+        for begin in range(0, count, chunkSize):
+            chunk = np.asarray(array[begin:begin + chunkSize], dtype=np.float64)
+            ideal = start + step * np.arange(begin, begin + len(chunk), dtype=np.float64)
+            if not np.all(np.abs(chunk - ideal) <= allowed):
+                return None
+        return UniformAxis(start, step, count)
+
+    @property
+    def shape(self):
+        return self.count,
+
+    @property
+    def size(self):
+        return self.count
+
+    def __len__(self):
+        return self.count
+
+    def __array__(self, dtype=None):
+        array = self.start + self.step * np.arange(self.count, dtype=np.float64)
+        return array.astype(dtype) if dtype is not None else array
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            begin, end, stride = index.indices(self.count)
+            return UniformAxis(self.start + self.step * begin, self.step * stride, len(xrange(begin, end, stride)))
+        if isinstance(index, (int, long, np.integer)):
+            if index < 0:
+                index += self.count
+            if not 0 <= index < self.count:
+                raise IndexError("index %d is out of bounds for axis with size %d" % (index, self.count))
+            return np.float64(self.start + self.step * index)
+        return np.asarray(self)[index]
+
+    def __iter__(self):
+        return (self[i] for i in xrange(self.count))
+
+    def min(self, axis=None, out=None, **kwargs):
+        if axis not in (None, 0) or out is not None or kwargs or not self.count:
+            return np.asarray(self).min(axis=axis, out=out, **kwargs)
+        return self[0] if self.step > 0 else self[-1]
+
+    def max(self, axis=None, out=None, **kwargs):
+        if axis not in (None, 0) or out is not None or kwargs or not self.count:
+            return np.asarray(self).max(axis=axis, out=out, **kwargs)
+        return self[-1] if self.step > 0 else self[0]
+
+    def searchsorted(self, values, side='left'):
+        """Returns the indices at which values would be inserted to keep the axis sorted, as ndarray.searchsorted"""
+        if self.step < 0:
+            return np.asarray(self).searchsorted(values, side=side)
+        positions = (np.asarray(values, dtype=np.float64) - self.start) / self.step
+        indices = np.ceil(positions) if side == 'left' else np.floor(positions) + 1
+        # Guard against rounding where a value is (nearly) exactly on the axis
+        indices = np.clip(indices, 0, self.count).astype(np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        inside = (indices > 0) & (indices <= self.count)
+        below = np.where(inside, self.start + self.step * (indices - 1), -np.inf)
+        indices -= (below >= values) if side == 'left' else (below > values)
+        inside = indices < self.count
+        at = np.where(inside, self.start + self.step * indices, np.inf)
+        indices += (at < values) if side == 'left' else (at <= values)
+        return indices if indices.ndim else np.intp(indices)
+
+    def isSameAs(self, other):
+        return isinstance(other, UniformAxis) and (self.start, self.step, self.count) == \
+            (other.start, other.step, other.count)
+
+    def _arithmetic(self, other, scalarFunc, arrayFunc):
+        if isinstance(other, Number) and not isinstance(other, complex):
+            return scalarFunc(float(other))
+        return arrayFunc(np.asarray(self), other)
+
+    def __mul__(self, other):
+        return self._arithmetic(other, lambda k: UniformAxis(self.start * k, self.step * k, self.count),
+                                lambda a, b: a * b)
+
+    __rmul__ = __mul__
+
+    def __div__(self, other):
+        return self._arithmetic(other, lambda k: UniformAxis(self.start / k, self.step / k, self.count),
+                                lambda a, b: a / b)
+
+    __truediv__ = __div__
+
+    def __add__(self, other):
+        return self._arithmetic(other, lambda k: UniformAxis(self.start + k, self.step, self.count),
+                                lambda a, b: a + b)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._arithmetic(other, lambda k: UniformAxis(self.start - k, self.step, self.count),
+                                lambda a, b: a - b)
+
+    def __rsub__(self, other):
+        return self._arithmetic(other, lambda k: UniformAxis(k - self.start, -self.step, self.count),
+                                lambda a, b: b - a)
+
+    def __neg__(self):
+        return UniformAxis(-self.start, -self.step, self.count)
+
+    def __rdiv__(self, other):
+        return other / np.asarray(self)
+
+    __rtruediv__ = __rdiv__
+
+    def __pow__(self, other):
+        return np.asarray(self) ** other
+
+    def __rpow__(self, other):
+        return other ** np.asarray(self)
+
+    def __repr__(self):
+        return "UniformAxis(start=%r, step=%r, count=%d)" % (self.start, self.step, self.count)
 
 
 class Graph(object):
     __author__ = "Thomas Schweich"
 
-    non_serializable_attrs = {'rawXData', 'rawYData', 'graphWindow', 'window', 'subplot', 'radioVar', 'chainData'}
+    non_serializable_attrs = {'rawXData', 'rawYData', 'graphWindow', 'window', 'subplot', 'radioVar', 'chainData',
+                              '_pyramid', '_sortedX', '_artists', '_density', 'fitReport',
+                              'frequencies', 'power'}
+    arrayAttrs = ()  # Attributes holding arrays besides the raw data, which are stored with it by a ResultCache
+
+    blockSize = 65536  # Points per block in evaluateBlockwise(), small enough for every operand's block to stay in cache
+    _blockUfuncs = {"^": np.power, "/": np.divide, "*": np.multiply, "+": np.add, "-": np.subtract}
+
+    # Canonical read-only x arrays shared between Graphs, as weak references by length and a sample of their values,
+    # and by id
+    axisSampleSize = 64
+    _axes = {}
+    _axisIds = {}
+    _axisLock = RLock()
 
     def __init__(self, window=None, title="", xLabel="", yLabel="", rawXData=np.array([0]), rawYData=np.array([0]),
                  xMagnitude=0, yMagnitude=0, autoScaleMagnitude=False, subplot=None):
@@ -59,9 +231,29 @@ class Graph(object):
         self.rawXData, self.rawYData = data
 
     def getRawData(self):
-        """Returns a tuple of (raw x data, raw y data)"""
+        """Returns a tuple of (raw x data, raw y data)
+
+        The x data of evenly sampled Graphs is a UniformAxis, which can be used like an array.
+        """
         return self.rawXData, self.rawYData
 
+    def isLazy(self):
+        """Returns whether this Graph's y data is a LazyArray, which is only computed when it is needed"""
+        return isinstance(self.getRawData()[1], LazyArray)
+
+    def setLazy(self, lazy=True):
+        """Makes the y data of this Graph lazy, so that the results of operations on it are only computed when plotted,
+        saved or reduced; or, with lazy=False, computes the y data"""
+        x, y = self.getRawData()
+        self.setRawData((x, LazyArray.wrap(y) if lazy else np.asarray(y)))
+
+    def iterRawChunks(self, chunkSize=None):
+        """Yields tuples of (x data, y data) of at most chunkSize points at a time, as ndarrays"""
+        x, y = self.getRawData()
+        chunkSize = int(chunkSize or LazyArray.chunkSize)
+        for start in range(0, len(x), chunkSize):
+            yield np.asarray(x[start:start + chunkSize]), np.asarray(y[start:start + chunkSize])
+
     def setTitle(self, title):
         """Sets the title of the graph"""
         self.title = title
@@ -102,7 +294,8 @@ class Graph(object):
     def setGraphMode(self, mode):
         """Sets the graphing mode
 
-        Possible options are 'logy', 'logx', 'loglog', and 'scatter'
+        Possible options are 'logy', 'logx', 'loglog', 'scatter', and 'density', which can also be combined with a log
+        scale as in 'density loglog'
         """
         self.mode = mode
 
@@ -150,25 +343,64 @@ class Graph(object):
                  'logy': lambda graph, subplot: Graph._get_plotter(graph, subplot).semilogy,
                  'logx': lambda graph, subplot: Graph._get_plotter(graph, subplot).semilogx,
                  'loglog': lambda graph, subplot: Graph._get_plotter(graph, subplot).loglog,
-                 '': lambda graph, subplot: Graph._get_plotter(graph, subplot).plot}
+                 '': lambda graph, subplot: Graph._get_plotter(graph, subplot).plot,
+                 'density': lambda graph, subplot: partial(graph.plotDensity, subplot),
+                 'density logx': lambda graph, subplot: partial(graph.plotDensity, subplot, xLog=True),
+                 'density logy': lambda graph, subplot: partial(graph.plotDensity, subplot, yLog=True),
+                 'density loglog': lambda graph, subplot: partial(graph.plotDensity, subplot, xLog=True, yLog=True)}
 
     def _plot_with_proper_axis(self, xVals, yVals, subplot=None, mode=''):
-        Graph._plotters.get(mode)(self, subplot)(xVals, yVals)
+        return Graph._plotters.get(mode)(self, subplot)(xVals, yVals)
 
-    def plot(self, subplot=None, mode='', maxPoints=None):
-        """Plots a PyPlot of the graph"""
+    def getPyramid(self):
+        """Returns the DecimationPyramid of this Graph's data, building it the first time it is needed"""
+        x, y = self.getRawData()
+        source, pyramid = getattr(self, '_pyramid', (None, None))
+        if source is not y or pyramid.length != len(x):
+            pyramid = DecimationPyramid(x, y)
+            self._pyramid = (y, pyramid)
+        return pyramid
+
+    def getPlotData(self, maxPoints=None, begin=0, end=None):
+        """Returns a tuple of (x data, y data) from point begin to end, scaled as in getScaledMagData()
+
+        If there are more than maxPoints points, they are decimated using the min and max of each section of the data,
+        so that no peaks are lost. Lazy Graphs are instead decimated by taking every n-th point, so that only the
+        points which are drawn are computed.
+        """
         xMag, yMag = self.getMagnitudes()
-        numPts = len(self.getRawData()[0])
-        if maxPoints and numPts > maxPoints:
-            step = math.ceil(numPts / maxPoints)
-            print "Using step size: %d" % step
-            xVals = self.getScaledMagData()[0][::int(step)]
-            yVals = self.getScaledMagData()[1][::int(step)]
-            print "Points plotted: %d" % len(xVals)
-        else:
-            xVals, yVals = self.getScaledMagData()
+        x, y = self.getRawData()
+        end = len(x) if end is None else min(end, len(x))
+        xVals = yVals = None
+        if maxPoints and end - begin > maxPoints:
+            if self.isLazy():
+                step = int(math.ceil((end - begin) / float(maxPoints)))
+                xVals, yVals = x[begin:end:step], y[begin:end:step]
+            else:
+                xVals, yVals, level = self.getPyramid().getView(begin, end, maxPoints)
+        if xVals is None:
+            xVals, yVals = x[begin:end], y[begin:end]
+        print "Points plotted: %d" % len(xVals)
+        return np.asarray(xVals) / 10 ** xMag, np.asarray(yVals) / 10 ** yMag
+
+    def plot(self, subplot=None, mode='', maxPoints=None):
+        """Plots a PyPlot of the graph, drawing at most about maxPoints points (see getPlotData())"""
         if not mode: mode = self.mode
-        self._plot_with_proper_axis(xVals, yVals, subplot=subplot, mode=mode)
+        if mode.startswith('density'):  # Drawn from all of the data, binned into pixels, rather than from points
+            artist = Graph._plotters.get(mode)(self, subplot)()
+        else:
+            xVals, yVals = self.getPlotData(maxPoints)
+            artist = self._plot_with_proper_axis(xVals, yVals, subplot=subplot, mode=mode)
+        sub = Graph._get_plotter(self, subplot)
+        if sub is not plt:
+            # Copied rather than modified, since shallow copies of this Graph share the dict
+            self._artists = weakref.WeakKeyDictionary(getattr(self, '_artists', {}))
+            self._artists[sub] = (artist[0] if isinstance(artist, list) else artist, None)
+        self.setAxisLabels(subplot)
+
+    def setAxisLabels(self, subplot=None):
+        """Titles and labels subplot with this Graph's title and axis labels, noting the magnitude of its data"""
+        xMag, yMag = self.getMagnitudes()
         sub = Graph._get_plotter(self, subplot)
         if sub is plt:
             plt.xlabel((str(self.getXLabel()) + "x10^" + str(xMag) if xMag != 0 else str(self.getXLabel())))
@@ -179,6 +411,158 @@ class Graph(object):
             sub.set_ylabel((str(self.getYLabel()) + "x10^" + str(yMag) if yMag != 0 else str(self.getYLabel())))
             sub.set_title(str(self.getTitle()))
 
+    @staticmethod
+    def _getRange(values, begin, end, log=False):
+        """Returns the (min, max) of the finite values (positive values if log) from index begin to end, read a chunk
+        at a time, or None if there are none"""
+        if isinstance(values, UniformAxis) and end > begin:
+            low, high = values[begin:end].min(), values[begin:end].max()
+            if not log or low > 0:
+                return low, high
+        low, high = np.inf, -np.inf
+        for start in range(begin, end, LazyArray.chunkSize):
+            chunk = np.asarray(values[start:min(start + LazyArray.chunkSize, end)], dtype=np.float64)
+            chunk = chunk[np.isfinite(chunk) & (chunk > 0)] if log else chunk[np.isfinite(chunk)]
+            if len(chunk):
+                low, high = min(low, chunk.min()), max(high, chunk.max())
+        return (low, high) if low <= high else None
+
+    def getDensity(self, width, height, xRange=None, yRange=None, xLog=False, yLog=False, begin=0, end=None):
+        """Returns a tuple of (counts, x edges, y edges), where counts is a height by width array of the number of
+        points from index begin to end in each bin, and the edges are the unscaled bounds of the bins
+
+        The bins span xRange and yRange, or all of the data if they aren't given, and are evenly spaced in log space
+        if xLog or yLog. Points outside of the bins, and non-positive values on log axes, aren't counted. The data is
+        binned a chunk at a time, and the result is kept so that drawing it again doesn't read the data.
+        """
+        x, y = self.getRawData()
+        end = len(x) if end is None else min(end, len(x))
+        key = (width, height, xRange, yRange, xLog, yLog, begin, end)
+        source, cachedKey, density = getattr(self, '_density', (None, None, None))
+        if source is y and cachedKey == key:
+            return density
+        bounds, edges = [], []
+        for values, valueRange, log, count in ((x, xRange, xLog, width), (y, yRange, yLog, height)):
+            valueRange = valueRange or Graph._getRange(values, begin, end, log) or (1, 10)
+            low, high = np.log10(valueRange) if log else valueRange
+            if low == high:
+                low, high = low - .5, high + .5
+            bounds.append((low, high))
+            spaced = np.linspace(low, high, count + 1)
+            edges.append(10 ** spaced if log else spaced)
+        (xLow, xHigh), (yLow, yHigh) = bounds
+        counts = np.zeros(width * height, dtype=np.int64)
+        for start in range(begin, end, LazyArray.chunkSize):
+            stop = min(start + LazyArray.chunkSize, end)
+            xs, ys = np.asarray(x[start:stop], dtype=np.float64), np.asarray(y[start:stop], dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if xLog: xs = np.log10(xs)
+                if yLog: ys = np.log10(ys)
+                columns = np.floor((xs - xLow) * (width / (xHigh - xLow)))
+                rows = np.floor((ys - yLow) * (height / (yHigh - yLow)))
+            # The highest value of each range belongs to the last bin rather than to one past it
+            columns[xs == xHigh], rows[ys == yHigh] = width - 1, height - 1
+            inside = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+            counts += np.bincount((rows[inside] * width + columns[inside]).astype(np.intp), minlength=width * height)
+        density = counts.reshape(height, width), edges[0], edges[1]
+        self._density = (y, key, density)
+        return density
+
+    def plotDensity(self, subplot=None, xLog=False, yLog=False):
+        """Plots the number of points in each pixel of the axis as an image, so that the time taken to draw the plot
+        depends on the size of the axis rather than the number of points
+
+        Also draws on log axes if xLog or yLog is set, or the axis already has a log scale. Returns the image.
+        """
+        sub = Graph._get_plotter(self, subplot)
+        axes = sub.gca() if sub is plt else sub
+        if xLog: axes.set_xscale('log')
+        if yLog: axes.set_yscale('log')
+        xLog, yLog = axes.get_xscale() == 'log', axes.get_yscale() == 'log'
+        width, height = max(int(axes.bbox.width), 1), max(int(axes.bbox.height), 1)
+        counts, xEdges, yEdges = self.getDensity(width, height, xLog=xLog, yLog=yLog)
+        xMag, yMag = self.getMagnitudes()
+        xEdges, yEdges = xEdges / 10 ** xMag, yEdges / 10 ** yMag
+        counts = np.ma.masked_equal(counts, 0)  # Empty pixels are left transparent
+        norm = LogNorm() if counts.count() else None
+        if xLog or yLog:  # Images can only be drawn with evenly spaced pixels, which log spaced bins aren't
+            return axes.pcolormesh(xEdges, yEdges, counts, norm=norm)
+        return axes.imshow(counts, origin='lower', extent=(xEdges[0], xEdges[-1], yEdges[0], yEdges[-1]),
+                           aspect='auto', interpolation='nearest', norm=norm)
+
+    def updateDensityView(self, subplot, image, view):
+        """Bins the points in the x and y limits of subplot into the pixels of image, returning whether anything
+        changed"""
+        xMag, yMag = self.getMagnitudes()
+        xLimits, yLimits = tuple(sorted(subplot.get_xlim())), tuple(sorted(subplot.get_ylim()))
+        width, height = max(int(subplot.bbox.width), 1), max(int(subplot.bbox.height), 1)
+        if (xLimits, yLimits, width, height) == view:
+            return False
+        x = self.getRawData()[0]
+        begin, end = 0, len(x)
+        if hasattr(x, 'searchsorted') and self.isSortedX():
+            begin, end = x.searchsorted(np.array(xLimits) * 10 ** xMag, side='left')
+            begin, end = max(int(begin) - 1, 0), min(int(end) + 1, len(x))
+        counts = self.getDensity(width, height, tuple(np.array(xLimits) * 10 ** xMag),
+                                 tuple(np.array(yLimits) * 10 ** yMag), begin=begin, end=end)[0]
+        counts = np.ma.masked_equal(counts, 0)
+        self._artists[subplot] = (image, (xLimits, yLimits, width, height))  # Before set_extent(), which sets limits
+        image.set_data(counts)
+        image.set_extent(xLimits + yLimits)
+        if counts.count():
+            image.set_norm(LogNorm())
+        return True
+
+    def isSortedX(self):
+        """Returns whether this Graph's x data is in ascending order, checking it a chunk at a time the first time"""
+        x = self.getRawData()[0]
+        source, isSorted = getattr(self, '_sortedX', (None, None))
+        if source is not x:
+            if isinstance(x, UniformAxis):
+                isSorted = x.step > 0
+            else:
+                isSorted = True
+                for start in range(0, len(x) - 1, LazyArray.chunkSize):
+                    chunk = np.asarray(x[start:start + LazyArray.chunkSize + 1])
+                    if np.any(chunk[1:] < chunk[:-1]):
+                        isSorted = False
+                        break
+            self._sortedX = (x, isSorted)
+        return isSorted
+
+    def updateView(self, subplot, xMin, xMax, maxPoints):
+        """Redraws this Graph's plot on subplot with only the points between x values xMin and xMax, decimated to at
+        most about maxPoints points, returning whether anything changed
+
+        The visible points are found by binary search, so the cost doesn't depend on the size of the data. Graphs with
+        unsorted x data are left as they are.
+        """
+        artist, view = getattr(self, '_artists', {}).get(subplot, (None, None))
+        if isinstance(artist, AxesImage):
+            return self.updateDensityView(subplot, artist, view)
+        x = self.getRawData()[0]
+        if artist is None or not hasattr(artist, 'set_data') or not hasattr(x, 'searchsorted') or \
+                not self.isSortedX():
+            return False
+        scale = 10 ** self.getMagnitudes()[0]
+        begin, end = x.searchsorted(np.array([xMin * scale, xMax * scale]), side='left')
+        begin, end = max(int(begin) - 1, 0), min(int(end) + 1, len(x))  # Include the points just outside the view
+        if (begin, end) == view:
+            return False
+        artist.set_data(*self.getPlotData(maxPoints, begin, end))
+        self._artists[subplot] = (artist, (begin, end))
+        return True
+
+    @staticmethod
+    def connectViewUpdates(subplot, graphs, maxPoints):
+        """Makes the graphs plotted on subplot redraw the visible part of their data whenever its x limits change"""
+        def onXLimChanged(ax):
+            xMin, xMax = sorted(ax.get_xlim())
+            changed = [g.updateView(ax, xMin, xMax, maxPoints) for g in graphs]
+            if any(changed) and ax.figure.canvas:
+                ax.figure.canvas.draw_idle()
+        return subplot.callbacks.connect('xlim_changed', onXLimChanged)
+
     def scatter(self, subplot=None):
         """Shortcut for mode="scatter" default in plot()"""
         self.plot(subplot=subplot, mode="scatter")
@@ -188,63 +572,96 @@ class Graph(object):
         forcedXMag, forcedYMag = self.getMagnitudes(forceAutoScale=True)
         setXMag, setYMag = self.getMagnitudes()
         xVals, yVals = self.getScaledMagData(forceAutoScale=True)
-        fitParams, fitCoVariances = curve_fit(fitFunction, xVals, yVals, check_finite=False)  # , maxfev=100000)
+        fitParams, fitCoVariances = curve_fit(fitFunction, np.asarray(xVals), yVals, check_finite=False)  # , maxfev=100000)
         magAdjustment = forcedYMag - setYMag
-        return Graph(self.window, rawXData=np.array(self.getRawData()[0]), rawYData=np.array(
+        return Graph(self.window, rawXData=self.getRawData()[0], rawYData=np.array(
             fitFunction(self.getScaledMagData(forceAutoScale=True)[0], *fitParams)) * 10 ** (magAdjustment + setYMag),
                      autoScaleMagnitude=self.autoScaleMagnitude, title="Fit for " + self.title, xLabel=self.xLabel,
                      yLabel=self.yLabel)
 
-    def getSinFit(self):
-        """Returns a Graph of a sine wave most closely fitting this graph"""
-        tt = self.getRawData()[0]
-        yy_raw = self.getRawData()[1]
+    def getPolynomialFit(self, degree):
+        """Returns a Graph of the least squares polynomial of degree through this Graph's data
 
-        # Subtract a linear fit from the function
-        line_func = lambda x, a, b: a * x + b
-        popt, pcov = curve_fit(line_func, tt, yy_raw)
-        slope, intercept = popt
-        linear_fit = line_func(tt, *popt)
-
-        yy = yy_raw - linear_fit
-
-        avg_delta = (tt.max() - tt.min()) / (len(tt) - 1)  # Find average interval between points
-        ff = np.fft.fftfreq(len(tt), avg_delta)  # assume uniform spacing
-        Fyy = abs(np.fft.fft(yy))
-        guess_freq = abs(
-            ff[np.argmax(Fyy[1:]) + 1])  # excluding the zero frequency "peak", which is related to offset
-        guess_amp = np.std(yy) * 2. ** 0.5
-        guess_offset = np.mean(yy)
-        guess = np.array([guess_amp, 2. * np.pi * guess_freq, 0., guess_offset])
-
-        def sinfunc(t, A, w, p, c):
-            return A * np.sin(w * t + p) + c
+        The fit is found in a single pass over the data (see Fitting.PolynomialFit), and raises a RuntimeError if the
+        data can't determine the polynomial. The fit of a lazy Graph is lazy.
+        """
+        x, y = self.getRawData()
+        fit = PolynomialFit(x, y, degree, self.isSortedX())
+        values = fit.evaluate(x)
+        return Graph(self.window, rawXData=x, rawYData=values if self.isLazy() else values.materialize(),
+                     autoScaleMagnitude=self.autoScaleMagnitude, title="Fit for " + self.title, xLabel=self.xLabel,
+                     yLabel=self.yLabel)
 
-        popt, pcov = curve_fit(sinfunc, tt, yy, p0=guess)
-        A, w, p, c = popt
-        fitfunc = lambda t: A * np.sin(w * t + p) + c
+    def getSinFit(self, timeBudget=30.0):
+        """Returns a Graph of the sine wave plus linear trend most closely fitting this graph
 
-        newY = fitfunc(self.getRawData()[0])
+        The fit stops iterating after timeBudget seconds (see Fitting.SineFit), and a report of how it went is kept in
+        the new Graph's .fitReport.
+        """
+        x, y = self.getRawData()
+        fit = SineFit(x, y, timeBudget)
+        values = fit.evaluate(x)
+        graph = Graph(self.window, rawXData=x, rawYData=values if self.isLazy() else values.materialize(),
+                      autoScaleMagnitude=self.autoScaleMagnitude, title="Fit for " + self.title, xLabel=self.xLabel,
+                      yLabel=self.yLabel)
+        graph.fitReport = fit.getReport()
+        return graph
+
+    def getLombScargle(self, maxFrequency=None):
+        """Returns a Graph of the Lomb-Scargle periodogram of y(t), which unlike getFFT() doesn't need evenly spaced x
+        data (see Spectral.lombScargle())
+
+        Each point is the fraction of the variance of y explained by a sine wave of that frequency.
+        """
+        x, y = self.getRawData()
+        frq, power = Spectral.lombScargle(x, y, maxFrequency)
+        return Graph(self.window, rawXData=UniformAxis(frq[0], frq[1] - frq[0], len(frq)), rawYData=power,
+                     title="Lomb-Scargle", xLabel="Freq (Hz)", yLabel="Normalized Power")
 
-        # Add back the linear fit
-        newY += linear_fit
+    def getSpectrogram(self, segmentLength=None, overlap=.5, columns=None):
+        """Returns a Spectrogram of the power spectral density of y(t) in segments of segmentLength points, averaged
+        into at most columns times (see Spectral.spectrogram())"""
+        x, y = self.getRawData()
+        rate = 1.0 / self.getSampleTime()
+        length = min(int(segmentLength or Spectral.spectrogramLength), len(y))  # As used by Spectral.spectrogram()
+        firstTime, timeStep, frequencies, power = Spectral.spectrogram(y, rate, length, overlap, columns)
+        times = UniformAxis(float(x[0]) + firstTime, timeStep, len(power))
+        return Spectrogram(self.window, times, UniformAxis(0, rate / length, len(frequencies)), power,
+                           title="Spectrogram", xLabel=self.getXLabel(), yLabel="Freq (Hz)")
+
+    def getSampleTime(self):
+        """Returns the spacing of this Graph's x data, assuming it is evenly spaced"""
+        x = self.getRawData()[0]
+        return x.step if isinstance(x, UniformAxis) else float(x[1] - x[0])
+
+    def getFFT(self, pad=False):
+        """Returns a Graph of the Single-Sided Amplitude Spectrum of y(t)
+
+        With pad set, the data is zero padded to a length which can be transformed quickly (see Spectral.fastLength()).
+        """
+        y = self.getRawData()[1]
+        size = Spectral.fastLength(len(y)) if pad else len(y)
+        frq = UniformAxis(0, 1.0 / (size * self.getSampleTime()), size // 2)  # one side frequency range
+        if isinstance(y, LazyArray):
+            Y = Deferred(partial(Spectral.amplitudes, pad=pad), y, size // 2)
+        else:
+            Y = Spectral.amplitudeSpectrum(y, pad)[0]
+        result = Graph(self.window, rawXData=frq, rawYData=Y, title="FFT", xLabel="Freq (Hz)", yLabel="|Y(freq)|")
+        result.setGraphMode("loglog")
+        return result
 
-        return Graph(self.window, rawXData=np.array(self.getRawData()[0]), rawYData=newY,
-                     autoScaleMagnitude=self.autoScaleMagnitude, title="Fit for " + self.title, xLabel=self.xLabel,
-                     yLabel=self.yLabel)
+    def getPSD(self, segmentLength=None, overlap=.5):
+        """Returns a Graph of the power spectral density of y(t) by Welch's method, averaging the spectra of
+        overlapping segments of segmentLength points (see Spectral.welch())
 
-    def getFFT(self):
-        """Returns a Graph of the Single-Sided Amplitude Spectrum of y(t)"""
-        x, y = self.getRawData()
-        sampleTime = x[1] - x[0]
-        n = len(y)  # length of the signal
-        k = np.arange(n)
-        T = n * sampleTime
-        frq = k / T  # two sides frequency range
-        frq = frq[range(n / 2)]  # one side frequency range
-        Y = fft(y, axis=0) / n  # fft computing and normalization
-        Y = Y[range(n / 2)]
-        result = Graph(self.window, rawXData=frq, rawYData=abs(Y), title="FFT", xLabel="Freq (Hz)", yLabel="|Y(freq)|")
+        Only a batch of segments is read at a time, so the PSD of data larger than memory can be found.
+        """
+        y = self.getRawData()[1]
+        rate = 1.0 / self.getSampleTime()
+        length = min(int(segmentLength or Spectral.segmentLength), len(y))  # As used by Spectral.welch()
+        frq, psd = Spectral.welch(y, rate, length, overlap)
+        result = Graph(self.window, rawXData=UniformAxis(0, rate / length, len(frq)), rawYData=psd, title="PSD",
+                       xLabel="Freq (Hz)", yLabel="PSD (%s^2/Hz)" % self.getYLabel() if self.getYLabel() else "PSD")
         result.setGraphMode("loglog")
         return result
 
@@ -253,7 +670,10 @@ class Graph(object):
         return Graph(self.window, title=str(self.title) + " (converted)",
                      xLabel=(self.xLabel if not xLabel else xLabel),
                      yLabel=(self.yLabel if not yLabel else yLabel),
-                     rawXData=self.getRawData()[0] * xMultiplier, rawYData=self.getRawData()[1] * yMultiplier,
+                     rawXData=(LazyArray.wrap(self.getRawData()[0]) if self.isLazy() and not isinstance(
+                         self.getRawData()[0], UniformAxis) else self.getRawData()[0]) * xMultiplier
+                     if xMultiplier != 1 else self.getRawData()[0],
+                     rawYData=self.getRawData()[1] * yMultiplier,
                      autoScaleMagnitude=self.autoScaleMagnitude)
 
     def slice(self, begin=0, end=None, step=1):
@@ -268,6 +688,76 @@ class Graph(object):
                      rawYData=self.getRawData()[1][int(begin):int(end):int(step)],
                      autoScaleMagnitude=self.autoScaleMagnitude)
 
+    def decimate(self, factor):
+        """Returns a Graph of every factor-th point, low pass filtered first so that frequencies too high for the
+        result are removed rather than aliased as they would be by slice() (see Spectral.decimate())
+
+        The data should be evenly spaced in x. Every fit, FFT and plot of the result reads factor times fewer points.
+        """
+        x, y = self.getRawData()
+        y = Spectral.decimate(y, factor)  # Which checks factor
+        factor = int(factor)
+        return Graph(self.window, title=str(self.title) + " decimated by " + str(factor), xLabel=self.xLabel,
+                     yLabel=self.yLabel, rawXData=x[::factor], rawYData=y, autoScaleMagnitude=self.autoScaleMagnitude)
+
+    def resample(self, step=None, method='linear', maxGap=None):
+        """Returns a Graph of the data resampled onto evenly spaced x values step apart, from the first x value to the
+        last
+
+        step defaults to the average spacing of the data, which must be in increasing order of x. method is 'linear' to
+        interpolate between the nearest points on either side, 'nearest' to take the nearest point, or 'mean' to average
+        the points within step / 2 (leaving NaN where there are none). Where maxGap is given, values between points
+        more than maxGap apart are NaN. The data is read a chunk at a time, and a large result is stored on disk (see
+        LazyArray.allocate()).
+        """
+        if method not in ('linear', 'nearest', 'mean'):
+            raise ValueError("Unknown resampling method '%s'" % method)
+        x, y = self.getRawData()
+        length = len(x)
+        if length < 2:
+            raise ValueError("Can't resample fewer than two points")
+        start = float(x[0])
+        step = float(step or (float(x[length - 1]) - start) / (length - 1))
+        if not step > 0:
+            raise ValueError("Can only resample data with increasing x values")
+        count = int((float(x[length - 1]) - start) / step * (1 + 1e-9)) + 1  # Allowing for rounding
+        result = LazyArray.allocate(count, np.float64)
+        if method == 'mean':
+            result[:] = 0
+            counts = LazyArray.allocate(count, np.int64)
+            counts[:] = 0
+        for begin in range(0, length - 1, LazyArray.chunkSize):
+            stop = min(begin + LazyArray.chunkSize + 1, length)  # The last point is also the first of the next chunk
+            xs, ys = np.asarray(x[begin:stop], dtype=np.float64), np.asarray(y[begin:stop], dtype=np.float64)
+            if (np.diff(xs) < 0).any():
+                raise ValueError("Can only resample data with increasing x values")
+            # Each chunk has the new x values from its first point up to its last, or to the end for the last chunk
+            first = int(np.ceil((xs[0] - start) / step))
+            last = count if stop == length else min(int(np.ceil((xs[-1] - start) / step)), count)
+            grid = start + step * np.arange(first, last)
+            right = np.clip(xs.searchsorted(grid, side='right'), 1, len(xs) - 1)
+            if method == 'mean':
+                owned = slice(None) if stop == length else slice(None, -1)
+                bins = np.clip(np.floor((xs[owned] - start) / step + .5).astype(np.intp), 0, count - 1)
+                low, high = bins[0], bins[-1] + 1
+                result[low:high] += np.bincount(bins - low, ys[owned], high - low)
+                counts[low:high] += np.bincount(bins - low, minlength=high - low)
+            elif method == 'linear':
+                result[first:last] = np.interp(grid, xs, ys)
+            else:
+                left = right - 1
+                result[first:last] = ys[np.where(grid - xs[left] <= xs[right] - grid, left, right)]
+            if maxGap is not None:
+                gaps = np.flatnonzero(xs[right] - xs[right - 1] > maxGap)
+                result[first + gaps] = np.nan
+        if method == 'mean':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for begin in range(0, count, LazyArray.chunkSize):
+                    result[begin:begin + LazyArray.chunkSize] /= counts[begin:begin + LazyArray.chunkSize]
+        return Graph(self.window, title=str(self.title) + " (resampled)", xLabel=self.xLabel, yLabel=self.yLabel,
+                     rawXData=UniformAxis(start, step, count), rawYData=result,
+                     autoScaleMagnitude=self.autoScaleMagnitude)
+
     def onClick(self, event):
         """Opens this Graph's GraphWindow if the event is within its axes and was a double click"""
         if event.inaxes is self.subplot and event.dblclick:
@@ -279,7 +769,82 @@ class Graph(object):
         self.graphWindow.open()
 
     def isSameX(self, other):
-        return np.array_equal(self.getRawData()[0], other.getRawData()[0])
+        """Returns whether other has the same x values as this Graph
+
+        Both Graphs' x data are interned first, so after their first comparison this is only an identity check.
+        """
+        x, otherX = self.getRawData()[0], other.getRawData()[0]
+        if x is otherX:
+            return True
+        if len(x) != len(otherX):
+            return False
+        if isinstance(x, UniformAxis) and isinstance(otherX, UniformAxis):
+            return x.isSameAs(otherX)
+        if isinstance(x, UniformAxis) or isinstance(otherX, UniformAxis):
+            return np.array_equal(x, otherX)
+        if np.asarray(x).dtype != np.asarray(otherX).dtype:
+            return np.array_equal(x, otherX)
+        return self.internX() is other.internX()
+
+    def internX(self):
+        """Replaces this Graph's x data with the canonical array of the same values, returning it"""
+        self.rawXData = Graph.internAxis(self.getRawData()[0])
+        return self.rawXData
+
+    @staticmethod
+    def isInterned(array):
+        """Returns whether array is a canonical x array"""
+        ref = Graph._axisIds.get(id(array))
+        return ref is not None and ref() is array
+
+    @staticmethod
+    def _isReadOnly(array):
+        """Returns whether array and every array it views are read-only, so that its values can't be changed"""
+        while isinstance(array, np.ndarray):
+            if array.flags.writeable:
+                return False
+            array = array.base
+        return array is None
+
+    @staticmethod
+    def internAxis(array):
+        """Returns the canonical array with the same values as array, making a read-only copy of array the canonical one
+        if there is none
+
+        Canonical arrays are shared between every Graph with those x values, so array itself is only used when neither
+        it nor anything it views can be written to; otherwise a change to the caller's array would change them all.
+        They are found by their length and a sample of their values, and only compared in full when an array is first
+        interned.
+        """
+        if isinstance(array, UniformAxis) or Graph.isInterned(array):
+            return array
+        array = np.asarray(array)
+        sample = array[np.linspace(0, len(array) - 1, min(len(array), Graph.axisSampleSize)).astype(int)] \
+            if array.ndim == 1 and len(array) else array
+        key = (array.dtype.str, array.shape, sample.tostring())
+        with Graph._axisLock:
+            candidates = [ref() for ref in Graph._axes.get(key, [])]
+            for canonical in candidates:
+                if canonical is not None and np.array_equal(canonical, array):
+                    return canonical
+            if not Graph._isReadOnly(array):
+                array = array.copy()
+                array.flags.writeable = False
+            identity = id(array)
+
+            def forget(ref):
+                with Graph._axisLock:
+                    if Graph._axisIds.get(identity) is ref:
+                        del Graph._axisIds[identity]
+                    refs = [r for r in Graph._axes.get(key, []) if r is not ref]
+                    if refs:
+                        Graph._axes[key] = refs
+                    else:
+                        Graph._axes.pop(key, None)
+            ref = weakref.ref(array, forget)
+            Graph._axisIds[identity] = ref
+            Graph._axes.setdefault(key, []).append(ref)
+        return array
 
     @staticmethod
     def useYForCall(function, *args):
@@ -302,13 +867,66 @@ class Graph(object):
         except AttributeError as a:
             raise MathExpression.ParseFailure(str(graph), a)
 
+    @staticmethod
+    def evaluateBlockwise(program, values):
+        """Evaluates a run of arithmetic over Graphs and numbers block by block, returning the resulting Graph
+
+        Meant to be used as the blockFunc of a MathExpression, which passes the run as a postfix program. Rather than
+        creating a full length array and a Graph for every operator, the run is built into a single LazyArray, which
+        combines each block of the operands while it is in cache. Unless any of the Graphs are lazy, it is computed
+        straight away into a single array. The result has the same data, title and metadata
+        as if the Graph operators had been used one at a time. Returns NotImplemented if any operand is not a Graph or
+        a number, if the Graphs don't share their x values, or if a number is on the left of '-', '/' or '^'.
+        """
+        graphs = [v for v in values if isinstance(v, Graph)]
+        if not graphs or not all(isinstance(v, (Graph, Number)) for v in values) or len(graphs[0]) == 0:
+            return NotImplemented
+        first = graphs[0]
+        if not all(first.isSameX(g) for g in graphs[1:] if g is not first):
+            return NotImplemented
+        # Step through the program without any data to find the Graph the result takes its metadata from, and its title
+        stack = []
+        for part in program:
+            if isinstance(part, int):
+                value = values[part]
+                stack.append((value, value.getTitle() if isinstance(value, Graph) else None))
+            else:
+                right, rightTitle = stack.pop()
+                left, leftTitle = stack.pop()
+                if isinstance(left, Graph):
+                    stack.append((left, leftTitle + " " + part + " " + (
+                        rightTitle if isinstance(right, Graph) else str(right))))
+                elif isinstance(right, Graph):
+                    if part not in ("+", "*"):
+                        return NotImplemented
+                    stack.append((right, rightTitle + " " + part + " " + str(left)))
+                else:
+                    stack.append((MathExpression.defaultFunctions[part](left, right), None))
+        metaSource, title = stack[0]
+        stack = []
+        for part in program:
+            if isinstance(part, int):
+                value = values[part]
+                stack.append(LazyArray.wrap(value.getRawData()[1]) if isinstance(value, Graph) else value)
+            else:
+                right = stack.pop()
+                stack.append(Graph._blockUfuncs[part](stack.pop(), right))
+        result = stack[0]
+        if not any(g.isLazy() for g in graphs):
+            result = result.materialize(chunkSize=Graph.blockSize)
+        g = Graph(metaSource.window)
+        g.__dict__.update(metaSource.getMetaData())
+        g.setRawData((first.getRawData()[0], result))
+        g.setTitle(title)
+        return g
+
     def __sub__(self, other):
         """Subtracts the y data of two graphs and returns the resulting Graph.
 
         Returns NotImplemented if used on a non-graph,
          non-number object or the data sets do not have the same x values.
         """
-        if isinstance(other, Graph) and np.array_equal(self.getRawData()[0], other.getRawData()[0]):
+        if isinstance(other, Graph) and self.isSameX(other):
             g = Graph(self.window)
             g.__dict__.update(self.getMetaData())
             g.setRawData((self.getRawData()[0], self.getRawData()[1] - other.getRawData()[1]))
@@ -328,7 +946,7 @@ class Graph(object):
 
         Returns NotImplemented if used on a non-graph,
          non-number object or the data sets do not have the same x values."""
-        if isinstance(other, Graph) and np.array_equal(self.getRawData()[0], other.getRawData()[0]):
+        if isinstance(other, Graph) and self.isSameX(other):
             g = Graph(self.window)
             g.__dict__.update(self.getMetaData())
             g.setRawData((self.getRawData()[0], self.getRawData()[1] + other.getRawData()[1]))
@@ -348,7 +966,7 @@ class Graph(object):
 
         Returns NotImplemented if used on a non-graph,
          non-number object or the data sets do not have the same x values."""
-        if isinstance(other, Graph) and np.array_equal(self.getRawData()[0], other.getRawData()[0]):
+        if isinstance(other, Graph) and self.isSameX(other):
             g = Graph(self.window)
             g.__dict__.update(self.getMetaData())
             g.setRawData((self.getRawData()[0], self.getRawData()[1] * other.getRawData()[1]))
@@ -371,7 +989,7 @@ class Graph(object):
 
         Returns NotImplemented if used on a non-graph,
          non-number object or the data sets do not have the same x values."""
-        if isinstance(other, Graph) and np.array_equal(self.getRawData()[0], other.getRawData()[0]):
+        if isinstance(other, Graph) and self.isSameX(other):
             g = Graph(self.window)
             g.__dict__.update(self.getMetaData())
             g.setRawData((self.getRawData()[0], self.getRawData()[1] / other.getRawData()[1]))
@@ -391,7 +1009,7 @@ class Graph(object):
 
         !! Modulo argument not implemented !!"""
         # TODO Modulo
-        if isinstance(other, Graph) and np.array_equal(self.getRawData()[0], other.getRawData()[0]):
+        if isinstance(other, Graph) and self.isSameX(other):
             g = Graph(self.window)
             g.__dict__.update(self.getMetaData())
             g.setRawData((self.getRawData()[0], np.power(self.getRawData()[1], other.getRawData()[1])))
@@ -412,6 +1030,78 @@ class Graph(object):
         return len(self.getRawData()[0])
 
 
+class Spectrogram(Graph):
+    """A Graph of how the spectrum of another Graph changes over time
+
+    The power spectral density at each time and frequency is kept in .power, with a row for each time and a column
+    for each of .frequencies, and is plotted as an image. As a Graph of x and y data, a Spectrogram is the frequency
+    with the most power at each time, which is what remains of it when saved in a project.
+    """
+    __author__ = "Thomas Schweich"
+
+    arrayAttrs = ('frequencies', 'power')
+
+    def __init__(self, window=None, times=None, frequencies=None, power=None, **kwargs):
+        if power is not None:
+            kwargs.update(rawXData=times, rawYData=np.asarray(frequencies[np.argmax(power[:, 1:], axis=1) + 1]))
+        Graph.__init__(self, window, **kwargs)  # Without power, as when restored from its x and y data, it's a Graph
+        self.frequencies = frequencies
+        self.power = power
+
+    def getImage(self, axes, begin=0, end=None):
+        """Returns (image data, extent) of the power from time index begin to end, with at most about one row and
+        column per pixel of axes
+
+        Where there are more times or frequencies than pixels, each pixel shows the greatest power among them, so that
+        narrow peaks aren't lost.
+        """
+        end = len(self.power) if end is None else min(end, len(self.power))
+        data = np.asarray(self.power[begin:end]).T
+        for axis, pixels in ((0, axes.bbox.height), (1, axes.bbox.width)):
+            size = int(math.ceil(data.shape[axis] / max(pixels, 1.0)))
+            if size > 1:
+                data = np.maximum.reduceat(data, np.arange(0, data.shape[axis], size), axis=axis)
+        times, frequencies = self.getRawData()[0], self.frequencies
+        xScale = 10 ** self.getMagnitudes()[0]
+        halfStep, halfBin = times.step / 2.0, frequencies.step / 2.0
+        extent = ((times[begin] - halfStep) / xScale, (times[end - 1] + halfStep) / xScale,
+                  frequencies[0] - halfBin, frequencies[len(frequencies) - 1] + halfBin)
+        return np.ma.masked_less_equal(data, 0), extent
+
+    def plot(self, subplot=None, mode='', maxPoints=None):
+        """Plots the power spectral density as an image, with a log color scale"""
+        if self.power is None:
+            return Graph.plot(self, subplot, mode, maxPoints)
+        sub = Graph._get_plotter(self, subplot)
+        axes = sub.gca() if sub is plt else sub
+        data, extent = self.getImage(axes)
+        image = axes.imshow(data, origin='lower', extent=extent, aspect='auto', interpolation='nearest',
+                            norm=LogNorm() if data.count() else None)
+        if sub is not plt:
+            self._artists = weakref.WeakKeyDictionary(getattr(self, '_artists', {}))
+            self._artists[sub] = (image, None)
+        self.setAxisLabels(subplot)
+
+    def updateView(self, subplot, xMin, xMax, maxPoints):
+        """Draws the times between xMin and xMax again in as much detail as subplot can show"""
+        if self.power is None:
+            return Graph.updateView(self, subplot, xMin, xMax, maxPoints)
+        image, view = getattr(self, '_artists', {}).get(subplot, (None, None))
+        if image is None:
+            return False
+        scale = 10 ** self.getMagnitudes()[0]
+        begin, end = self.getRawData()[0].searchsorted(np.array([xMin * scale, xMax * scale]), side='left')
+        begin, end = max(int(begin) - 1, 0), min(int(end) + 1, len(self.power))
+        size = subplot.bbox.width, subplot.bbox.height
+        if end <= begin or (begin, end, size) == view:
+            return False
+        self._artists[subplot] = (image, (begin, end, size))  # Before set_extent(), which sets limits
+        data, extent = self.getImage(subplot, begin, end)
+        image.set_data(data)
+        image.set_extent(extent)
+        return True
+
+
 def create(xData, yData):
     return Graph(rawXData=xData, rawYData=yData)
 
@@ -420,7 +1110,7 @@ def x(graph, index=None):
     if index is not None:
         return graph.getRawData()[0][index]
     else:
-        return graph.getRawData()[0]
+        return np.asarray(graph.getRawData()[0])
 
 
 def y(graph, index=None):
@@ -438,35 +1128,91 @@ def getSlice(graph, start, stop, step=1):
     return graph.slice(start, stop, step)
 
 
+def decimate(graph, factor):
+    return graph.decimate(factor)
+
+
+def resample(graph, step=None, maxGap=None):
+    return graph.resample(step, 'linear', maxGap)
+
+
+def resampleNearest(graph, step=None, maxGap=None):
+    return graph.resample(step, 'nearest', maxGap)
+
+
+def resampleMean(graph, step=None, maxGap=None):
+    return graph.resample(step, 'mean', maxGap)
+
+
+def lazy(graph):
+    """Returns a copy of graph whose operations are only computed when needed"""
+    g = Graph(graph.window)
+    g.__dict__.update(graph.getMetaData())
+    g.setRawData(graph.getRawData())
+    g.setLazy(True)
+    return g
+
+
+def compute(graph):
+    """Returns a copy of graph with its data computed"""
+    g = lazy(graph)
+    g.setLazy(False)
+    return g
+
+
+def density(graph):
+    """Returns a copy of graph which is plotted as the number of points in each pixel, keeping any log scale"""
+    g = Graph(graph.window)
+    g.__dict__.update(graph.getMetaData())
+    g.setRawData(graph.getRawData())
+    g.setGraphMode("density " + graph.mode if graph.mode in ("logx", "logy", "loglog") else "density")
+    return g
+
+
 def linearFit(graph):
-    return _safeFit(graph, lambda x, a, b: a * x + b)
+    return _fit(graph, 1)
 
 
 def quadraticFit(graph):
-    return _safeFit(graph, lambda x, a, b, c: a * x ** 2 + b * x + c)
+    return _fit(graph, 2)
 
 
 def cubicFit(graph):
-    return _safeFit(graph, lambda x, a, b, c, d: a * x ** 3 + b * x ** 2 + c * x + d)
+    return _fit(graph, 3)
 
 
 def quarticFit(graph):
-    return _safeFit(graph, lambda x, a, b, c, d, e: a * x ** 4 + b * x ** 3 + c * x ** 2 + d * x + e)
+    return _fit(graph, 4)
+
 
+def _fit(graph, degree):
+    """Returns a polynomial fit of degree, raising a RuntimeError if no fit is found
 
-def _safeFit(graph, fitFunction):
-    """Safely returns a fit, displaying an error message if no fit is found"""
+    Expression functions may run on worker threads, so the error is left for the caller to show.
+    """
     try:
-        return graph.getCurveFit(fitFunction=fitFunction)
+        return graph.getPolynomialFit(degree)
     except RuntimeError as r:
-        tkMessageBox.showerror("Fit", "Couldn't fit function.\n" + str(r))
+        raise RuntimeError("Couldn't fit function.\n" + str(r))
 
 
-def getFFT(graph):
-    gr = graph.getFFT() / ((2 * np.pi) ** .5)
+def getFFT(graph, pad=0):
+    gr = graph.getFFT(bool(pad)) / ((2 * np.pi) ** .5)
     gr.setTitle("FFT (LabView Scale Factor)")
     return gr
 
 
+def getPSD(graph, segmentLength=None):
+    return graph.getPSD(segmentLength)
+
+
+def getLombScargle(graph, maxFrequency=None):
+    return graph.getLombScargle(maxFrequency)
+
+
+def getSpectrogram(graph, segmentLength=None):
+    return graph.getSpectrogram(segmentLength)
+
+
 def getDispFFT(graph):
     return ((getFFT(graph) ** 2) / (1.0 / x(graph, 1) - x(graph, 0) * length(graph))) ** .5
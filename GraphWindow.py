@@ -43,6 +43,7 @@ class GraphWindow(Tk.Frame):
         self.addBox = None
         self.multBox = None
         self.customBox = None
+        self.spectralBox = None
         self.canvas = None
         self.f = None
         self.baseGroup = None
@@ -69,10 +70,12 @@ class GraphWindow(Tk.Frame):
             self.f = Figure(figsize=(2, 1), dpi=self.settings["DPI"])
             self.graphSubPlot = self.f.add_subplot(121)
             self.graph.plot(subplot=self.graphSubPlot, maxPoints=self.settings["Max Preview Points"])
+            Graph.Graph.connectViewUpdates(self.graphSubPlot, [self.graph], self.settings["Max Preview Points"])
             self.newSubPlot = self.f.add_subplot(122)
             self.newGraph = copy(self.graph)
             self.newGraph.setTitle("Transformation of " + str(self.graph.getTitle()))
             self.newGraph.plot(subplot=self.newSubPlot, maxPoints=self.settings["Max Preview Points"])
+            Graph.Graph.connectViewUpdates(self.newSubPlot, [self.newGraph], self.settings["Max Preview Points"])
             self.canvas = FigureCanvasTkAgg(self.f, self.window)
             self.canvas.draw()
             self.canvas.show()
@@ -154,6 +157,11 @@ class GraphWindow(Tk.Frame):
         end.insert(0, "End")
         self.addWidget(Tk.Button, parent=self.sliceBox, command=lambda: self.addSlice(sliceVar, start.get(), end.get()),
                        text="Preview")
+        self.addWidget(Tk.Label, parent=self.sliceBox, text="Keep every nth point, filtered against aliasing:")
+        factor = self.addWidget(Tk.Entry, parent=self.sliceBox)
+        factor.insert(0, "10")
+        self.addWidget(Tk.Button, parent=self.sliceBox, command=lambda: self.addDecimation(factor.get()),
+                       text="Decimate")
 
         # ADD
         self.addBox = self.addWidget(Tk.Radiobutton, command=self.refreshOptions,
@@ -213,6 +221,21 @@ class GraphWindow(Tk.Frame):
         parseButton = self.addWidget(Tk.Button, parent=self.customBox, text="Parse Expression")
         parseButton.configure(command=lambda: self.parseExpression(textBox.get(1.0, Tk.END), parseButton))
 
+        # SPECTRAL
+        self.spectralBox = self.addWidget(Tk.Radiobutton, command=self.refreshOptions, text="Spectral Options",
+                                          variable=self.radioVar, value=5)
+        self.spectralBox.val = 5
+        self.addWidget(Tk.Label, parent=self.spectralBox, text="Segment length (points, blank for default):")
+        segmentLength = self.addWidget(Tk.Entry, parent=self.spectralBox)
+        self.addWidget(Tk.Button, parent=self.spectralBox, text="FFT",
+                       command=lambda: self.addSpectrum(self.graph.getFFT))
+        self.addWidget(Tk.Button, parent=self.spectralBox, text="Lomb-Scargle (Uneven Spacing)",
+                       command=lambda: self.addSpectrum(self.graph.getLombScargle))
+        self.addWidget(Tk.Button, parent=self.spectralBox, text="Power Spectral Density",
+                       command=lambda: self.addSpectrum(self.graph.getPSD, segmentLength.get()))
+        self.addWidget(Tk.Button, parent=self.spectralBox, text="Spectrogram",
+                       command=lambda: self.addSpectrum(self.graph.getSpectrogram, segmentLength.get()))
+
         # TODO Cases with multiple graphs of the same title
         # TODO Cases without matching graphs
 
@@ -264,7 +287,8 @@ class GraphWindow(Tk.Frame):
         self.newGraph.setYLabel(yLabel)
         self.f.delaxes(self.newSubPlot)
         self.newSubPlot = self.f.add_subplot(122)
-        self.newGraph.plot(subplot=self.newSubPlot)
+        self.newGraph.plot(subplot=self.newSubPlot, maxPoints=self.settings["Max Preview Points"])
+        Graph.Graph.connectViewUpdates(self.newSubPlot, [self.newGraph], self.settings["Max Preview Points"])
         self.canvas.show()
         window.destroy()
 
@@ -295,12 +319,14 @@ class GraphWindow(Tk.Frame):
         self.newSubPlot = self.f.add_subplot(122)
         referenceGraph = copy(self.graph)
         self.newGraph = graph
-        referenceGraph.plot(subplot=self.newSubPlot)
+        referenceGraph.plot(subplot=self.newSubPlot, maxPoints=self.settings["Max Preview Points"])
         try:
-            self.newGraph.plot(subplot=self.newSubPlot)
+            self.newGraph.plot(subplot=self.newSubPlot, maxPoints=self.settings["Max Preview Points"])
         except AttributeError:
             self.newGraph = referenceGraph
             raise
+        Graph.Graph.connectViewUpdates(self.newSubPlot, [referenceGraph, self.newGraph],
+                                       self.settings["Max Preview Points"])
         self.canvas.show()
 
     def plotAlone(self, graph):
@@ -308,7 +334,8 @@ class GraphWindow(Tk.Frame):
         self.f.delaxes(self.newSubPlot)
         self.newSubPlot = self.f.add_subplot(122)
         self.newGraph = graph
-        self.newGraph.plot(subplot=self.newSubPlot)
+        self.newGraph.plot(subplot=self.newSubPlot, maxPoints=self.settings["Max Preview Points"])
+        Graph.Graph.connectViewUpdates(self.newSubPlot, [self.newGraph], self.settings["Max Preview Points"])
         self.canvas.show()
 
     def plotOnThisAxis(self):
@@ -327,10 +354,10 @@ class GraphWindow(Tk.Frame):
         self.graph.window.removeGraph(self.graph)
         self.close()
 
-    def safeFit(self, fitFunction):
-        """Safely returns a fit, displaying an error message if no fit is found"""
+    def safeFit(self, degree):
+        """Safely returns a polynomial fit of degree, displaying an error message if no fit is found"""
         try:
-            return self.graph.getCurveFit(fitFunction=fitFunction)
+            return self.graph.getPolynomialFit(degree)
         except RuntimeError as r:
             tkMessageBox.showerror("Fit", "Couldn't fit function.\n" + str(r))
             self.window.lift()
@@ -338,7 +365,11 @@ class GraphWindow(Tk.Frame):
     def safeSinFit(self):
         """ Safely returns a sinusoidal fit """
         try:
-            return self.graph.getSinFit()
+            fit = self.graph.getSinFit(timeBudget=self.settings["Fit Time Limit"])
+            if not fit.fitReport.startswith("Converged"):
+                tkMessageBox.showwarning("Fit", fit.fitReport)
+                self.window.lift()
+            return fit
         except RuntimeError as r:
             tkMessageBox.showerror("Fit", "Couldn't fit function.\n" + str(r))
             self.window.lift()
@@ -349,21 +380,19 @@ class GraphWindow(Tk.Frame):
 
     def quarticFit(self):
         """Plots a quartic fit of the Graph's data with reference"""
-        self.plotWithReference(self.safeFit(
-            fitFunction=lambda x, a, b, c, d, e: a * x ** 4 + b * x ** 3 + c * x ** 2 + d * x + e))
+        self.plotWithReference(self.safeFit(4))
 
     def cubicFit(self):
         """Plots a cubic fit of the Graph's data with reference"""
-        self.plotWithReference(
-            self.safeFit(fitFunction=lambda x, a, b, c, d: a * x ** 3 + b * x ** 2 + c * x + d))
+        self.plotWithReference(self.safeFit(3))
 
     def quadraticFit(self):
         """Plots a quadratic fit of the Graph's data with reference"""
-        self.plotWithReference(self.safeFit(fitFunction=lambda x, a, b, c: a * x ** 2 + b * x + c))
+        self.plotWithReference(self.safeFit(2))
 
     def linearFit(self):
         """Plots a linear fit of the .graph data with reference"""
-        self.plotWithReference(self.safeFit(fitFunction=lambda x, a, b: a * x + b))
+        self.plotWithReference(self.safeFit(1))
 
     def addSlice(self, tkVar, begin, end):
         """Plots a slice of .graph alone"""
@@ -372,9 +401,28 @@ class GraphWindow(Tk.Frame):
             self.plotAlone(self.graph.slice(begin=float(begin), end=float(end)))
         # By x value
         elif tkVar.get() == 1:
-            results = np.searchsorted(self.graph.getRawData()[0], np.array([np.float64(begin), np.float64(end)]))
+            results = self.graph.getRawData()[0].searchsorted(np.array([np.float64(begin), np.float64(end)]))
             self.plotAlone(self.graph.slice(begin=results[0], end=results[1]))
 
+    def addSpectrum(self, transform, segmentLength=None):
+        """Plots the Graph returned by transform, given segmentLength if one was entered, alone"""
+        try:
+            if segmentLength and segmentLength.strip():
+                self.plotAlone(transform(int(segmentLength)))
+            else:
+                self.plotAlone(transform())
+        except (ValueError, RuntimeError) as e:
+            tkMessageBox.showerror("Spectrum", "Couldn't find spectrum.\n" + str(e))
+            self.window.lift()
+
+    def addDecimation(self, factor):
+        """Plots .graph decimated by factor alone"""
+        try:
+            self.plotAlone(self.graph.decimate(int(factor)))
+        except ValueError as e:
+            tkMessageBox.showerror("Decimate", "Couldn't decimate graph.\n" + str(e))
+            self.window.lift()
+
     def addAddition(self, val):
         """Plots a Graph of .graph + val alone"""
         self.plotAlone(self.graph + val)
@@ -442,7 +490,8 @@ class GraphWindow(Tk.Frame):
             for graph in axis:
                 graphVars[graph.getTitle()] = copy(graph)
         print graphVars
-        exp = MathExpression(str(expression), modules=(Graph, np, math), variables=graphVars, fallbackFunc=self.graph.useYForCall)
+        exp = MathExpression(str(expression), modules=(Graph, np, math), variables=graphVars,
+                             fallbackFunc=self.graph.useYForCall, blockFunc=self.graph.evaluateBlockwise)
         tkButton.config(text="Loading...", relief=Tk.SUNKEN)
         self.graph.window.update()
         try:
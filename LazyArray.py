@@ -0,0 +1,285 @@
+"""Arrays whose values are only computed when they are needed, a chunk at a time
+
+A LazyArray is a node in a graph of operations over source arrays (such as the memmaps created by
+MainWindow.loadData). Arithmetic and NumPy ufuncs on LazyArrays build new nodes rather than computing anything, and
+slicing a LazyArray (including with a step, as when decimating for a preview) only computes the values in the slice.
+Converting a LazyArray to an array, or calling materialize(), computes it chunkSize values at a time, into a memmap
+if the result is larger than memoryLimit, so that results larger than memory can be computed.
+"""
+import numpy as np
+from numpy.lib.format import open_memmap
+from numbers import Number
+import tempfile
+import os
+
+__author__ = "Thomas Schweich"
+
+
+class LazyArray(object):
+    """Base class of the nodes of a lazily evaluated 1D array
+
+    Subclasses implement compute(start, stop), returning the values from start to stop as an ndarray, and
+    take(indices), returning the values at an array of indices.
+    """
+    __author__ = "Thomas Schweich"
+
+    chunkSize = 1 << 20  # Values computed at a time
+    memoryLimit = 1 << 28  # Results larger than this many bytes are materialized into a memmap in tempDir
+    tempDir = tempfile.gettempdir()
+    ndim = 1
+
+    def __init__(self, length, dtype):
+        self.length = int(length)
+        self.dtype = np.dtype(dtype)
+        self._value = None
+
+    @staticmethod
+    def wrap(array):
+        """Returns array as a LazyArray, wrapping it in a Source unless it already is one"""
+        return array if isinstance(array, LazyArray) else Source(array)
+
+    def compute(self, start, stop):
+        raise NotImplementedError
+
+    def take(self, indices):
+        raise NotImplementedError
+
+    @property
+    def shape(self):
+        return self.length,
+
+    @property
+    def size(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        return self.length * self.dtype.itemsize
+
+    def __len__(self):
+        return self.length
+
+    def iterChunks(self, chunkSize=None):
+        """Yields the values of the array as consecutive ndarrays of at most chunkSize values"""
+        chunkSize = chunkSize or self.chunkSize
+        for start in range(0, self.length, chunkSize):
+            yield self._compute(start, min(start + chunkSize, self.length))
+
+    def _compute(self, start, stop):
+        return self._value[start:stop] if self._value is not None else self.compute(start, stop)
+
+    def _take(self, indices):
+        return self._value[indices] if self._value is not None else self.take(indices)
+
+    @staticmethod
+    def allocate(shape, dtype):
+        """Returns an uninitialized array of shape and dtype, which is a memmap in tempDir if it is larger than
+        memoryLimit"""
+        dtype = np.dtype(dtype)
+        if int(np.prod(shape)) * dtype.itemsize > LazyArray.memoryLimit:
+            handle, path = tempfile.mkstemp(suffix=".npy", dir=LazyArray.tempDir)
+            os.close(handle)
+            result = open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+            try:
+                os.remove(path)  # The memmap stays usable, and its space is freed once it is no longer used
+            except OSError:
+                pass  # Windows doesn't allow removing files which are in use
+            return result
+        return np.empty(shape, dtype=dtype)
+
+    def materialize(self, chunkSize=None):
+        """Computes and returns the full array, which is kept so that it is only computed once"""
+        if self._value is None:
+            result = LazyArray.allocate(self.shape, self.dtype)
+            start = 0
+            for chunk in self.iterChunks(chunkSize):
+                result[start:start + len(chunk)] = chunk
+                start += len(chunk)
+            self._value = result
+        return self._value
+
+    def __array__(self, dtype=None):
+        array = self.materialize()
+        return array.astype(dtype) if dtype is not None and np.dtype(dtype) != array.dtype else array
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            begin, end, step = index.indices(self.length)
+            return Slice(self, begin, step, len(xrange(begin, end, step)))
+        if isinstance(index, (int, long, np.integer)):
+            if index < 0:
+                index += self.length
+            if not 0 <= index < self.length:
+                raise IndexError("index %d is out of bounds for axis with size %d" % (index, self.length))
+            return self._compute(index, index + 1)[0]
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        return self._take(np.where(index < 0, index + self.length, index))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        """Builds an Elementwise node for ufuncs called on LazyArrays, computing anything else straight away"""
+        if method == "__call__" and ufunc.nout == 1 and not kwargs and \
+                all(isinstance(i, (LazyArray, Number)) or (isinstance(i, np.ndarray) and i.ndim == 0) or
+                    (isinstance(i, np.ndarray) and i.shape == self.shape) for i in inputs):
+            return Elementwise(ufunc, [i[()] if isinstance(i, np.ndarray) and i.ndim == 0 else
+                                       Source(i) if isinstance(i, np.ndarray) else i for i in inputs])
+        inputs = [np.asarray(i) if isinstance(i, LazyArray) else i for i in inputs]
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(o) if isinstance(o, LazyArray) else o for o in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __add__(self, other):
+        return np.add(self, other)
+
+    def __radd__(self, other):
+        return np.add(other, self)
+
+    def __sub__(self, other):
+        return np.subtract(self, other)
+
+    def __rsub__(self, other):
+        return np.subtract(other, self)
+
+    def __mul__(self, other):
+        return np.multiply(self, other)
+
+    def __rmul__(self, other):
+        return np.multiply(other, self)
+
+    def __div__(self, other):
+        return np.divide(self, other)
+
+    def __rdiv__(self, other):
+        return np.divide(other, self)
+
+    def __truediv__(self, other):
+        return np.true_divide(self, other)
+
+    def __rtruediv__(self, other):
+        return np.true_divide(other, self)
+
+    def __pow__(self, other):
+        return np.power(self, other)
+
+    def __rpow__(self, other):
+        return np.power(other, self)
+
+    def __neg__(self):
+        return np.negative(self)
+
+    def __abs__(self):
+        return np.absolute(self)
+
+    def _reduce(self, combine, axis=None, out=None, **kwargs):
+        """Reduces the array a chunk at a time with combine(previous result, chunk), or returns None if the arguments
+        need the full array"""
+        if axis not in (None, 0) or out is not None or kwargs:
+            return None
+        result = None
+        for chunk in self.iterChunks():
+            result = combine(result, chunk)
+        return result
+
+    def min(self, axis=None, out=None, **kwargs):
+        result = self._reduce(lambda r, c: c.min() if r is None else min(r, c.min()), axis, out, **kwargs)
+        return result if result is not None else np.asarray(self).min(axis=axis, out=out, **kwargs)
+
+    def max(self, axis=None, out=None, **kwargs):
+        result = self._reduce(lambda r, c: c.max() if r is None else max(r, c.max()), axis, out, **kwargs)
+        return result if result is not None else np.asarray(self).max(axis=axis, out=out, **kwargs)
+
+    def sum(self, axis=None, dtype=None, out=None, **kwargs):
+        if dtype is not None:
+            kwargs['dtype'] = dtype
+        result = self._reduce(lambda r, c: c.sum() if r is None else r + c.sum(), axis, out, **kwargs)
+        return result if result is not None else np.asarray(self).sum(axis=axis, out=out, **kwargs)
+
+    def mean(self, axis=None, dtype=None, out=None, **kwargs):
+        if axis not in (None, 0) or dtype is not None or out is not None or kwargs:
+            return np.asarray(self).mean(axis=axis, dtype=dtype, out=out, **kwargs)
+        return self.sum() / float(self.length)
+
+    def __repr__(self):
+        return "%s(length=%d, dtype=%s)" % (self.__class__.__name__, self.length, self.dtype)
+
+
+class Source(LazyArray):
+    """A LazyArray of an existing array-like, such as an ndarray, memmap or Graph.UniformAxis"""
+
+    def __init__(self, array):
+        LazyArray.__init__(self, len(array), getattr(array, 'dtype', np.float64))
+        self.array = array
+
+    def compute(self, start, stop):
+        return np.asarray(self.array[start:stop])
+
+    def take(self, indices):
+        return np.asarray(self.array[indices])
+
+    def materialize(self, chunkSize=None):
+        return np.asarray(self.array)
+
+
+class Elementwise(LazyArray):
+    """A LazyArray of a ufunc applied to LazyArrays and numbers, computed a chunk at a time"""
+
+    def __init__(self, ufunc, operands):
+        lengths = set(len(o) for o in operands if isinstance(o, LazyArray))
+        if len(lengths) != 1:
+            raise ValueError("operands could not be broadcast together with shapes %s" %
+                             " ".join("(%d,)" % l for l in sorted(lengths)))
+        dtype = ufunc(*[np.empty(0, o.dtype) if isinstance(o, LazyArray) else o for o in operands]).dtype
+        LazyArray.__init__(self, lengths.pop(), dtype)
+        self.ufunc = ufunc
+        self.operands = operands
+
+    def compute(self, start, stop):
+        return self.ufunc(*[o._compute(start, stop) if isinstance(o, LazyArray) else o for o in self.operands])
+
+    def take(self, indices):
+        return self.ufunc(*[o._take(indices) if isinstance(o, LazyArray) else o for o in self.operands])
+
+
+class Slice(LazyArray):
+    """A LazyArray of every step-th value of source from start, which only computes the values it holds"""
+
+    def __init__(self, source, start, step, length):
+        if isinstance(source, Slice):  # Slices of slices refer straight to the original source
+            source, start, step = source.source, source.start + source.step * start, source.step * step
+        LazyArray.__init__(self, length, source.dtype)
+        self.source = source
+        self.start = start
+        self.step = step
+
+    def compute(self, start, stop):
+        if self.step == 1:
+            return self.source._compute(self.start + start, self.start + stop)
+        return self.source._take(self.start + self.step * np.arange(start, stop))
+
+    def take(self, indices):
+        return self.source._take(self.start + self.step * np.asarray(indices))
+
+
+class Deferred(LazyArray):
+    """A LazyArray of func applied to the whole of source, for operations such as FFTs which can't be done in chunks
+
+    func is only called, with source as an ndarray, when a value is first needed.
+    """
+
+    def __init__(self, func, source, length, dtype=np.float64):
+        LazyArray.__init__(self, length, dtype)
+        self.func = func
+        self.source = source
+
+    def materialize(self, chunkSize=None):
+        if self._value is None:
+            self._value = np.asarray(self.func(np.asarray(self.source)), dtype=self.dtype)
+            self.source = None  # No longer needed
+        return self._value
+
+    def compute(self, start, stop):
+        return self.materialize()[start:stop]
+
+    def take(self, indices):
+        return self.materialize()[indices]
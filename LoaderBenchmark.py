@@ -0,0 +1,63 @@
+"""Compares loading a large text file with DataLoader.loadText() and with loadTextParallel() on more and more processes
+
+Usage: python LoaderBenchmark.py [lines] [repeats]
+"""
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+import numpy as np
+import DataLoader
+
+__author__ = "Thomas Schweich"
+
+
+def writeData(path, lines, chunkSize=1 << 20):
+    """Writes lines of tab separated time, value and flag columns to path, with a few NaNs among the values"""
+    with open(path, 'w') as f:
+        for start in range(0, lines, chunkSize):
+            index = np.arange(start, min(start + chunkSize, lines))
+            values = np.sin(index * 1e-3) + np.random.normal(0, .1, len(index))
+            values[index % 9973 == 0] = np.nan
+            np.savetxt(f, np.column_stack((index * 1e-2, values, index % 2)), delimiter="\t", fmt="%.6f")
+
+
+def best(func, repeats):
+    """Returns (the fastest of repeats calls to func in seconds, the result of the last call)"""
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def run(lines=10000000, repeats=3):
+    handle, path = tempfile.mkstemp(suffix=".txt")
+    os.close(handle)
+    try:
+        writeData(path, lines)
+        size = os.path.getsize(path)
+        sequential, expected = best(lambda: DataLoader.loadText(path), repeats)
+        results = [("loadText", sequential)]
+        processes = 1
+        while True:
+            elapsed, data = best(lambda: DataLoader.loadTextParallel(path, processes=processes), repeats)
+            if not all(np.array_equal(a, b) for a, b in zip(expected, data)):
+                raise AssertionError("loadTextParallel() on %d processes disagrees with loadText()" % processes)
+            results.append(("%d processes" % processes, elapsed))
+            if processes >= cpu_count():
+                break
+            processes = min(processes * 2, cpu_count())
+    finally:
+        os.remove(path)
+    print "%d lines (%.1f MB), %d points after cleaning" % (lines, size / 1e6, len(expected[0]))
+    print "%14s %10s %10s %9s" % ("Loader", "Time (s)", "MB/s", "Speedup")
+    for name, elapsed in results:
+        print "%14s %10.2f %10.1f %8.2fx" % (name, elapsed, size / 1e6 / elapsed, sequential / elapsed)
+    return results
+
+
+if __name__ == "__main__":
+    run(lines=int(sys.argv[1]) if len(sys.argv) > 1 else 10000000, repeats=int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -4,18 +4,20 @@ import os
 import Tkinter as Tk
 import matplotlib.pyplot as plt
 import numpy as np
-from numpy.lib.format import open_memmap
-import pandas as pd
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
 from matplotlib.backend_bases import key_press_handler
 from matplotlib.figure import Figure
 from Graph import Graph
+from LazyArray import LazyArray
 import tkFileDialog
+import tkMessageBox
 import FileDialog
 import math
 import json
 import shutil
 from GraphSelector import GraphSelector
+from PlotManager import PlotManager
+import DataLoader
 
 
 class MainWindow(Tk.Tk):
@@ -52,6 +54,7 @@ class MainWindow(Tk.Tk):
         self.toolbar = NavigationToolbar2TkAgg(self.canvas, self)
         self.toolbar.update()
         self.canvas._tkcanvas.pack(side=Tk.TOP, fill=Tk.BOTH, expand=1)
+        self.plotManager = PlotManager(self.fig, self.settings["Max Plot Points"])
         self.canvas.mpl_connect("button_press_event", lambda event: self.onClick(event))
         self.canvas.mpl_connect("key_press_event", lambda event: self.on_key_event(event))  # Buggy??
 
@@ -66,7 +69,11 @@ class MainWindow(Tk.Tk):
         self.graphs = graphs
 
     def saveProject(self):
-        """Saves this window's graphs and their metadata"""
+        """Saves this window's graphs and their metadata
+
+        The data of lazy Graphs is computed first, a chunk at a time (see LazyArray.materialize()). The project is
+        written to a temporary file which then replaces path, so a failed save leaves no partial project behind.
+        """
         path = tkFileDialog.asksaveasfilename(defaultextension=".gee.npy",
                                               filetypes=[("WIZ Project", ".gee.npy")], parent=self)
         if not path: return
@@ -78,11 +85,21 @@ class MainWindow(Tk.Tk):
             for j, graph in enumerate(axis):
                 rawdata[i].append([])
                 metadata[i].append([])
-                rawdata[i][j] = graph.getRawData()
+                rawdata[i][j] = tuple(a.materialize() if isinstance(a, LazyArray) else a for a in graph.getRawData())
                 metadata[i][j] = graph.getMetaData()
         print "Length of raw data %d" % len(rawdata), metadata
         proj = np.array([rawdata, metadata])
-        np.save(path, proj)
+        temp = path + ".tmp"
+        try:
+            with open(temp, 'wb') as f:
+                np.save(f, proj)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+        except Exception as e:
+            if os.path.exists(temp):
+                os.remove(temp)
+            tkMessageBox.showerror("Save Project", "Couldn't save the project.\n" + str(e))
 
     @staticmethod
     def loadProject(path, destroyTk=None):
@@ -121,71 +138,62 @@ class MainWindow(Tk.Tk):
 
     @staticmethod
     def loadData(path, clean=True, chunkRead=True, chunkSize=100000, tkProgress=None, tkRoot=None, xCol=0, yCol=1,
-                 header=None):
+                 header=None, tempDir="/tmp", uniformX=True, processes=1, cache=None, rows=None, xRange=None):
         """Loads data depending on file type, returning the resulting numpy array.
 
         With clean=True, removes non-finite values from the data stored at the path
-        With chunkRead=True, the number of lines in the file are estimated and a memmap is created to store the data.
-        The data is then loaded into the memmap 100,000 points at a time.
+        With chunkRead=True, text files are read in one pass of chunkSize lines at a time into a memmap for each column,
+        cleaning each chunk as it is read (see DataLoader.loadText()). The memmaps are created in tempDir.
+        With processes other than 1 (None for one per CPU), text files larger than DataLoader.rangeSize are parsed in
+        that many processes at once (see DataLoader.loadTextParallel()).
+        With a DataLoader.LoadCache as cache, text files read in chunks are stored in it once parsed, and loading the
+        same file with the same options again maps the stored data instead.
+        With rows or xRange, only that range of rows or of x values of a text file read in chunks is parsed (see
+        DataLoader.loadText()). If a DataLoader.RowIndex of the file has been saved beside it, it is used to seek to the
+        range, and otherwise one is built in the background for later range loads.
+        With uniformX=True, evenly spaced x data is returned as a Graph.UniformAxis rather than as an array.
         """
         ftype = path[path.rfind("."):]
-        if ftype == ".npy":
-            xData, yData = np.load(path, mmap_mode="r+")
+        options = (xCol, yCol, header, clean, rows, xRange)
+        cached = cache.get(path, options) if cache and ftype != ".npy" and chunkRead else None
+        if cached:
+            print "Loaded parsed data of %s from the cache" % path
+            xData, yData = cached
+        elif ftype != ".npy" and chunkRead:
+            if not os.path.exists(tempDir):
+                os.makedirs(tempDir)
+                print "Created tmp directory"
+            progress = (lambda: (tkProgress.step(), tkRoot.update())) if tkProgress and tkRoot else None
+            if processes != 1 and rows is None and xRange is None and os.path.getsize(path) > DataLoader.rangeSize:
+                xData, yData = DataLoader.loadTextParallel(path, xCol=xCol, yCol=yCol, header=header,
+                                                           chunkSize=chunkSize, clean=clean, tempDir=tempDir,
+                                                           processes=processes, progress=progress)
+            else:
+                index = DataLoader.RowIndex.open(path, header, xCol, build=False) if rows or xRange else None
+                xData, yData = DataLoader.loadText(path, xCol=xCol, yCol=yCol, header=header, chunkSize=chunkSize,
+                                                   clean=clean, tempDir=tempDir, progress=progress, rows=rows,
+                                                   xRange=xRange, index=index)
+                if (rows or xRange) and index is None:
+                    DataLoader.RowIndex.buildInBackground(path, header, xCol)
+            if cache:
+                cache.put(path, options, xData, yData)
         else:
-            if chunkRead:
-                lineSize = 0
-                with open(path) as f:
-                    '''
-                    for i, line in enumerate(f):
-                        if i == 100000:
-                            lineSize += sys.getsizeof(line)
-                            break
-                        else:
-                            lineSize += sys.getsizeof(line)
-                    '''
-                    numLines = sum(1 for _ in f)
-                    f.seek(0, 0)
-                '''
-                if lineSize:
-                    print "Line size: %d" % lineSize
-                    approxLines = numLines  # os.path.getsize(path) / (lineSize / 100000)
-                    print "approxLines: %d" % approxLines
-                else:
-                    raise ValueError("Couldn't find first line")
-                '''
-                if not os.path.exists("/tmp"):
-                    os.makedirs("/tmp")
-                    print "Created tmp directory"
-                else:
-                    print "/tmp already exists; using existing"
-                num = 0
-                while os.path.exists("/tmp/arr%s.npy" % str(num)):
-                    num += 1
-                with open("/tmp/arr%s.npy" % str(num), "w+") as tempFile:
-                    mmap = open_memmap(tempFile.name, mode='w+', dtype=np.float64, shape=(numLines, 2))
-                    #  hd = h5py.File("project.hdf5")
-                    #  mmap = hd.create_group("Original").create_dataset("Raw", (numLines, 2), dtype=np.float64)
-                    #  pass  # for below v
-                #  mmap = np.ndarray(dtype=np.float64, shape=(numLines, 2))
-                # Parse "chunk size" number points at a time to avoid overflow
-                n = 0
-                for chunk in pd.read_table(path, chunksize=chunkSize, dtype=np.float64, usecols=[xCol, yCol],
-                                           header=header):
-                    if tkProgress and tkRoot:
-                        tkProgress.step()
-                        tkRoot.update()
-                    mmap[n: n + chunk.shape[0]] = chunk.values
-                    n += chunk.shape[0]
-                    #  print "Chunk read"
-                xData, yData = np.trim_zeros(mmap[:,0]), np.trim_zeros(mmap[:,1])
+            if ftype == ".npy":
+                xData, yData = np.load(path, mmap_mode="r+")
             else:
                 xData, yData = np.loadtxt(path, unpack=True, dtype=np.float64)
-        if clean:
-            xFinite = np.isfinite(xData)
-            yFinite = np.isfinite(yData)
-            finitePoints = np.logical_and(xFinite, yFinite)
-            xData = xData[finitePoints]
-            yData = yData[finitePoints]
+            if clean:
+                xFinite = np.isfinite(xData)
+                yFinite = np.isfinite(yData)
+                finitePoints = np.logical_and(xFinite, yFinite)
+                xData = xData[finitePoints]
+                yData = yData[finitePoints]
+        if uniformX:
+            from Graph import UniformAxis
+            uniform = UniformAxis.fromArray(xData)
+            if uniform:
+                print "X data is evenly spaced: %s" % str(uniform)
+                xData = uniform
         return xData, yData
         # TODO .sac files, HDF5 format
 
@@ -268,8 +276,10 @@ class MainWindow(Tk.Tk):
         GraphSelector(self, graphsInAxis).populate()
 
     def plotGraphs(self):
-        """Plots all graphs in the MainWindows .graphs list, creating a button for each which isn't shown"""
-        self.fig.clear()
+        """Plots all graphs in the MainWindows .graphs list, creating a button for each which isn't shown
+
+        Only the graphs which were added, changed, shown or hidden since the last call are drawn again (see PlotManager)
+        """
         self.clearButtons()
         for axis in self.graphs:
             for graph in axis:
@@ -282,24 +292,7 @@ class MainWindow(Tk.Tk):
                     if graph.isShown():
                         axesToShow.append(axis)
                         break
-        length = len(axesToShow)
-        rows = math.ceil(length / 2.0)
-        subplots = [self.fig.add_subplot(rows, 1 if length == 1 else 2, index + 1)
-                    for index in range(0, length)]
-        for idx, axis in enumerate(axesToShow):
-            master = None
-            for g in axis:
-                if g.isShown() and not g.master:
-                    g.setSubplot(subplots[idx])
-                    g.plot()
-                if g.master:
-                    g.setSubplot(subplots[idx])
-                    master = g
-            if master:
-                master.plot()  # Ensures master is plotted last, thus giving the axis its metadata
-            else:
-                axis[-1].master = True
-        self.canvas.draw()
+        self.plotManager.update(axesToShow)
         for button in self.buttons:
             button.pack(side=Tk.LEFT, fill=Tk.X, expand=1)
 
@@ -330,10 +323,8 @@ def generateEQPGraphs(window):
     driftRm.setTitle("Drift Removed")
     unitConverted = window.addGraph(driftRm.convertUnits(yMultiplier=1.0 / 142857.0, yLabel="Position (rad)"),
                                     plot=False)
-    slice = unitConverted
-    sliceX, sliceY = slice.getRawData()
-    xFourier = np.linspace(sliceX[0], sliceX[-1], num=len(sliceX))
-    sliceAveraged = window.addGraph(Graph(window, title="Averaged Intervals", rawXData=xFourier, rawYData=sliceY))
+    sliceAveraged = window.addGraph(unitConverted.resample())
+    sliceAveraged.setTitle("Averaged Intervals")
     sliceFFT = sliceAveraged.getFFT()
     sliceFFT.setTitle("FFT")
     window.addGraph(sliceFFT)
@@ -27,10 +27,16 @@ class MathExpression:
     be a single string. Parsing is completed in groups of 3 in the format token + operator + token. This is done
     iteratively. Expressions are recursively broken into sub-expressions through
     the use of matching parenthesis, and evaluated from the inside out.
+    Each string is parsed only once into a tree of Token, Operation and Call nodes (see parse()). Trees are cached by
+    expression string, so evaluating the same string again only walks its tree. The original token-list evaluator
+    remains available as evaluateExpression().
     Function calls are evaluated in the format func(arg0, arg1...). Kwargs are not supported. A
     backup function in the format  backup(func, *args) can be specified to handle arguments which are passed to a
     function but are of improper type; for instance, using only the first index of an array as arguments
     for certain functions, etc.
+    A block function in the format block(program, values) can be specified to evaluate a whole run of arithmetic at
+    once. program is the run in postfix order, where integers index values (the already evaluated operands) and
+    strings are operators. It may return NotImplemented, in which case the run is combined as usual.
     """
 
     __author__ = "Thomas Schweich"
@@ -48,13 +54,28 @@ class MathExpression:
                  {"/": forceReversible(operator.div), "*": forceReversible(operator.mul)},
                  {"+": forceReversible(operator.add), "-": forceReversible(operator.sub)}]
     modules = (np, math)
+    defaultFunctions = {o: f for d in operators for o, f in d.items() if f is not None}
 
-    def __init__(self, expression, variables=None, operators=operators, modules=modules, fallbackFunc=None):
+    # Parsed trees shared between every MathExpression, keyed by (expression string, operator grammar)
+    _trees = {}
+    maxCachedTrees = 512
+
+    def __init__(self, expression, variables=None, operators=operators, modules=modules, fallbackFunc=None,
+                 blockFunc=None):
         self.variables = variables if variables is not None else {}
         self.operators = operators if operators is not None else MathExpression.operators
         self.modules = modules if modules is not None else MathExpression.modules
         self.fallbackFunc = fallbackFunc
-        self.expression = self.genFromString(expression)
+        self.blockFunc = blockFunc
+        self.string = expression
+        self.functions = {o: f for d in self.operators for o, f in d.items() if f is not None}
+        cached = MathExpression._trees.get((expression, self._grammar()))
+        if cached:
+            tokens, self.tree = cached
+            self.expression = list(tokens)
+        else:
+            self.expression = self.genFromString(expression)
+            self.tree = None
         self.loops = 0
         self.result = None
 
@@ -72,8 +93,129 @@ class MathExpression:
         return Thread(target=self.evaluate())
 
     def evaluate(self):
-        """Calls evaluateExpression() on .expression"""
-        self.expression = self.evaluateExpression(self.expression)
+        """Evaluates the parsed tree of the expression, replacing .expression with the result"""
+        self.expression = self.evaluateTree(self.getTree())
+
+    def _grammar(self):
+        return MathExpression.getGrammar(self.operators)
+
+    @staticmethod
+    def getGrammar(operators):
+        """Returns a hashable description of operators, grouped by order of operations"""
+        return tuple(tuple(sorted(d.keys())) for d in operators)
+
+    def getTree(self):
+        """Returns the expression tree of .string, parsing it only if it has not been parsed before
+
+        Trees are cached by expression string, so re-evaluating a string only walks its tree again.
+        """
+        if self.tree is None:
+            tokens = list(self.expression)
+            self.tree = self.parse(tokens)
+            MathExpression.remember(self.string, tokens, self.tree, self.operators)
+        return self.tree
+
+    @staticmethod
+    def remember(expression, tokens, tree, operators=None):
+        """Caches tokens and tree as the parsed form of expression, such as when loaded from a template"""
+        if len(MathExpression._trees) >= MathExpression.maxCachedTrees:
+            MathExpression._trees.clear()
+        grammar = MathExpression.getGrammar(operators if operators is not None else MathExpression.operators)
+        MathExpression._trees[(expression, grammar)] = (list(tokens), tree)
+
+    def parse(self, tokens):
+        """Builds an expression tree from the output of genFromString()
+
+        Operators of equal order are grouped into a single Operation which is evaluated from left to right, exactly
+        as evaluateExpression() combines them. Raises MathExpression.SyntaxError on unbalanced parenthesis, missing
+        arguments or leftover tokens.
+        """
+        levels = [set(o for o, f in d.items() if f is not None) for d in self.operators]
+        levels = [level for level in reversed(levels) if level]  # Lowest order first
+        structural = set(o for d in self.operators for o, f in d.items() if f is None)
+        position = [0]
+
+        def peek():
+            return tokens[position[0]] if position[0] < len(tokens) else None
+
+        def take():
+            token = peek()
+            if token is None:
+                raise MathExpression.SyntaxError(tokens)
+            position[0] += 1
+            return token
+
+        def expect(token):
+            if take() != token:
+                raise MathExpression.SyntaxError(tokens[:position[0]])
+
+        def parseOrder(index):
+            if index == len(levels):
+                return parsePrimary()
+            operands = [parseOrder(index + 1)]
+            operators = []
+            while peek() in levels[index]:
+                operators.append(take())
+                operands.append(parseOrder(index + 1))
+            return operands[0] if not operators else Operation(operands, operators)
+
+        def parsePrimary():
+            token = take()
+            if token == "(":
+                node = parseOrder(0)
+                expect(")")
+                return node
+            if token in structural or any(token in level for level in levels):
+                raise MathExpression.SyntaxError(tokens[:position[0]])
+            node = Token(token)
+            if peek() == "(":
+                take()
+                args = []
+                if peek() == ")":
+                    take()
+                else:
+                    args.append(parseOrder(0))
+                    while peek() == ",":
+                        take()
+                        args.append(parseOrder(0))
+                    expect(")")
+                node = Call(node, args)
+            return node
+
+        tree = parseOrder(0)
+        if position[0] != len(tokens):
+            raise MathExpression.SyntaxError(tokens[position[0]:])
+        return tree
+
+    def evaluateTree(self, node):
+        """Evaluates a tree created by parse() using .variables, .modules and .operators"""
+        if isinstance(node, Token):
+            return node.value if node.isConstant else self._interpret(node.token)
+        elif isinstance(node, Operation):
+            if self.blockFunc and self._countBlockOperators(node) > 1:
+                program, values = [], []
+                self._flatten(node, program, values)
+                result = self.blockFunc(program, values)
+                return result if result is not NotImplemented else self._runProgram(program, values)
+            value = self.evaluateTree(node.operands[0])
+            for part, operand in zip(node.operators, node.operands[1:]):
+                nxt = self.evaluateTree(operand)
+                if isinstance(value, np.ndarray) and not isinstance(nxt, np.ndarray):
+                    raise MathExpression.SyntaxError(value)
+                value = self.functions[part](value, nxt)
+            return value
+        else:
+            funcToCall = self.evaluateTree(node.function)
+            args = [self.evaluateTree(arg) for arg in node.arguments]
+            try:
+                return funcToCall(*args)
+            except Exception as e:
+                if self.fallbackFunc is None:
+                    raise MathExpression.ParseFailure(str(funcToCall), e)  # Report the function's own error
+                try:
+                    return self.fallbackFunc(funcToCall, *args)
+                except Exception as e:
+                    raise MathExpression.ParseFailure(str(funcToCall), e)
 
     def evaluateExpression(self, exp):
         """Recursively evaluates expressions starting with innermost parenthesis, working outwards
@@ -178,6 +320,51 @@ class MathExpression:
             else:
                 raise MathExpression.SyntaxError(exp)
 
+    def _countBlockOperators(self, node):
+        """Returns the number of operators in the run of arithmetic starting at node
+
+        Returns -1 if any of them has been given a function other than the default, and so can't be handed to
+        .blockFunc.
+        """
+        if not isinstance(node, Operation):
+            return 0
+        count = 0
+        for part in node.operators:
+            if self.functions[part] is not MathExpression.defaultFunctions.get(part):
+                return -1
+            count += 1
+        for operand in node.operands:
+            inner = self._countBlockOperators(operand)
+            if inner < 0:
+                return -1
+            count += inner
+        return count
+
+    def _flatten(self, node, program, values):
+        """Appends node to program in postfix order, evaluating everything other than its arithmetic into values"""
+        if isinstance(node, Operation):
+            self._flatten(node.operands[0], program, values)
+            for part, operand in zip(node.operators, node.operands[1:]):
+                self._flatten(operand, program, values)
+                program.append(part)
+        else:
+            program.append(len(values))
+            values.append(self.evaluateTree(node))
+
+    def _runProgram(self, program, values):
+        """Combines values according to a postfix program from _flatten() one operator at a time"""
+        stack = []
+        for part in program:
+            if isinstance(part, int):
+                stack.append(values[part])
+            else:
+                nxt = stack.pop()
+                value = stack.pop()
+                if isinstance(value, np.ndarray) and not isinstance(nxt, np.ndarray):
+                    raise MathExpression.SyntaxError(value)
+                stack.append(self.functions[part](value, nxt))
+        return stack[0]
+
     def _interpret(self, string):
         if isinstance(string, str):
             if string[0] == "<" and string[-1] == ">":
@@ -244,6 +431,74 @@ class MathExpression:
             return str(self.__repr__())
 
 
+class Token(object):
+    """A leaf of an expression tree: a number, a <variable>, or a name to be found in a MathExpression's .modules"""
+    __slots__ = ('token', 'value', 'isConstant')
+
+    def __init__(self, token):
+        self.token = token
+        try:
+            self.value = float(token)
+            self.isConstant = True
+        except ValueError:
+            self.value = None
+            self.isConstant = False
+
+    def __repr__(self):
+        return "Token(%s)" % self.token
+
+    def toList(self):
+        return ["Token", self.token]
+
+
+class Operation(object):
+    """A run of operands joined by operators of the same order, i.e. operands[0] operators[0] operands[1] ..."""
+    __slots__ = ('operands', 'operators')
+
+    def __init__(self, operands, operators):
+        self.operands = operands
+        self.operators = operators
+
+    def __repr__(self):
+        return "Operation(%s, %s)" % (str(self.operands), str(self.operators))
+
+    def toList(self):
+        return ["Operation", [o.toList() for o in self.operands], list(self.operators)]
+
+
+class Call(object):
+    """A function call in the format function(arguments[0], arguments[1]...)"""
+    __slots__ = ('function', 'arguments')
+
+    def __init__(self, function, arguments):
+        self.function = function
+        self.arguments = arguments
+
+    def __repr__(self):
+        return "Call(%s, %s)" % (str(self.function), str(self.arguments))
+
+    def toList(self):
+        return ["Call", self.function.toList(), [a.toList() for a in self.arguments]]
+
+
+def nodeFromList(data):
+    """Rebuilds an expression tree from the output of its toList(), raising ValueError if data is malformed"""
+    try:
+        kind = data[0]
+        if kind == "Token" and len(data) == 2 and isinstance(data[1], basestring):
+            return Token(data[1])
+        if kind == "Operation" and len(data) == 3 and len(data[1]) == len(data[2]) + 1 > 1 and \
+                all(isinstance(o, basestring) for o in data[2]):
+            return Operation([nodeFromList(o) for o in data[1]], list(data[2]))
+        if kind == "Call" and len(data) == 3:
+            function = nodeFromList(data[1])
+            if isinstance(function, Token):
+                return Call(function, [nodeFromList(a) for a in data[2]])
+    except (TypeError, IndexError, KeyError):
+        pass
+    raise ValueError("Malformed expression tree: %s" % repr(data)[:100])
+
+
 def limit(max_=None):
     """Return decorator that limits allowed returned values."""
     def decorator(func):
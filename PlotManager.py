@@ -0,0 +1,170 @@
+"""Keeps the plots of a figure up to date with a list of axes of Graphs, redrawing only what has changed
+
+Rather than clearing the figure and plotting every Graph again whenever a Graph is added, removed, replaced, shown or
+hidden, a PlotManager keeps the subplot of each axis and the artist of each Graph plotted on it. Subplots are only laid
+out again when the number of axes changes, hidden Graphs keep their artists so that showing them again is immediate,
+and only Graphs which are new or whose data has changed are plotted. The artists of Graphs are animated, so when the
+limits and labels of a subplot don't change, it is updated by blitting its saved background and its Graphs rather than
+drawing the whole figure.
+"""
+import math
+from matplotlib.axes import Subplot
+from matplotlib.lines import Line2D
+from Graph import Graph
+
+__author__ = "Thomas Schweich"
+
+
+class PlotManager(object):
+    """Plots lists of Graphs on the subplots of fig, one subplot per list, keeping what is plotted between updates"""
+    __author__ = "Thomas Schweich"
+
+    def __init__(self, fig, maxPoints=None):
+        self.fig = fig
+        self.maxPoints = maxPoints
+        self.subplots = []  # (axis, subplot) for each axis shown, in order
+        self.plotted = {}  # subplot: list of [graph, artist, key] for each Graph plotted on subplot
+        self.backgrounds = {}  # subplot: the saved region of subplot without its Graphs, for blitting
+        self.viewCallbacks = {}  # subplot: id of the callback updating its Graphs when its x limits change
+        self.canBlit = getattr(fig.canvas, 'supports_blit', False)
+        fig.canvas.mpl_connect('draw_event', self.onDraw)
+
+    @staticmethod
+    def getKey(graph):
+        """Returns what the artist of graph depends on, so that it can be plotted again when any of it changes"""
+        x, y = graph.getRawData()
+        return x, y, graph.mode, graph.getMagnitudes()
+
+    @staticmethod
+    def isSameKey(key, other):
+        return key[0] is other[0] and key[1] is other[1] and key[2:] == other[2:]
+
+    def update(self, axes):
+        """Plots the shown Graphs of each list in axes on a subplot of its own, reusing the existing subplots and
+        artists wherever possible, and draws the result"""
+        redraw = self.layout(axes)
+        blit = []
+        for axis, subplot in self.subplots:
+            change = self.updateSubplot(subplot, axis)
+            if change == 'draw' or (change == 'blit' and subplot not in self.backgrounds):
+                redraw = True
+            elif change == 'blit':
+                blit.append(subplot)
+        if redraw or not self.canBlit:
+            self.fig.canvas.draw()
+        else:
+            for subplot in blit:
+                self.blit(subplot)
+
+    def layout(self, axes):
+        """Creates, removes and arranges subplots so there is one for each list in axes, returning whether the layout
+        changed"""
+        existing = dict((id(axis), subplot) for axis, subplot in self.subplots)
+        subplots = [(axis, existing.pop(id(axis), None)) for axis in axes]
+        if [s for a, s in subplots] == [s for a, s in self.subplots]:
+            self.subplots = subplots
+            return False
+        for subplot in existing.values():
+            self.fig.delaxes(subplot)
+            self.plotted.pop(subplot, None)
+            self.backgrounds.pop(subplot, None)
+            self.viewCallbacks.pop(subplot, None)
+        length = len(subplots)
+        rows, columns = int(math.ceil(length / 2.0)), 1 if length == 1 else 2
+        for index, (axis, subplot) in enumerate(subplots):
+            if subplot is None:
+                subplots[index] = (axis, self.fig.add_subplot(Subplot(self.fig, rows, columns, index + 1)))
+            else:
+                subplot.change_geometry(rows, columns, index + 1)
+        self.subplots = subplots
+        self.backgrounds.clear()
+        return True
+
+    def updateSubplot(self, subplot, axis):
+        """Brings the Graphs plotted on subplot up to date with axis
+
+        Returns None if nothing changed, 'blit' if only the Graphs changed, or 'draw' if the limits or labels of
+        subplot changed, so that the whole figure must be drawn.
+        """
+        master = next((g for g in axis if g.master), None)
+        if master is None:
+            master = axis[-1]
+            master.master = True
+        shown = [g for g in axis if g.isShown() and g is not master] + ([master] if master.isShown() else [])
+        for g in axis:
+            g.setSubplot(subplot)
+        if subplot in self.viewCallbacks:  # Plotting changes the limits, which would otherwise redraw the figure
+            subplot.callbacks.disconnect(self.viewCallbacks.pop(subplot))
+        labels = subplot.get_title(), subplot.get_xlabel(), subplot.get_ylabel()
+        limits = subplot.get_xlim(), subplot.get_ylim()
+        changed = rescale = False
+        kept = []
+        for record in self.plotted.get(subplot, []):
+            graph, artist, key = record
+            if not any(g is graph for g in axis) or not PlotManager.isSameKey(key, PlotManager.getKey(graph)):
+                artist.remove()
+                changed = rescale = True
+            else:
+                if artist.get_visible() and not any(g is graph for g in shown):
+                    artist.set_visible(False)
+                    changed = rescale = True
+                kept.append(record)
+        records = []
+        for graph in shown:
+            record = next((r for r in kept if r[0] is graph), None)
+            if record is None:
+                record = self.plotGraph(subplot, graph)
+                changed = rescale = True
+            elif not record[1].get_visible():
+                record[1].set_visible(True)
+                changed = rescale = True
+            records.append(record)
+        hidden = [r for r in kept if not r[1].get_visible()]
+        if rescale and any(not isinstance(artist, Line2D) for graph, artist, key in records):
+            # relim() only accounts for lines, so the Graphs are plotted again with the data limits reset
+            for graph, artist, key in records + hidden:
+                artist.remove()
+            subplot.ignore_existing_data_limits = True
+            records, hidden = [self.plotGraph(subplot, graph) for graph in shown], []
+        elif rescale and subplot.get_autoscale_on():
+            subplot.relim(visible_only=True)
+            subplot.autoscale_view()
+        self.plotted[subplot] = records + hidden  # The master comes last among those shown, and so is drawn on top
+        master.setAxisLabels(subplot)
+        if subplot.get_xlim() != limits[0]:
+            xMin, xMax = sorted(subplot.get_xlim())
+            for graph in shown:
+                graph.updateView(subplot, xMin, xMax, self.maxPoints)
+        self.viewCallbacks[subplot] = Graph.connectViewUpdates(subplot, shown, self.maxPoints)
+        if labels != (subplot.get_title(), subplot.get_xlabel(), subplot.get_ylabel()) or \
+                limits != (subplot.get_xlim(), subplot.get_ylim()):
+            return 'draw'
+        return 'blit' if changed else None
+
+    def plotGraph(self, subplot, graph):
+        """Plots graph on subplot, returning its record of [graph, artist, key]"""
+        graph.plot(subplot, maxPoints=self.maxPoints)
+        artist = graph._artists[subplot][0]
+        artist.set_animated(self.canBlit)
+        return [graph, artist, PlotManager.getKey(graph)]
+
+    def drawGraphs(self, subplot):
+        """Draws the shown Graphs of subplot, which being animated aren't drawn with the rest of the figure"""
+        for graph, artist, key in self.plotted.get(subplot, []):
+            if artist.get_visible():
+                subplot.draw_artist(artist)
+
+    def blit(self, subplot):
+        """Redraws only the inside of subplot, from its saved background"""
+        canvas = self.fig.canvas
+        canvas.restore_region(self.backgrounds[subplot])
+        self.drawGraphs(subplot)
+        canvas.blit(subplot.bbox)
+
+    def onDraw(self, event):
+        """Saves the background of each subplot once the figure has been drawn, and draws the Graphs over it"""
+        if not self.canBlit or self.fig.canvas.is_saving():
+            return  # Animated artists are drawn as usual when saving
+        for axis, subplot in self.subplots:
+            self.backgrounds[subplot] = self.fig.canvas.copy_from_bbox(subplot.bbox)
+            self.drawGraphs(subplot)
@@ -0,0 +1,296 @@
+"""Spectra of large data sets
+
+The spectra of real data are computed with real FFTs, which take about half the time and memory of complex ones. The
+time an FFT takes depends on the prime factors of its length, so data can be zero padded to the next length whose
+factors are all 2, 3 and 5.
+
+welch() estimates a power spectral density by averaging the spectra of overlapping segments of the data. Segments are
+read a batch at a time and transformed together, so the memory used depends on the segment length rather than on the
+length of the data, which may be a memmap or LazyArray larger than memory. spectrogram() reads segments in the same way,
+averaging them into a bounded number of columns. NumPy's FFTs release the GIL, so while each batch is read, the
+batches before it are transformed on a pool of threads.
+
+lombScargle() finds the spectrum of unevenly sampled data by the method of Press and Rybicki, in which each point is
+"extirpolated" onto a regular grid so that the trigonometric sums over all the points at every frequency can be found
+with one FFT, taking O(n log n) time rather than the O(n m) of summing directly at m frequencies.
+
+decimate() low pass filters data and keeps every factor-th point, so that frequencies above the new Nyquist frequency
+are removed rather than aliased. The filter is applied in polyphase form, computing only the points which are kept,
+a batch at a time with enough of the previous batch to carry the filter across it.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.fftpack import next_fast_len
+from scipy.signal import firwin, upfirdn
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from LazyArray import LazyArray
+
+__author__ = "Thomas Schweich"
+
+threads = None  # Threads transforming batches of segments at once in welch() and spectrogram(), or None for one per CPU
+batchSize = 1 << 20  # Values of data read and transformed at a time by welch()
+segmentLength = 1 << 16  # Default length of each segment averaged by welch()
+spectrogramLength = 1 << 12  # Default length of each segment of spectrogram()
+spectrogramColumns = 1 << 11  # Default greatest number of columns of spectrogram()
+periodogramLength = 1 << 20  # Greatest number of frequencies of lombScargle()
+samplesPerPeak = 5  # Frequencies of lombScargle() across the width of a peak, 1 / (time spanned), where possible
+extirpolationOrder = 4  # Grid points each point is spread over by lombScargle()
+extirpolationOversampling = 4  # Grid points of lombScargle() per frequency
+tapsPerFactor = 20  # Taps of the filter of decimate() for each point removed per point kept
+
+
+def fastLength(length):
+    """Returns the smallest length of at least length whose only prime factors are 2, 3 and 5"""
+    return next_fast_len(int(length))
+
+
+def rfft(data, length=None, axis=-1):
+    """Returns the real FFT of data along axis, zero padded or truncated to length if given"""
+    return np.fft.rfft(data, length, axis=axis)
+
+
+def amplitudeSpectrum(data, pad=True):
+    """Returns a tuple of (the single-sided amplitude spectrum |FFT| / n of data, the length of the transform)
+
+    With pad set, data is zero padded to fastLength() first, which also samples the spectrum slightly more finely.
+    """
+    length = len(data)
+    size = fastLength(length) if pad else length
+    spectrum = np.abs(rfft(np.asarray(data, dtype=np.float64), size)[:size // 2])
+    spectrum /= length
+    return spectrum, size
+
+
+def amplitudes(data, pad=True):
+    """Returns the amplitude spectrum of amplitudeSpectrum() alone, as a module level function which can be pickled"""
+    return amplitudeSpectrum(data, pad)[0]
+
+
+def _segmentPowers(data, length, step, count, perBatch):
+    """Yields (index of first segment, array of the power spectrum |FFT| ** 2 of each segment) for batches of at most
+    perBatch of the count segments of length points, step points apart, at the start of data
+
+    The mean of each segment is removed and it is multiplied by a Hann window first. Each batch is read from data once
+    and the segments are taken as a strided view of it, so they are transformed together without being copied.
+    Batches are read in order by the calling thread, and transformed on threads threads, with at most one batch per
+    thread waiting to be transformed or yielded.
+    """
+    window = _window(length)
+
+    def transform(chunk):
+        segments = (len(chunk) - length) // step + 1
+        view = as_strided(chunk, shape=(segments, length), strides=(step * chunk.strides[0], chunk.strides[0]))
+        transformed = rfft((view - view.mean(axis=1)[:, np.newaxis]) * window, axis=1)
+        return transformed.real ** 2 + transformed.imag ** 2
+
+    firsts = range(0, count, perBatch)
+    workers = min(threads or cpu_count(), len(firsts))
+    pool = ThreadPool(workers) if workers > 1 else None
+    pending = deque()
+    try:
+        for first in firsts:
+            segments = min(perBatch, count - first)
+            chunk = np.ascontiguousarray(data[first * step:(first + segments - 1) * step + length], dtype=np.float64)
+            if pool is None:
+                yield first, transform(chunk)
+                continue
+            pending.append((first, pool.apply_async(transform, (chunk,))))
+            if len(pending) > workers:
+                first, result = pending.popleft()
+                yield first, result.get()
+        while pending:
+            first, result = pending.popleft()
+            yield first, result.get()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _window(length):
+    return np.hanning(length + 1)[:-1]  # The periodic Hann window, as used by scipy.signal.welch
+
+
+def _segments(total, length, overlap):
+    """Returns (segment length, step between segments, number of segments) for data of total points
+
+    Raises a ValueError if the segments would be shorter than 2 points, whose Hann window is all zeros.
+    """
+    length = min(int(length or segmentLength), total)
+    if length < 2:
+        raise ValueError("Segments must be at least 2 points long (got %d)" % length)
+    step = max(1, length - int(length * overlap))
+    return length, step, (total - length) // step + 1
+
+
+def _toDensity(power, length, sampleRate, count):
+    """Scales power, the sum of count power spectra of segments of length points, to a one-sided density in place"""
+    power /= count * sampleRate * (_window(length) ** 2).sum()
+    power[..., 1:-1 if length % 2 == 0 else None] *= 2  # Every bin but zero and the Nyquist bin gets its negative half
+    return power
+
+
+def welch(data, sampleRate=1.0, length=None, overlap=.5):
+    """Returns (frequencies, power spectral density) of data estimated by Welch's method
+
+    data is split into segments of length points (segmentLength by default, and at most the length of data), each
+    overlapping the last by the given fraction. The mean of each segment is removed and it is multiplied by a Hann
+    window before its power spectrum is taken, and the power spectra of all the segments are averaged. The density
+    is one-sided and scaled as by scipy.signal.welch, in units of data ** 2 per unit of sampleRate. Raises a
+    ValueError if the segments would be shorter than 2 points.
+    """
+    length, step, count = _segments(len(data), length, overlap)
+    power = np.zeros(length // 2 + 1)
+    for first, powers in _segmentPowers(data, length, step, count, max(1, batchSize // length)):
+        power += powers.sum(axis=0)
+    return np.arange(length // 2 + 1) * (sampleRate / length), _toDensity(power, length, sampleRate, count)
+
+
+def spectrogram(data, sampleRate=1.0, length=None, overlap=.5, columns=None):
+    """Returns (time of the first column, time between columns, frequencies, power) of the spectrogram of data
+
+    power is a 2D array of the power spectral density (scaled as by welch()) of each column, in time order. Each column
+    is a segment of length points (spectrogramLength by default), overlapping the last by the given fraction, or if
+    there would be more than columns (spectrogramColumns by default) segments, the average of as many consecutive
+    segments as keep it to columns.
+    Times are of the centres of the columns, relative to the first point of data. The time taken is proportional to
+    the length of data, and the memory used to the size of power, which is a memmap if it is large (see
+    LazyArray.allocate()).
+    """
+    length, step, count = _segments(len(data), length or spectrogramLength, overlap)
+    average = -(-count // (columns or spectrogramColumns))
+    columns = -(-count // average)
+    power = LazyArray.allocate((columns, length // 2 + 1), np.float64)
+    perBatch = max(1, batchSize // (length * average)) * average  # Whole columns per batch
+    for first, powers in _segmentPowers(data, length, step, count, perBatch):
+        column = first // average
+        whole = len(powers) // average * average
+        power[column:column + whole // average] = powers[:whole].reshape(-1, average, powers.shape[1]).sum(axis=1)
+        if whole < len(powers):  # The last column may average fewer segments
+            power[column + whole // average] = powers[whole:].sum(axis=0) * (float(average) / (len(powers) - whole))
+    _toDensity(power, length, sampleRate, average)
+    firstTime = ((average - 1) * step + length) / 2.0 / sampleRate
+    return firstTime, average * step / float(sampleRate), np.arange(length // 2 + 1) * (sampleRate / length), power
+
+
+def _extirpolate(grid, x, y, order):
+    """Adds y at each position x to the periodic grid, spread over the order nearest grid points so that the sum of y
+    times any smooth periodic function of x is the sum of grid times that function at the grid points
+
+    This is the inverse of Lagrange interpolation of order points.
+    """
+    size = len(grid)
+    whole = np.floor(x)
+    exact = x == whole  # These would divide by zero below, and belong only to their own grid point
+    if exact.any():
+        grid += np.bincount(whole[exact].astype(np.int64) % size, y[exact], size)
+        x, y, whole = x[~exact], y[~exact], whole[~exact]
+    nodes = np.arange(order)[:, np.newaxis]
+    first = whole.astype(np.int64) - (order - 1) // 2
+    offsets = x - first - nodes  # From each of the grid points first to first + order - 1
+    denominators = [np.prod([j - m for m in range(order) if m != j]) for j in range(order)]
+    weights = (y * np.prod(offsets, axis=0)) / (offsets * np.array(denominators)[:, np.newaxis])
+    added = np.bincount((first % size + nodes).ravel(), weights.ravel(), size + order)
+    grid += added[:size]
+    grid[:order] += added[size:]  # Wrapping around the end of grid
+
+
+def _trigSums(grid, count):
+    """Returns (sums of cos, sums of sin) at each of the first count frequencies of an extirpolated grid"""
+    transformed = rfft(grid)[:count]
+    return transformed.real, -transformed.imag
+
+
+def lombScargle(times, data, maxFrequency=None):
+    """Returns (frequencies, power) of the Lomb-Scargle periodogram of data sampled at times, which need not be evenly
+    spaced
+
+    The power at each frequency is the fraction of the variance of data explained by a least squares fit of a sine wave
+    of that frequency, as found by the method of Press and Rybicki. Frequencies are evenly spaced up to maxFrequency,
+    which by default is the Nyquist frequency of the average sample rate, samplesPerPeak for every 1 / (time spanned)
+    unless that would be more than periodogramLength of them. Points which aren't finite are left out. times and data
+    are read in batches of batchSize, so may be larger than memory.
+    """
+    total = len(data)
+    count, mean, start, end = 0, 0.0, np.inf, -np.inf
+    for begin in range(0, total, batchSize):
+        t, y = np.asarray(times[begin:begin + batchSize], np.float64), np.asarray(data[begin:begin + batchSize])
+        finite = np.isfinite(t) & np.isfinite(y)
+        if finite.any():
+            t, y = t[finite], y[finite]
+            start, end = min(start, t.min()), max(end, t.max())
+            count += len(y)
+            mean += (y.sum() - len(y) * mean) / count
+    span = end - start
+    if count < 3 or not span > 0:
+        raise ValueError("A periodogram needs at least three finite points at different times")
+    maxFrequency = maxFrequency or count / (2.0 * span)
+    step = max(1.0 / (samplesPerPeak * span), float(maxFrequency) / periodogramLength)
+    frequencies = int(maxFrequency / step)
+    size = fastLength(2 * extirpolationOversampling * (frequencies + 1))
+    weighted, weights = np.zeros(size), np.zeros(size)  # Of data - mean at frequencies, and of 1 at twice them
+    variance = 0.0
+    for begin in range(0, total, batchSize):
+        t, y = np.asarray(times[begin:begin + batchSize], np.float64), np.asarray(data[begin:begin + batchSize])
+        finite = np.isfinite(t) & np.isfinite(y)
+        t, y = t[finite] - start, y[finite] - mean
+        variance += np.dot(y, y)
+        position = t * step % 1 * size
+        _extirpolate(weighted, position, y, extirpolationOrder)
+        _extirpolate(weights, (2 * position) % size, np.ones(len(t)), extirpolationOrder)
+    cosines, sines = _trigSums(weighted, frequencies + 1)
+    cosines2, sines2 = _trigSums(weights, frequencies + 1)
+    # Shifting the times by tau, where tan(2 omega tau) = sum(sin(2 omega t)) / sum(cos(2 omega t)), makes the fitted
+    # sine and cosine orthogonal. Either solution will do, so 2 omega tau is taken between -pi / 2 and pi / 2.
+    hypotenuse = np.hypot(cosines2, sines2)
+    hypotenuse[hypotenuse == 0] = 1
+    cos2Tau, sin2Tau = np.abs(cosines2) / hypotenuse, np.where(cosines2 < 0, -sines2, sines2) / hypotenuse
+    cos2Tau[(cosines2 == 0) & (sines2 == 0)] = 1  # Any tau will do, and sin2Tau is already 0
+    cosTau, sinTau = np.sqrt(.5 * (1 + cos2Tau)), np.sign(sin2Tau) * np.sqrt(.5 * (1 - cos2Tau))
+    yCos, ySin = cosines * cosTau + sines * sinTau, sines * cosTau - cosines * sinTau
+    cosCos = .5 * (count + cosines2 * cos2Tau + sines2 * sin2Tau)
+    sinSin = count - cosCos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = (yCos ** 2 / cosCos + ySin ** 2 / sinSin) / variance
+    return np.arange(1, frequencies + 1) * step, np.nan_to_num(power[1:])
+
+
+def decimationFilter(factor):
+    """Returns the taps of the linear phase low pass FIR filter used by decimate(), as used by scipy.signal.decimate"""
+    return firwin(tapsPerFactor * factor + 1, 1.0 / factor, window='hamming')
+
+
+def decimate(data, factor):
+    """Returns every factor-th point of data (starting from the first) after a low pass filter with a cutoff at the
+    Nyquist frequency of the result
+
+    The filter (see decimationFilter()) is centred on each point, so the result isn't delayed, and data is extended
+    by repeating its first and last values. data is read batchSize points at a time, and a large result is stored on
+    disk (see LazyArray.allocate()). A factor of 1 returns a copy of data.
+    """
+    if factor < 1:
+        raise ValueError("Can't decimate by a factor of less than 1")
+    factor = int(factor)
+    if factor == 1:
+        result = LazyArray.allocate(len(data), np.float64)
+        for first in range(0, len(data), batchSize):
+            result[first:first + batchSize] = data[first:first + batchSize]
+        return result
+    taps = decimationFilter(factor)
+    delay = (len(taps) - 1) // 2
+    history = -(-(len(taps) - 1) // factor)  # Points kept of which the filter of the first of a batch reads
+    total = len(data)
+    count = -(-total // factor)
+    result = LazyArray.allocate(count, np.float64)
+    perBatch = max(1, batchSize // factor)
+    for first in range(0, count, perBatch):
+        last = min(first + perBatch, count)
+        # The filter of kept point m reads data from m * factor + delay back to m * factor + delay - (len(taps) - 1)
+        begin, end = (first - history) * factor + delay, (last - 1) * factor + delay + 1
+        chunk = np.asarray(data[max(begin, 0):min(end, total)], dtype=np.float64)
+        before, after = np.repeat(chunk[:1], max(0, -begin)), np.repeat(chunk[-1:], max(0, end - total))
+        chunk = np.concatenate((before, chunk, after))
+        result[first:last] = upfirdn(taps, chunk, 1, factor)[history:history + last - first]
+    return result
@@ -1,7 +1,7 @@
 import Tkinter as Tk
 import tkFileDialog
-from ExpressionChain import ExpressionChain
-import pickle
+from MathExpression import MathExpression
+import TemplateFile
 
 
 class TemplateCreator(Tk.Toplevel):
@@ -97,13 +97,18 @@ class TemplateCreator(Tk.Toplevel):
 
     def save(self):
         self.error.pack_forget()
-        chain = ExpressionChain()
-        for i, name in enumerate(self.names):
-            chain.addExp(self.expressions[i].get(), name.get())
+        formulae = [(self.expressions[i].get(), name.get()) for i, name in enumerate(self.names)]
+        try:
+            document = TemplateFile.toDocument(formulae)
+            TemplateFile.fromDocument(document)  # Catch references to names which aren't defined above
+        except (MathExpression.SyntaxError, TemplateFile.TemplateError) as e:
+            self.error.configure(text=str(e))
+            self.error.pack()
+            return
         path = tkFileDialog.asksaveasfilename(defaultextension=".wizt",
                                               filetypes=[("WIZ Template", ".wizt")])
         try:
-            with open(path, 'w+') as f:
-                pickle.dump(chain, f)
+            TemplateFile.write(document, path)
         except IOError:
+            self.error.configure(text="Invalid selection")
             self.error.pack()
@@ -0,0 +1,217 @@
+"""Reads and writes WIZ templates (.wizt files)
+
+Templates are JSON documents holding each formula, its name, the formulae it depends on, and its tokenized and parsed
+form, so that loading a template needs no unpickling. The parsed forms are used without parsing the formula again
+when their digest (a SHA-1 of the expression, tokens and tree, written when the template is saved) still matches;
+otherwise they are checked against a fresh parse:
+
+    {"format": "WIZ Template", "version": 1, "grammar": [["(", ")", ","], ["^"], ["*", "/"], ["+", "-"]],
+     "formulae": [{"name": "Graph 1", "expression": "<ORIGINAL> * 2", "dependencies": [],
+                   "tokens": ["<ORIGINAL>", "*", "2"], "tree": ["Operation", [...], ["*"]], "digest": "5f0c..."},
+                  ...]}
+
+Templates written by earlier versions of WIZ are pickled ExpressionChains. load() still reads them (without running
+any code they contain), and running "python TemplateFile.py migrate old.wizt [...]" rewrites them in this format.
+"""
+import hashlib
+import json
+import pickle
+import sys
+from collections import OrderedDict
+from ExpressionChain import ExpressionChain
+from MathExpression import MathExpression, nodeFromList
+
+__author__ = "Thomas Schweich"
+
+FORMAT = "WIZ Template"
+VERSION = 1
+ORIGINAL = "ORIGINAL"
+
+
+class TemplateError(Exception):
+    """Raised when a template can't be read, or is not a valid template"""
+    pass
+
+
+def toDocument(formulae):
+    """Returns the template document of a list of (expression, name), raising MathExpression.SyntaxError if any
+    expression can't be parsed"""
+    chain = ExpressionChain()
+    for expression, name in formulae:
+        chain.addExp(expression, name)
+    entries = []
+    for (expression, name), dependencies in zip(chain.formulae, chain.getDependencies()):
+        exp = MathExpression(expression)
+        tree = exp.getTree().toList()
+        tokens = list(exp.expression)
+        entries.append(OrderedDict([("name", name), ("expression", expression), ("dependencies", dependencies),
+                                    ("tokens", tokens), ("tree", tree), ("digest", _digest(expression, tokens, tree))]))
+    return OrderedDict([("format", FORMAT), ("version", VERSION), ("grammar", _grammar()), ("formulae", entries)])
+
+
+def save(formulae, path):
+    """Writes a template of a list of (expression, name) to path"""
+    write(toDocument(formulae), path)
+
+
+def write(document, path):
+    """Writes a template document to path"""
+    with open(path, 'w') as f:
+        json.dump(document, f)
+
+
+def load(path):
+    """Returns a validated ExpressionChain of the template at path, ready for its variables to be added
+
+    Raises TemplateError if the file isn't a valid template.
+    """
+    try:
+        with open(path, 'rb') as f:
+            text = f.read()
+    except IOError as e:
+        raise TemplateError("Couldn't read %s: %s" % (path, str(e)))
+    if text.lstrip().startswith("{"):
+        try:
+            document = _toStr(json.loads(text))
+        except ValueError as e:
+            raise TemplateError("%s is not a valid template: %s" % (path, str(e)))
+    else:
+        print "%s is a template from an earlier version of WIZ; run TemplateFile.py migrate to update it" % path
+        try:
+            document = toDocument(loadLegacy(text))
+        except MathExpression.SyntaxError as e:
+            raise TemplateError("%s contains an invalid formula: %s" % (path, str(e)))
+    return fromDocument(document)
+
+
+def fromDocument(document):
+    """Validates a template document, returning its ExpressionChain and caching the parsed form of each formula
+
+    The tokens and tree stored with a formula must match those of its expression, so that a template can't make an
+    expression evaluate as some other expression. Its tokens are always checked, since tokenizing is cheap, but its
+    tree is only compared with a fresh parse when its digest doesn't match.
+    """
+    if not isinstance(document, dict) or document.get("format") != FORMAT:
+        raise TemplateError("Not a WIZ template")
+    version = document.get("version")
+    if not isinstance(version, int) or version < 1:
+        raise TemplateError("Invalid template version %s" % repr(version))
+    if version > VERSION:
+        raise TemplateError("This template requires a newer version of WIZ (template version %d)" % version)
+    formulae = document.get("formulae")
+    if not isinstance(formulae, list):
+        raise TemplateError("Template has no list of formulae")
+    # Parsed forms are only checked when parsed with the same grammar; otherwise they are ignored
+    precompiled = _grammar() == document.get("grammar")
+    chain = ExpressionChain()
+    defined = {}
+    for index, entry in enumerate(formulae):
+        if not isinstance(entry, dict) or not isinstance(entry.get("expression"), basestring) or \
+                not isinstance(entry.get("name"), basestring):
+            raise TemplateError("Formula %d must have a name and an expression" % (index + 1))
+        expression, name = entry["expression"], entry["name"]
+        try:
+            exp = MathExpression(expression)
+            tokens = exp.genFromString(expression)
+            if precompiled and entry.get("tokens") != tokens:
+                raise ValueError("Stored tokens don't match the expression")
+            if precompiled and entry.get("digest") == _digest(expression, tokens, entry.get("tree")):
+                tree = nodeFromList(entry["tree"])
+            else:
+                tree = exp.parse(list(tokens))
+                if precompiled and nodeFromList(entry.get("tree")).toList() != tree.toList():
+                    raise ValueError("Stored tree doesn't match the expression")
+            MathExpression.remember(expression, tokens, tree)
+        except (ValueError, MathExpression.SyntaxError) as e:
+            raise TemplateError("Formula %d (%s) is invalid: %s" % (index + 1, name, str(e)))
+        references = ExpressionChain.getReferences(tokens)
+        undefined = sorted(r for r in references if r not in defined and r != ORIGINAL)
+        if undefined:
+            raise TemplateError("Formula %d (%s) refers to %s, which %s not defined above it" % (
+                index + 1, name, ", ".join("<%s>" % u for u in undefined), "is" if len(undefined) == 1 else "are"))
+        dependencies = sorted({defined[r] for r in references if r in defined})
+        if "dependencies" in entry and entry["dependencies"] != dependencies:
+            raise TemplateError("Formula %d (%s) has inconsistent dependencies" % (index + 1, name))
+        chain.addExp(expression, name)
+        defined[name] = index
+    return chain
+
+
+class _LegacyChain(object):
+    """Stands in for the ExpressionChain of a pickled template, so that only its state is read"""
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Unpickles old templates, refusing to load anything other than an ExpressionChain's plain data"""
+    def find_class(self, module, name):
+        if (module, name) == ("ExpressionChain", "ExpressionChain"):
+            return _LegacyChain
+        raise TemplateError("Template refers to %s.%s, which is not allowed" % (module, name))
+
+
+def loadLegacy(text):
+    """Returns the list of (expression, name) held in a pickled ExpressionChain template"""
+    from cStringIO import StringIO
+    try:
+        chain = _LegacyUnpickler(StringIO(text)).load()
+    except TemplateError:
+        raise
+    except Exception as e:
+        raise TemplateError("Not a valid template: %s" % str(e))
+    formulae = getattr(chain, 'formulae', None) if isinstance(chain, _LegacyChain) else None
+    if not isinstance(formulae, list) or not all(isinstance(f, tuple) and len(f) == 2 and
+                                                 all(isinstance(s, basestring) for s in f) for f in formulae):
+        raise TemplateError("Not a valid template")
+    return [(str(e), str(n)) for e, n in formulae]
+
+
+def migrate(path, newPath=None):
+    """Rewrites the pickled template at path in the current format, keeping a copy of the original as path.bak"""
+    with open(path, 'rb') as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        print "%s is already up to date" % path
+        return
+    formulae = loadLegacy(text)
+    if newPath is None:
+        newPath = path
+        with open(path + ".bak", 'wb') as f:
+            f.write(text)
+    save(formulae, newPath)
+    print "Migrated %s to %s (%d formulae)" % (path, newPath, len(formulae))
+
+
+def _digest(expression, tokens, tree):
+    """Returns the digest by which a formula's stored tokens and tree are known to belong to its expression"""
+    return hashlib.sha1(json.dumps([expression, tokens, tree])).hexdigest()
+
+
+def _grammar():
+    return [list(g) for g in MathExpression.getGrammar(MathExpression.operators)]
+
+
+def _toStr(obj):
+    """Converts the unicode strings produced by json back to str"""
+    if isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    if isinstance(obj, list):
+        return [_toStr(o) for o in obj]
+    if isinstance(obj, dict):
+        return {_toStr(k): _toStr(v) for k, v in obj.items()}
+    return obj
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "migrate":
+        print "Usage: python TemplateFile.py migrate template.wizt [more templates...]"
+        sys.exit(1)
+    failed = False
+    for p in sys.argv[2:]:
+        try:
+            migrate(p)
+        except (TemplateError, IOError) as e:
+            print "Couldn't migrate %s: %s" % (p, str(e))
+            failed = True
+    sys.exit(1 if failed else 0)
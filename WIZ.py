@@ -10,8 +10,11 @@ import math
 import json
 import os
 import re
+import tempfile
+from multiprocessing import freeze_support
+import DataLoader
 from TemplateCreator import TemplateCreator
-import pickle
+import TemplateFile
 import tkMessageBox
 
 
@@ -23,10 +26,19 @@ class InitialWindow(Tk.Tk):
         "Load Chunk Size": 100000,
         "Plot Chunk Size": 100000,
         "Max Preview Points": 100000,
+        "Max Plot Points": 100000,
         "DPI": 100,
         "Style": ["ggplot"],
         "User Font Size": 12,
-        "Icon Location": r'res\WIZ.ico'
+        "Icon Location": r'res\WIZ.ico',
+        "Template Cache Directory": "",
+        "Detect Uniform X": True,
+        "Lazy Evaluation": False,
+        "Fit Time Limit": 30.0,
+        "Load Processes": 1,
+        "Load Cache Directory": "",
+        "Load Cache Size": 4096,
+        "Template Memory Cache Size": 256
     }
 
     def __init__(self, win=None, *args, **kwargs):
@@ -36,6 +48,12 @@ class InitialWindow(Tk.Tk):
         if os.path.isfile('programSettings.json'):
             with open('programSettings.json', 'r') as settingsFile:
                 self.settings = json.load(settingsFile)
+            # Add any settings which were introduced after the file was created
+            missing = {k: v for k, v in InitialWindow.defaultProgramSettings.items() if k not in self.settings}
+            if missing:
+                self.settings.update(missing)
+                with open('programSettings.json', 'w') as settingsFile:
+                    json.dump(self.settings, settingsFile)
         else:
             with open('programSettings.json', 'w+') as settingsFile:
                 json.dump(InitialWindow.defaultProgramSettings, settingsFile)
@@ -166,22 +184,48 @@ class InitialWindow(Tk.Tk):
             chunkVal = Tk.IntVar()
             chunkVal.set(1)
             Tk.Checkbutton(self.newFrame, text="Read data in chunks (recommended)", variable=chunkVal).pack()
+            Tk.Label(self.newFrame, text="Only load from (blank for the start) to (blank for the end):").pack()
+            rangeFrame = Tk.Frame(self.newFrame)
+            rangeFrame.pack(expand=True)
+            rangeStart = Tk.Entry(rangeFrame, width=12)
+            rangeStart.pack(side=Tk.LEFT)
+            rangeEnd = Tk.Entry(rangeFrame, width=12)
+            rangeEnd.pack(side=Tk.RIGHT)
+            rangeVal = Tk.IntVar()
+            rangeVal.set(0)
+            Tk.Radiobutton(self.newFrame, text="By line number", variable=rangeVal, value=0).pack()
+            Tk.Radiobutton(self.newFrame, text="By x-value (x must be ascending)", variable=rangeVal, value=1).pack()
             Tk.Button(self.newFrame, text="Load", command=lambda: self.load(
                 path, xEntry.get(), yEntry.get(), headerVal.get(), cleanVal.get(), chunkVal.get(),
-                callFunc=callFunc)).pack()
+                callFunc=callFunc, loadRange=(rangeVal.get(), rangeStart.get(), rangeEnd.get()))).pack()
         else:
             self.load(path, shouldChunk=False, callFunc=callFunc)
         self.update()
         self.lift()
 
-    def load(self, path, xCol=0, yCol=1, hasHeaders=False, shouldClean=True, shouldChunk=True, callFunc=None):
+    def load(self, path, xCol=0, yCol=1, hasHeaders=False, shouldClean=True, shouldChunk=True, callFunc=None,
+             loadRange=None):
+        """Loads the data at path, and prompts the user for a slice of it
+
+        loadRange is (0 for line numbers or 1 for x-values, start, end) of the only part of the file to parse, where
+        blank start or end strings mean the start or end of the file.
+        """
         self.newFrame.destroy()
         self.newFrame = Tk.Frame(self.baseFrame)
         self.newFrame.pack(side=Tk.BOTTOM)
         self.lift()
+        rows = xRange = None
         try:
             xCol = int(xCol)
             yCol = int(yCol)
+            if loadRange and (loadRange[1].strip() or loadRange[2].strip()):
+                byX, start, end = loadRange
+                convert = float if byX else int
+                bounds = tuple(convert(v) if v.strip() else None for v in (start, end))
+                if byX:
+                    xRange = bounds
+                else:
+                    rows = bounds
         except ValueError:
             self.error.pack()
             raise
@@ -194,8 +238,11 @@ class InitialWindow(Tk.Tk):
         self.update()
         try:
             data = MainWindow.loadData(path, chunkSize=self.settings['Load Chunk Size'], tkProgress=progress,
-                                       tkRoot=self, xCol=xCol, yCol=yCol, header=hasHeaders, clean=shouldClean,
-                                       chunkRead=shouldChunk)
+                                       tkRoot=self, xCol=xCol, yCol=yCol, header=0 if hasHeaders else None,
+                                       clean=shouldClean, chunkRead=shouldChunk,
+                                       uniformX=self.settings["Detect Uniform X"],
+                                       processes=self.settings["Load Processes"] or None, cache=self.getLoadCache(),
+                                       rows=rows, xRange=xRange)
         except (ValueError, IOError):
             loading.pack_forget()
             if progress: progress.pack_forget()
@@ -217,6 +264,13 @@ class InitialWindow(Tk.Tk):
         Tk.Button(self.newFrame, text="Create Project" if not self.win else "Add Graph",
                   command=lambda: self.sliceData(data, tkVar, start.get(), end.get(), callFunc=callFunc)).pack()
 
+    def getLoadCache(self):
+        """Returns the DataLoader.LoadCache set up in the settings, or None if its size is 0"""
+        if not self.settings["Load Cache Size"]:
+            return None
+        directory = self.settings["Load Cache Directory"] or os.path.join(tempfile.gettempdir(), "WIZ Load Cache")
+        return DataLoader.LoadCache(directory, int(self.settings["Load Cache Size"] * 2 ** 20))
+
     def createBlankProject(self):
         self.quit()
         self.destroy()
@@ -235,7 +289,7 @@ class InitialWindow(Tk.Tk):
             newDat = data[0][int(begin):int(end)], data[1][int(begin):int(end)]
         # By x value
         else:  # elif tkVar.get() == 1:
-            newBegin, newEnd = np.searchsorted(data[0], np.array([np.float64(begin), np.float64(end)]))
+            newBegin, newEnd = data[0].searchsorted(np.array([np.float64(begin), np.float64(end)]))
             newDat = data[0][newBegin:newEnd], data[1][newBegin:newEnd]
         callFunc(newDat)  # Currently either createMain() or applyTemplate())
 
@@ -246,6 +300,7 @@ class InitialWindow(Tk.Tk):
             gr = Graph(window=self.win, title="Raw Data")
             print "Additional Graph Created"
             gr.setRawData(newDat)
+            gr.setLazy(self.settings["Lazy Evaluation"])
             print "Raw Data Set"
             self.win.addGraph(gr)
             print "Added to Window"
@@ -254,6 +309,7 @@ class InitialWindow(Tk.Tk):
             win = MainWindow()
             gr = Graph(window=win, title="Raw Data")
             gr.setRawData(newDat)
+            gr.setLazy(self.settings["Lazy Evaluation"])
             win.setGraphs([[gr]])
             win.plotGraphs()
             win.mainloop()
@@ -267,9 +323,9 @@ class InitialWindow(Tk.Tk):
         instructions = Tk.Label(self.newFrame, text="Select Your Template")
         templatePath = tkFileDialog.askopenfilename(filetypes=[("WIZ Template", ".wizt")])
         try:
-            with open(templatePath, 'r') as f:
-                chain = pickle.load(f)
-        except (ValueError, IOError):
+            chain = TemplateFile.load(templatePath)
+        except TemplateFile.TemplateError as e:
+            print "Couldn't load template: %s" % str(e)
             self.error.pack()
             return
         instructions.pack_forget()
@@ -278,16 +334,28 @@ class InitialWindow(Tk.Tk):
     def applyTemplate(self, expChain, data):
         win = MainWindow()
         from Graph import Graph
-        expChain.addVariable('ORIGINAL', Graph(window=win, rawXData=data[0], rawYData=data[1]))
+        original = Graph(window=win, rawXData=data[0], rawYData=data[1])
+        original.setLazy(self.settings["Lazy Evaluation"])
+        expChain.addVariable('ORIGINAL', original)
         import Graph
         expChain.modules = (Graph, np, math)
+        expChain.blockFunc = Graph.Graph.evaluateBlockwise
+        expChain.cache.setDirectory(self.settings["Template Cache Directory"])
+        expChain.cache.maxBytes = int(self.settings["Template Memory Cache Size"] * 2 ** 20)
         progress = ttk.Progressbar(win, length=self.defaultWidth, mode="determinate", maximum=len(expChain))
         progress.pack()
         info = Tk.Label(win, text="Loading...")
         info.pack()
-        for gr, name in expChain:
-            gr.setTitle(name)
+        results = iter(expChain)
+        for index in range(len(expChain)):
+            try:
+                gr, name = results.next()
+            except Exception as e:  # Raised here, on the Tk thread, rather than in the worker that evaluated it
+                tkMessageBox.showerror("Template", "Couldn't evaluate %s.\n%s" % (expChain.formulae[index][1], str(e)))
+                break
             try:
+                gr.setTitle(name)
+                gr.window = win  # Memoized results may come from another window, or from disk
                 win.addGraph(gr)
             except AttributeError:
                 pass  # Non-Graph object
@@ -301,5 +369,6 @@ class InitialWindow(Tk.Tk):
         win.mainloop()
 
 if __name__ == "__main__":
+    freeze_support()  # Lets the worker processes of a frozen executable parse files rather than start WIZ again
     initial = InitialWindow()
     initial.mainloop()